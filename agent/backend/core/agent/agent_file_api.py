@@ -3,11 +3,13 @@
 """
 
 import sys
+import base64
+import codecs
 import mimetypes
 import os
 import shutil
 import subprocess
-import hashlib
+import itertools
 import re
 import json
 import tempfile
@@ -17,15 +19,18 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Body, File, UploadFile, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Body, File, UploadFile, Query, Request, Response
 from fastapi.responses import FileResponse, HTMLResponse
 from starlette.background import BackgroundTask
 
-from .agent_manager import get_agent_work_dir, get_user_work_base_dir
+from .agent_manager import get_agent_work_dir
+from .thumbnail import THUMBNAIL_SOURCE_EXTENSIONS, get_thumbnail, is_thumbnail_available, normalize_width
 from ..auth.auth_filter import get_current_user_id
 from ..auth.auth_utils import verify_token
+from ..cache.preview_cache import preview_cache
 from ..db.dbutil import DatabaseUtil
 from ..system import config
+from ..system.http_cache import build_cache_headers, conditional_file_response, is_not_modified, not_modified_response
 from ..firewall.firewall_bash import check_user_storage_quota
 
 router = APIRouter(prefix="/api/v1/chat", tags=["agent_files"])
@@ -36,6 +41,10 @@ db = DatabaseUtil()
 OFFICE_EXTENSIONS = config.OFFICE_EXTENSIONS
 _LIBREOFFICE_CACHE: Dict[str, str] = {}
 
+# read_file 分段读取上限：单次字节切片 / 单次行窗口
+READ_FILE_MAX_SLICE_BYTES = 4 * 1024 * 1024
+READ_FILE_MAX_LINES = 5000
+
 def _get_session_workdir(session_id: str, user_id: str) -> Dict[str, Any]:
     """获取单聊会话工作目录"""
     session_row = db.execute_query(
@@ -125,18 +134,12 @@ def _find_libreoffice_cmd() -> Optional[str]:
     _LIBREOFFICE_CACHE["cmd"] = ""
     return None
 
-def _cache_pdf_path(target: Path, cache_root: Path) -> Path:
-    stat_res = target.stat()
-    signature = f"{target.as_posix()}|{stat_res.st_mtime}|{stat_res.st_size}"
-    hash_key = hashlib.sha1(signature.encode("utf-8")).hexdigest()
-    cache_dir = cache_root / hash_key
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    return cache_dir / f"{target.stem}.pdf"
-
-def _convert_office_to_pdf(target: Path, cache_root: Path) -> Path:
-    pdf_path = _cache_pdf_path(target, cache_root)
-    if pdf_path.exists():
-        return pdf_path
+def _convert_office_to_pdf(target: Path, user_id: str) -> Path:
+    pdf_name = f"{target.stem}.pdf"
+    cached = preview_cache.lookup(user_id, target, "pdf", pdf_name)
+    if cached:
+        return cached
+    pdf_path = preview_cache.reserve(user_id, target, "pdf", pdf_name)
 
     cmd = _find_libreoffice_cmd()
     if not cmd:
@@ -170,6 +173,7 @@ def _convert_office_to_pdf(target: Path, cache_root: Path) -> Path:
 
     if not pdf_path.exists():
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="转换失败，未生成PDF")
+    preview_cache.commit(user_id, target, "pdf", pdf_path)
     return pdf_path
 
 def _get_archive_root(work_dir: Path) -> Path:
@@ -196,7 +200,7 @@ def _copy_tree(src: Path, dst: Path) -> None:
     if not dst.exists():
         dst.mkdir(parents=True, exist_ok=True)
     for item in src.iterdir():
-        if item.name in {".preview_cache"}:
+        if item.name in {config.PREVIEW_CACHE_DIR}:
             continue
         target = dst / item.name
         if item.is_dir():
@@ -347,10 +351,19 @@ async def read_file(
     session_id: str,
     path: str,
     user_id: str,
+    request: Request,
+    response: Response,
+    offset: Optional[int] = Query(None, ge=0, description="按字节读取：起始偏移"),
+    length: Optional[int] = Query(None, ge=1, description="按字节读取：读取长度"),
+    start_line: Optional[int] = Query(None, ge=1, description="按行读取：起始行号（从1开始）"),
+    max_lines: Optional[int] = Query(None, ge=1, description="按行读取：最多返回行数"),
         current_user_id: str = Depends(get_current_user_id),
 ):
     """
     读取指定会话工作目录下的文件内容
+
+    默认返回完整内容；传入 offset/length 时按字节切片读取，传入 start_line/max_lines 时按行窗口读取。
+    响应带 ETag / Last-Modified，客户端携带 If-None-Match / If-Modified-Since 且文件未变化时返回 304。
     """
     if current_user_id != user_id:
         raise HTTPException(
@@ -377,24 +390,98 @@ async def read_file(
             detail="文件不存在",
         )
 
-    data = target.read_bytes()
-    is_binary = False
-    try:
-        content = data.decode("utf-8")
-    except UnicodeDecodeError:
-        content = data.decode("utf-8", errors="replace")
-        is_binary = True
+    if (offset is not None or length is not None) and (start_line is not None or max_lines is not None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="字节读取与按行读取不能同时使用",
+        )
 
     stat_res = target.stat()
-    return {
+    # 不同读取窗口对应不同的响应内容，ETag 需要区分
+    variant = ""
+    if offset is not None or length is not None:
+        variant = f"b{offset or 0}:{length or ''}"
+    elif start_line is not None or max_lines is not None:
+        variant = f"l{start_line or 1}:{max_lines or ''}"
+
+    if is_not_modified(request, stat_res, variant):
+        return not_modified_response(stat_res, variant)
+    response.headers.update(build_cache_headers(stat_res, variant))
+
+    result: Dict[str, Any] = {
         "success": True,
         "path": path,
-        "is_binary": is_binary,
-        "content": content,
         "size": stat_res.st_size,
         "modified_at": datetime.fromtimestamp(stat_res.st_mtime).isoformat(),
     }
 
+    if offset is not None or length is not None:
+        start = offset or 0
+        read_len = min(length or READ_FILE_MAX_SLICE_BYTES, READ_FILE_MAX_SLICE_BYTES)
+        with target.open("rb") as f:
+            f.seek(start)
+            data = f.read(read_len)
+        # 文本按 UTF-8 字符边界对齐：跳过开头的续字节，结尾不完整的字符留给下一段
+        skip = 0
+        while skip < min(3, len(data)) and (data[skip] & 0xC0) == 0x80:
+            skip += 1
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            content = decoder.decode(data[skip:], final=start + len(data) >= stat_res.st_size)
+        except UnicodeDecodeError:
+            # 二进制内容原样以 base64 返回，不做替换
+            result.update({
+                "offset": start,
+                "length": len(data),
+                "has_more": start + len(data) < stat_res.st_size,
+                "is_binary": True,
+                "encoding": "base64",
+                "content": base64.b64encode(data).decode("ascii"),
+            })
+            return result
+        slice_start = start + skip
+        slice_len = len(data) - skip - len(decoder.getstate()[0])
+        result.update({
+            "offset": slice_start,
+            "length": slice_len,
+            "has_more": slice_start + slice_len < stat_res.st_size,
+            "is_binary": False,
+            "content": content,
+        })
+        return result
+    elif start_line is not None or max_lines is not None:
+        first = start_line or 1
+        limit = min(max_lines or READ_FILE_MAX_LINES, READ_FILE_MAX_LINES)
+        lines: List[str] = []
+        has_more = False
+        with target.open("r", encoding="utf-8", errors="replace", newline="") as f:
+            for line in itertools.islice(f, first - 1, None):
+                if len(lines) >= limit:
+                    has_more = True
+                    break
+                lines.append(line)
+        result.update({
+            "is_binary": False,
+            "content": "".join(lines),
+            "start_line": first,
+            "line_count": len(lines),
+            "has_more": has_more,
+        })
+        return result
+    else:
+        data = target.read_bytes()
+
+    is_binary = False
+    try:
+        content = data.decode("utf-8")
+    except UnicodeDecodeError:
+        content = data.decode("utf-8", errors="replace")
+        is_binary = True
+
+    result["is_binary"] = is_binary
+    result["content"] = content
+    return result
+
 
 @router.post("/sessions/{session_id}/files")
 async def write_file(
@@ -593,6 +680,7 @@ async def download_file(
     session_id: str,
     user_id: str,
     path: str,
+    request: Request,
         current_user_id: str = Depends(get_current_user_id),
 ):
     """
@@ -649,12 +737,7 @@ async def download_file(
         "Content-Disposition": f"inline; filename*=UTF-8''{safe_name}"
     }
 
-    return FileResponse(
-        path=str(target),
-        media_type=media_type,
-        filename=None,
-        headers=headers,
-    )
+    return conditional_file_response(request, target, media_type=media_type, headers=headers)
 
 
 @router.post("/sessions/{session_id}/upload")
@@ -795,6 +878,7 @@ async def preview_file(
     session_id: str,
     user_id: str,
     path: str,
+    request: Request,
         current_user_id: str = Depends(get_current_user_id),
 ):
     """
@@ -818,16 +902,15 @@ async def preview_file(
 
     suffix = target.suffix.lower()
     if suffix in OFFICE_EXTENSIONS:
-        cache_root = get_user_work_base_dir(user_id) / ".preview_cache"
-        pdf_path = _convert_office_to_pdf(target, cache_root)
+        pdf_path = _convert_office_to_pdf(target, user_id)
         safe_name = quote(f"{target.stem}.pdf")
         headers = {"Content-Disposition": f"inline; filename*=UTF-8''{safe_name}"}
-        return FileResponse(path=str(pdf_path), media_type="application/pdf", filename=None, headers=headers)
+        return conditional_file_response(request, pdf_path, media_type="application/pdf", headers=headers)
 
     if suffix == ".pdf":
         safe_name = quote(target.name)
         headers = {"Content-Disposition": f"inline; filename*=UTF-8''{safe_name}"}
-        return FileResponse(path=str(target), media_type="application/pdf", filename=None, headers=headers)
+        return conditional_file_response(request, target, media_type="application/pdf", headers=headers)
 
     raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST,
@@ -909,6 +992,7 @@ async def preview_asset(
     session_id: str,
     token: str,
     asset_path: str,
+    request: Request,
 ):
     """
     预览HTML资源文件（通过token鉴权）。
@@ -926,4 +1010,50 @@ async def preview_asset(
 
     media_type, _ = mimetypes.guess_type(target.name)
     media_type = media_type or "application/octet-stream"
-    return FileResponse(path=str(target), media_type=media_type, filename=None)
+    return conditional_file_response(request, target, media_type=media_type)
+
+
+@router.get("/sessions/{session_id}/thumbnail")
+async def preview_thumbnail(
+    session_id: str,
+    path: str,
+    token: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, description="缩略图宽度（像素）"),
+    fmt: Optional[str] = Query(None, description="输出格式：webp / jpeg，默认按 Accept 协商"),
+):
+    """
+    图片缩略图（通过token鉴权），供聊天预览卡片和文件面板使用。
+    不支持的格式（如 SVG）或服务端未安装 Pillow 时直接返回原图。
+    """
+    user_id = _get_user_id_from_token(token)
+    session_info = _resolve_context(session_id, user_id)
+    work_dir = session_info["work_dir"]
+    target = _resolve_path(work_dir, path)
+
+    if not target.exists() or not target.is_file():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="文件不存在",
+        )
+
+    media_type, _ = mimetypes.guess_type(target.name)
+    media_type = media_type or "application/octet-stream"
+    if target.suffix.lower() not in THUMBNAIL_SOURCE_EXTENSIONS or not is_thumbnail_available():
+        return conditional_file_response(request, target, media_type=media_type)
+
+    if fmt not in ("webp", "jpeg"):
+        fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+
+    try:
+        thumb_path = await get_thumbnail(user_id, target, normalize_width(w), fmt)
+    except Exception as exc:
+        print(f"生成缩略图失败 {target}: {exc}", file=sys.stderr)
+        return conditional_file_response(request, target, media_type=media_type)
+
+    return conditional_file_response(
+        request,
+        thumb_path,
+        media_type=f"image/{fmt}",
+        headers={"Vary": "Accept"},
+    )
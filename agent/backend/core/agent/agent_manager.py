@@ -17,7 +17,7 @@ import psycopg2.extras
 from datetime import datetime
 from ..db.dbutil import DatabaseUtil
 from ..mcp import get_mcp_allowed_tools, get_all_mcp_servers
-from ..membership.pub_key_api import get_api_key_for_membership
+from ..membership.pub_key_api import api_key_router
 from ..membership.sub_api import get_user_membership_info
 from ..firewall.firewall_bash import (
     build_tool_permission_handler,
@@ -130,7 +130,7 @@ class AgentManager:
             try:
                 membership_info = get_user_membership_info(owner_id) if owner_id else None
                 membership_level = (membership_info or {}).get("membership_level") or "no"
-                api_key = get_api_key_for_membership(membership_level)
+                api_key = api_key_router.acquire(agent_id, membership_level)
                 if api_key:
                     env_overrides = {
                         "ANTHROPIC_AUTH_TOKEN": api_key["auth_token"],
@@ -170,6 +170,7 @@ class AgentManager:
             return True
 
         except Exception as e:
+            api_key_router.release(agent_id)
             print(f"❌ 创建智能体客户端失败 {agent_name}: {str(e)}", file=sys.stderr)
             return False
 
@@ -266,6 +267,7 @@ class AgentManager:
                     del self._client_connected[agent_id]
                 if agent_id in self._agent_last_active:
                     del self._agent_last_active[agent_id]
+                api_key_router.release(agent_id)
 
                 logger.info("成功关闭智能体客户端: %s", agent_id)
                 return True
@@ -1,21 +1,33 @@
 """
 Agent local service proxy.
 Maps /agent/<username>-<port> to http://127.0.0.1:<port>.
+WebSocket upgrades on the same path are tunneled to ws://127.0.0.1:<port>.
 Static HTML file serving: /html-page/<user_id>/<filename>.html
 """
 
 from __future__ import annotations
 
-from typing import Optional
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
 import re
+import stat
+import time
+from collections import OrderedDict
 from pathlib import Path
 
 import httpx
-from fastapi import APIRouter, HTTPException, Request, Response
+import websockets
+from fastapi import APIRouter, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
+from ..system import config
 from ..system.config import get_agent_work_dir
+from ..system.http_cache import build_cache_headers, conditional_file_response, is_not_modified, not_modified_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # 安全验证：filename 只允许字母、数字、中文、下划线、连字符和点
 SAFE_FILENAME_PATTERN = re.compile(r'^[\w\u4e00-\u9fff.\-]+$')
@@ -57,19 +69,163 @@ def _extract_port(slug: str) -> Optional[int]:
     return port if 1 <= port <= 65535 else None
 
 
+# 逐跳头（hop-by-hop），不能透传给上下游
+HOP_BY_HOP_HEADERS = {
+    "transfer-encoding",
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "upgrade",
+}
+
+# 进程级共享连接池（到 127.0.0.1:<port> 的 keep-alive 连接复用）
+_proxy_client: Optional[httpx.AsyncClient] = None
+
+# 按用户限制并发代理请求数；引用计数（持有 + 排队的请求数）归零时删除，避免长期残留
+_user_semaphores: Dict[str, asyncio.Semaphore] = {}
+_user_semaphore_refs: Dict[str, int] = {}
+
+
 def _filter_headers(headers: dict) -> dict:
-    excluded = {
-        "content-encoding",
-        "transfer-encoding",
-        "connection",
-        "keep-alive",
-        "proxy-authenticate",
-        "proxy-authorization",
-        "te",
-        "trailers",
-        "upgrade",
-    }
-    return {k: v for k, v in headers.items() if k.lower() not in excluded}
+    # 请求/响应体均按原始字节透传，content-encoding 需保留
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+
+def _get_proxy_client() -> httpx.AsyncClient:
+    global _proxy_client
+    if _proxy_client is None or _proxy_client.is_closed:
+        _proxy_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=config.AGENT_PROXY_CONNECT_TIMEOUT,
+                read=config.AGENT_PROXY_READ_TIMEOUT,
+                write=config.AGENT_PROXY_READ_TIMEOUT,
+                pool=config.AGENT_PROXY_QUEUE_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=config.AGENT_PROXY_MAX_CONNECTIONS,
+                max_keepalive_connections=config.AGENT_PROXY_MAX_KEEPALIVE,
+                keepalive_expiry=30,
+            ),
+            trust_env=False,
+        )
+    return _proxy_client
+
+
+async def close_proxy_client() -> None:
+    """关闭共享代理连接池（应用关闭时调用）"""
+    global _proxy_client
+    if _proxy_client is not None:
+        await _proxy_client.aclose()
+        _proxy_client = None
+
+
+# 端口 -> (owner_user_id, port_start, port_end, 缓存时间)，端口段分配后基本不变；按 LRU 限制条目数
+_port_owner_cache: "OrderedDict[int, Tuple[Optional[str], int, int, float]]" = OrderedDict()
+_PORT_OWNER_CACHE_TTL = 300
+_PORT_OWNER_CACHE_MAX = 8192
+
+# 共享数据库工具（首次使用时创建）
+_db = None
+
+# 每个用户（端口段）当前的 WebSocket 隧道数
+_ws_connections: Dict[str, int] = {}
+
+# 不透传给上游 WebSocket 握手的请求头（由 websockets 客户端自行生成）
+WS_EXCLUDED_HEADERS = HOP_BY_HOP_HEADERS | {
+    "host",
+    "content-length",
+    "sec-websocket-key",
+    "sec-websocket-version",
+    "sec-websocket-extensions",
+    "sec-websocket-protocol",
+}
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        from ..db.dbutil import DatabaseUtil
+        _db = DatabaseUtil()
+    return _db
+
+
+def _cache_put(cache: OrderedDict, key, value, max_entries: int) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+
+
+def _query_port_owner(port: int) -> Optional[Tuple[str, int, int]]:
+    row = _get_db().execute_query(
+        "SELECT user_id, port_start, port_end FROM user_set WHERE port_start <= %s AND port_end >= %s LIMIT 1",
+        (port, port),
+        fetch="one",
+    )
+    if not row:
+        return None
+    return row["user_id"], int(row["port_start"]), int(row["port_end"])
+
+
+async def _resolve_port_owner(port: int) -> Optional[str]:
+    """根据 user_set 端口段解析端口所属用户（带缓存），未分配的端口返回 None"""
+    cached = _port_owner_cache.get(port)
+    now = time.monotonic()
+    if cached and now - cached[3] < _PORT_OWNER_CACHE_TTL:
+        _port_owner_cache.move_to_end(port)
+        return cached[0]
+
+    try:
+        owner = await asyncio.to_thread(_query_port_owner, port)
+    except Exception as e:
+        logger.warning(f"[agent-proxy] 端口归属查询失败 port={port}: {e}")
+        return cached[0] if cached else None
+
+    if owner:
+        user_id, port_start, port_end = owner
+        # 同一端口段内的端口一起缓存
+        for p in range(port_start, port_end + 1):
+            _cache_put(_port_owner_cache, p, (user_id, port_start, port_end, now), _PORT_OWNER_CACHE_MAX)
+        return user_id
+    _cache_put(_port_owner_cache, port, (None, port, port, now), _PORT_OWNER_CACHE_MAX)
+    return None
+
+
+async def _get_user_key(slug: str, port: int) -> str:
+    # 优先按 user_set 端口段归属限流；未分配端口段的端口退回按 slug 中的用户名
+    owner_id = await _resolve_port_owner(port)
+    if owner_id:
+        return owner_id
+    if "-" in slug:
+        return slug.rsplit("-", 1)[0]
+    return str(port)
+
+
+def _get_user_semaphore(user_key: str) -> asyncio.Semaphore:
+    """获取用户的并发信号量（引用计数 +1，用完须调用 _put_user_semaphore）"""
+    semaphore = _user_semaphores.get(user_key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(config.AGENT_PROXY_USER_CONCURRENCY)
+        _user_semaphores[user_key] = semaphore
+    _user_semaphore_refs[user_key] = _user_semaphore_refs.get(user_key, 0) + 1
+    return semaphore
+
+
+def _put_user_semaphore(user_key: str) -> None:
+    refs = _user_semaphore_refs.get(user_key, 1) - 1
+    if refs > 0:
+        _user_semaphore_refs[user_key] = refs
+    else:
+        _user_semaphore_refs.pop(user_key, None)
+        _user_semaphores.pop(user_key, None)
+
+
+def _release_user_slot(user_key: str, semaphore: asyncio.Semaphore) -> None:
+    semaphore.release()
+    _put_user_semaphore(user_key)
 
 
 @router.api_route("/agent/{slug}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
@@ -88,27 +244,236 @@ async def proxy_agent_service(slug: str, path: str = "", request: Request = None
     headers = _filter_headers(dict(request.headers))
     headers.pop("host", None)
 
+    user_key = await _get_user_key(slug, port)
+    semaphore = _get_user_semaphore(user_key)
     try:
-        async with httpx.AsyncClient(timeout=None) as client:
-            resp = await client.request(
-                request.method,
-                target_url,
-                headers=headers,
-                content=await request.body(),
-                follow_redirects=False,
-            )
+        await asyncio.wait_for(semaphore.acquire(), timeout=config.AGENT_PROXY_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _put_user_semaphore(user_key)
+        raise HTTPException(status_code=429, detail="too many concurrent requests")
+    except BaseException:
+        _put_user_semaphore(user_key)
+        raise
+
+    # 请求体流式转发：只有声明了请求体时才读取
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    client = _get_proxy_client()
+    try:
+        upstream_request = client.build_request(
+            request.method,
+            target_url,
+            headers=headers,
+            content=request.stream() if has_body else None,
+        )
+        resp = await client.send(upstream_request, stream=True, follow_redirects=False)
+    except httpx.TimeoutException:
+        _release_user_slot(user_key, semaphore)
+        raise HTTPException(status_code=504, detail="upstream service timeout")
     except httpx.RequestError:
+        _release_user_slot(user_key, semaphore)
         raise HTTPException(status_code=502, detail="upstream service unavailable")
+    except BaseException:
+        _release_user_slot(user_key, semaphore)
+        raise
 
-    return Response(
-        content=resp.content,
+    released = False
+
+    async def _close_upstream() -> None:
+        # 正常结束走 background，客户端中途断开走生成器 finally，两处都可能触发
+        nonlocal released
+        if released:
+            return
+        released = True
+        try:
+            await resp.aclose()
+        finally:
+            _release_user_slot(user_key, semaphore)
+
+    async def _stream_body():
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        finally:
+            await _close_upstream()
+
+    # 响应体按原始字节流式返回（保留 content-encoding，不在代理侧解压）
+    response_headers = _filter_headers(dict(resp.headers))
+    if resp.headers.get("content-type", "").startswith("text/event-stream"):
+        # SSE：禁止前置 nginx 缓冲，保证事件逐条到达
+        response_headers["X-Accel-Buffering"] = "no"
+        response_headers.setdefault("Cache-Control", "no-cache")
+    return StreamingResponse(
+        _stream_body(),
         status_code=resp.status_code,
-        headers=_filter_headers(dict(resp.headers)),
+        headers=response_headers,
+        background=BackgroundTask(_close_upstream),
+    )
+
+
+@router.websocket("/agent/{slug}")
+@router.websocket("/agent/{slug}/{path:path}")
+async def proxy_agent_websocket(websocket: WebSocket, slug: str, path: str = "") -> None:
+    """WebSocket 隧道：双向转发客户端与 ws://127.0.0.1:<port> 的消息，空闲超时后断开"""
+    port = _extract_port(slug)
+    if not port:
+        await websocket.close(code=1008)
+        return
+
+    user_key = await _get_user_key(slug, port)
+    if _ws_connections.get(user_key, 0) >= config.AGENT_PROXY_WS_MAX_PER_USER:
+        await websocket.close(code=1013)
+        return
+
+    target_url = f"ws://127.0.0.1:{port}"
+    if path:
+        target_url = f"{target_url}/{path}"
+    if websocket.url.query:
+        target_url = f"{target_url}?{websocket.url.query}"
+
+    headers = [(k, v) for k, v in websocket.headers.items() if k.lower() not in WS_EXCLUDED_HEADERS]
+    subprotocols = websocket.scope.get("subprotocols") or None
+
+    _ws_connections[user_key] = _ws_connections.get(user_key, 0) + 1
+    try:
+        try:
+            upstream = await websockets.connect(
+                target_url,
+                extra_headers=headers,
+                subprotocols=subprotocols,
+                open_timeout=config.AGENT_PROXY_CONNECT_TIMEOUT,
+                max_size=None,
+            )
+        except Exception as e:
+            logger.info(f"[agent-proxy] WebSocket 上游连接失败 {target_url}: {e}")
+            await websocket.close(code=1011)
+            return
+
+        await websocket.accept(subprotocol=upstream.subprotocol)
+        last_active = time.monotonic()
+
+        async def _client_to_upstream() -> None:
+            nonlocal last_active
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                last_active = time.monotonic()
+                if message.get("text") is not None:
+                    await upstream.send(message["text"])
+                elif message.get("bytes") is not None:
+                    await upstream.send(message["bytes"])
+
+        async def _upstream_to_client() -> None:
+            nonlocal last_active
+            async for message in upstream:
+                last_active = time.monotonic()
+                if isinstance(message, str):
+                    await websocket.send_text(message)
+                else:
+                    await websocket.send_bytes(message)
+
+        async def _idle_watchdog() -> None:
+            idle_timeout = config.AGENT_PROXY_WS_IDLE_TIMEOUT
+            while True:
+                remaining = idle_timeout - (time.monotonic() - last_active)
+                if remaining <= 0:
+                    return
+                await asyncio.sleep(remaining)
+
+        tasks = [
+            asyncio.create_task(_client_to_upstream()),
+            asyncio.create_task(_upstream_to_client()),
+            asyncio.create_task(_idle_watchdog()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await upstream.close()
+            try:
+                await websocket.close()
+            except (RuntimeError, WebSocketDisconnect):
+                pass
+    finally:
+        remaining_count = _ws_connections.get(user_key, 1) - 1
+        if remaining_count > 0:
+            _ws_connections[user_key] = remaining_count
+        else:
+            _ws_connections.pop(user_key, None)
+
+
+# agent_id -> (工作目录, 缓存时间)；智能体不存在时缓存 None，防止被刷库；按 LRU 限制条目数
+_agent_workdir_cache: "OrderedDict[str, Tuple[Optional[Path], float]]" = OrderedDict()
+_AGENT_NOT_FOUND_CACHE_TTL = 30
+_AGENT_WORKDIR_CACHE_MAX = 10000
+
+# 小文件内存缓存：路径 -> (mtime_ns, size, 内容)，按 LRU 淘汰
+_hot_files: "OrderedDict[str, Tuple[int, int, bytes]]" = OrderedDict()
+_hot_files_bytes = 0
+
+
+def _query_agent_owner(agent_id: str) -> Optional[str]:
+    row = _get_db().execute_query(
+        "SELECT owner_id FROM users WHERE id = %s AND user_type = 'ai'",
+        (agent_id,),
+        fetch="one",
     )
+    return row.get("owner_id") if row else None
+
+
+async def _resolve_agent_work_dir(agent_id: str) -> Path:
+    """解析智能体的工作目录（带缓存），智能体不存在时抛出 404"""
+    now = time.monotonic()
+    cached = _agent_workdir_cache.get(agent_id)
+    if cached:
+        work_dir, cached_at = cached
+        ttl = config.HTML_PAGE_OWNER_CACHE_TTL if work_dir else _AGENT_NOT_FOUND_CACHE_TTL
+        if now - cached_at < ttl:
+            _agent_workdir_cache.move_to_end(agent_id)
+            if work_dir is None:
+                raise HTTPException(status_code=404, detail=f"agent not found: {agent_id}")
+            return work_dir
+
+    try:
+        owner_id = await asyncio.to_thread(_query_agent_owner, agent_id)
+    except Exception as e:
+        logger.error(f"[html-page] error: {e}")
+        raise HTTPException(status_code=500, detail=f"error: {str(e)}")
+
+    if not owner_id:
+        _cache_put(_agent_workdir_cache, agent_id, (None, now), _AGENT_WORKDIR_CACHE_MAX)
+        raise HTTPException(status_code=404, detail=f"agent not found: {agent_id}")
+
+    work_dir = Path(get_agent_work_dir(owner_id, agent_id)).resolve()
+    _cache_put(_agent_workdir_cache, agent_id, (work_dir, now), _AGENT_WORKDIR_CACHE_MAX)
+    return work_dir
+
+
+def _read_hot_file(path: Path, stat_res) -> bytes:
+    """读取小文件，mtime/size 未变化时直接命中内存缓存"""
+    global _hot_files_bytes
+    key = str(path)
+    cached = _hot_files.get(key)
+    if cached and cached[0] == stat_res.st_mtime_ns and cached[1] == stat_res.st_size:
+        _hot_files.move_to_end(key)
+        return cached[2]
+
+    content = path.read_bytes()
+    if cached:
+        _hot_files_bytes -= len(cached[2])
+    _hot_files[key] = (stat_res.st_mtime_ns, stat_res.st_size, content)
+    _hot_files.move_to_end(key)
+    _hot_files_bytes += len(content)
+    while _hot_files_bytes > config.HTML_PAGE_HOT_CACHE_MAX_BYTES and _hot_files:
+        _, (_, _, evicted) = _hot_files.popitem(last=False)
+        _hot_files_bytes -= len(evicted)
+    return content
 
 
 @router.get("/html-page/{agent_id}/{file_path:path}")
-async def serve_static_html(agent_id: str, file_path: str):
+async def serve_static_html(agent_id: str, file_path: str, request: Request):
     """
     安全地提供 agent 工作目录中的静态 HTML 文件
     路径格式：/html-page/{agent_id}/{filename}
@@ -136,59 +501,41 @@ async def serve_static_html(agent_id: str, file_path: str):
     if not parts or any(not SAFE_FILENAME_PATTERN.match(p) for p in parts):
         raise HTTPException(status_code=400, detail="invalid filename format")
 
-    # 通过 agent_id 获取工作目录
-    from ..system.config import get_agent_work_dir
-    from ..db.dbutil import DatabaseUtil
-    import psycopg2.extras
-    import logging
-
-    logger = logging.getLogger(__name__)
-    db = DatabaseUtil()
-    conn = db.get_connection()
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    # 通过 agent_id 获取工作目录（带缓存，热点页面不再访问数据库）
+    work_dir = await _resolve_agent_work_dir(agent_id)
+    target = work_dir / file_path
 
+    # 安全检查：确保文件在工作目录内
     try:
-        cursor.execute('''
-            SELECT owner_id FROM users WHERE id = %s AND user_type = 'ai'
-        ''', (agent_id,))
-        agent_info = cursor.fetchone()
-        conn.close()
-
-        logger.debug(f"[html-page] agent_id={agent_id}, agent_info={agent_info}")
-
-        if not agent_info:
-            raise HTTPException(status_code=404, detail=f"agent not found: {agent_id}")
-
-        owner_id = agent_info.get("owner_id")
-        if not owner_id:
-            raise HTTPException(status_code=404, detail=f"agent has no owner_id: {agent_id}")
-
-        work_dir = get_agent_work_dir(owner_id, agent_id)
-        file_path = Path(work_dir) / file_path
+        target.resolve().relative_to(work_dir)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="access denied")
 
-        logger.debug(f"[html-page] work_dir={work_dir}, file_path={file_path}, exists={file_path.exists()}")
-
-        # 安全检查：确保文件在工作目录内
-        if not str(file_path.resolve()).startswith(str(Path(work_dir).resolve())):
-            raise HTTPException(status_code=403, detail="access denied")
-
-        if not file_path.exists() or not file_path.is_file():
-            raise HTTPException(status_code=404, detail=f"file not found: {file_path}")
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        if conn:
-            conn.close()
-        logger.error(f"[html-page] error: {e}")
-        raise HTTPException(status_code=500, detail=f"error: {str(e)}")
-
-    # 读取并返回文件内容
     try:
-        content = file_path.read_bytes()
+        stat_res = target.stat()
+    except OSError:
+        raise HTTPException(status_code=404, detail=f"file not found: {file_path}")
+    if not stat.S_ISREG(stat_res.st_mode):
+        raise HTTPException(status_code=404, detail=f"file not found: {file_path}")
+
+    media_type = CONTENT_TYPE_BY_EXT.get(ext, "application/octet-stream")
+    cache_control = config.HTML_PAGE_CACHE_CONTROL
+    if is_not_modified(request, stat_res):
+        return not_modified_response(stat_res, cache_control=cache_control)
+
+    # 小文件走内存缓存，大文件交给 FileResponse（sendfile + Range）
+    if stat_res.st_size <= config.HTML_PAGE_HOT_FILE_MAX_BYTES and "range" not in request.headers:
+        try:
+            content = _read_hot_file(target, stat_res)
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=f"error reading file: {str(e)}")
         return Response(
             content=content,
-            media_type=CONTENT_TYPE_BY_EXT.get(ext, "application/octet-stream")
+            media_type=media_type,
+            headers=build_cache_headers(stat_res, cache_control=cache_control),
         )
+
+    try:
+        return conditional_file_response(request, target, media_type=media_type, cache_control=cache_control)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"error reading file: {str(e)}")
@@ -0,0 +1,99 @@
+"""
+工作区图片缩略图
+按需生成缩小尺寸的 WebP/JPEG 派生图，在线程池中执行，结果存入预览缓存（按源文件签名 + 尺寸 + 格式区分）。
+"""
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from ..cache.preview_cache import preview_cache
+from ..system import config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未安装时缩略图功能不可用，调用方回退到原图
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# 支持生成缩略图的位图格式（SVG 为矢量图，直接返回原图）
+THUMBNAIL_SOURCE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp"}
+
+# 缩略图宽度按该步长取整，避免任意宽度产生过多缓存变体
+_WIDTH_STEP = 160
+_MIN_WIDTH = 160
+
+_executor = ThreadPoolExecutor(max_workers=max(1, config.THUMBNAIL_WORKERS), thread_name_prefix="thumbnail")
+
+
+def is_thumbnail_available() -> bool:
+    """Pillow 是否可用"""
+    return Image is not None
+
+
+def normalize_width(width: Optional[int]) -> int:
+    """规范化缩略图宽度：按步长向上取整，并限制在 [最小宽度, 最大宽度] 内"""
+    width = width or config.THUMBNAIL_DEFAULT_WIDTH
+    width = ((width + _WIDTH_STEP - 1) // _WIDTH_STEP) * _WIDTH_STEP
+    return max(_MIN_WIDTH, min(width, config.THUMBNAIL_MAX_WIDTH))
+
+
+def _render_thumbnail(source: Path, output: Path, width: int, fmt: str) -> None:
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            img = img.resize((width, height), Image.LANCZOS)
+
+        if fmt == "jpeg":
+            if img.mode in ("RGBA", "LA", "P"):
+                rgba = img.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.split()[-1])
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            save_kwargs = {"quality": config.THUMBNAIL_QUALITY, "optimize": True, "progressive": True}
+        else:
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            save_kwargs = {"quality": config.THUMBNAIL_QUALITY, "method": 4}
+
+        # 先写临时文件再替换，避免并发请求读到写了一半的文件（临时文件名每次唯一，并发渲染互不干扰）
+        tmp_path = output.with_name(f"{output.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            img.save(tmp_path, format=fmt.upper(), **save_kwargs)
+            os.replace(tmp_path, output)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+async def get_thumbnail(user_id: str, source: Path, width: int, fmt: str) -> Path:
+    """
+    获取缩略图（命中缓存直接返回，否则在线程池中生成）
+
+    Args:
+        user_id: 用户ID（缓存归属）
+        source: 源图片路径
+        width: 规范化后的目标宽度
+        fmt: 输出格式 webp / jpeg
+
+    Returns:
+        缩略图文件路径
+    """
+    variant = f"{width}.{fmt}"
+    filename = f"{source.stem}_{width}.{'jpg' if fmt == 'jpeg' else fmt}"
+    cached = preview_cache.lookup(user_id, source, "thumb", filename, variant)
+    if cached:
+        return cached
+
+    output = preview_cache.reserve(user_id, source, "thumb", filename, variant)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _render_thumbnail, source, output, width, fmt)
+    preview_cache.commit(user_id, source, "thumb", output, variant)
+    return output
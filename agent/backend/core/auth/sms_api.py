@@ -13,6 +13,7 @@ from typing import Optional, Dict
 from ..db.dbutil import DatabaseUtil
 from ..system import config
 from ..cache.redis_cache import check_sms_verify_lock, increment_sms_verify_fail, clear_sms_verify_fail
+from ..cache import rate_limiter
 
 # ==================== 配置（从 config.py 导入） ====================
 # 使用 config.py 中的配置
@@ -98,7 +99,7 @@ class SMSRepository:
         return True
 
     def check_rate_limit(self, phone: str, client_ip: str = None) -> bool:
-        """检查速率限制（查询过去24小时内的记录数量）"""
+        """检查速率限制（查询过去24小时内的记录数量，仅在 Redis 不可用时使用）"""
         window_start = datetime.utcnow() - timedelta(hours=SMS_RATE_LIMIT_WINDOW_HOURS)
 
         # 检查手机号限制
@@ -123,7 +124,7 @@ class SMSRepository:
         return True
 
     def check_cooldown(self, phone: str, client_ip: str = None) -> bool:
-        """检查冷却时间（查询最后发送时间）"""
+        """检查冷却时间（查询最后发送时间，仅在 Redis 不可用时使用）"""
         # 检查手机号冷却时间
         query = '''
             SELECT sent_at FROM sms_verification_codes
@@ -207,6 +208,17 @@ def generate_code() -> str:
     """生成随机验证码"""
     return ''.join([str(random.randint(0, 9)) for _ in range(SMS_CODE_LENGTH)])
 
+def _send_rate_rules(phone: str, client_ip: str = None, fingerprint: str = None) -> list:
+    """发送验证码的限流规则：手机号、IP、设备指纹各自受24小时次数上限和重发冷却约束"""
+    rules = []
+    for name, value in (("phone", phone), ("ip", client_ip), ("fp", fingerprint)):
+        if not value:
+            continue
+        key = f"sms:send:{name}:{value}"
+        rules.append(rate_limiter.Rule("daily", key, SMS_RATE_LIMIT_WINDOW_HOURS * 3600, SMS_RATE_LIMIT_MAX))
+        rules.append(rate_limiter.Rule("cooldown", key, SMS_CODE_RESEND_COOLDOWN_SECONDS, 1))
+    return rules
+
 async def send_verification_code(phone: str, client_ip: str = None,
                                   user_agent: str = None, fingerprint: str = None) -> Dict:
     """
@@ -225,21 +237,28 @@ async def send_verification_code(phone: str, client_ip: str = None,
     db = DatabaseUtil()
     sms_repo = SMSRepository(db)
 
-    # 检查速率限制
-    if not sms_repo.check_rate_limit(phone, client_ip):
-        return {'success': False, 'message': '请求过于频繁，24小时内最多发送10次'}
-
-    # 检查冷却时间
-    if not sms_repo.check_cooldown(phone, client_ip):
-        return {'success': False, 'message': '请求过于频繁，请稍后再试'}
-
-    # 检查现有验证码（30天重发阻塞期）
+    # 检查现有验证码（30天重发阻塞期，先于限流检查，避免占用发送次数）
     existing = sms_repo.get_latest_valid_code(phone)
     if existing:
         sent_at = existing['sent_at']
         if (now - sent_at).days < SMS_CODE_RESEND_BLOCK_DAYS:
             return {'success': False, 'message': '验证码有效30天，请查看手机短信【达信通】'}
 
+    # 检查速率限制与冷却时间（Redis 滑动窗口，数据库表只作发送记录）
+    # 先占用名额再发送（并发请求不会同时穿过限制），发送失败时撤销，只有成功发送才计数
+    rate_rules = _send_rate_rules(phone, client_ip, fingerprint)
+    limited = rate_limiter.acquire(rate_rules)
+    if limited is None:
+        # Redis 不可用，退回数据库统计
+        if not sms_repo.check_rate_limit(phone, client_ip):
+            return {'success': False, 'message': '请求过于频繁，24小时内最多发送10次'}
+        if not sms_repo.check_cooldown(phone, client_ip):
+            return {'success': False, 'message': '请求过于频繁，请稍后再试'}
+    elif not limited.allowed:
+        if limited.rule.name == "cooldown":
+            return {'success': False, 'message': '请求过于频繁，请稍后再试'}
+        return {'success': False, 'message': '请求过于频繁，24小时内最多发送10次'}
+
     # 生成验证码
     code = generate_code()
     expires_at = now + timedelta(days=SMS_CODE_VALID_DAYS)
@@ -247,6 +266,8 @@ async def send_verification_code(phone: str, client_ip: str = None,
     # 发送短信
     send_success = await send_sms_ihyi(phone, code)
     if not send_success:
+        if limited is not None:
+            rate_limiter.cancel(rate_rules, limited.token)
         return {'success': False, 'message': '短信发送失败，请稍后再试'}
 
     # 保存到数据库
@@ -0,0 +1,295 @@
+"""
+预览缓存管理
+统一管理 Office 转 PDF、缩略图、渲染 HTML 等派生文件的磁盘缓存：
+- 缓存目录：<用户目录>/.preview_cache/<key>/<文件名>，key 由 (类型, 源文件, mtime, size, 变体) 计算
+- 索引文件：<用户目录>/.preview_cache/index.json，记录每个条目的来源、大小和最近访问时间
+- 容量控制：单用户 / 全局字节上限，超出后按最近访问时间（LRU）淘汰
+- 过期清理：源文件被删除或修改后，对应的旧缓存会被移除
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..system import config
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "index.json"
+
+# 未登记到索引的目录超过该时间才视为孤儿目录（避免误删正在生成中的缓存）
+_ORPHAN_GRACE_SECONDS = 3600
+
+# 命中缓存时访问时间的落盘间隔（秒），避免每次预览都重写索引
+_INDEX_FLUSH_INTERVAL = 30
+
+
+class PreviewCacheManager:
+    """按用户维护的派生文件缓存（线程安全）"""
+
+    def __init__(
+        self,
+        user_max_bytes: int = config.PREVIEW_CACHE_USER_MAX_BYTES,
+        global_max_bytes: int = config.PREVIEW_CACHE_GLOBAL_MAX_BYTES,
+    ):
+        self.user_max_bytes = user_max_bytes
+        self.global_max_bytes = global_max_bytes
+        self._lock = threading.RLock()
+        self._indexes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._flushed_at: Dict[str, float] = {}
+        self._dirty: set = set()
+
+    # ---------- 路径与索引 ----------
+
+    @staticmethod
+    def get_cache_root(user_id: str) -> Path:
+        """获取用户的预览缓存根目录"""
+        return config.get_user_work_base_dir(user_id) / config.PREVIEW_CACHE_DIR
+
+    @staticmethod
+    def _make_key(kind: str, source: Path, variant: str = "") -> str:
+        stat_res = source.stat()
+        signature = f"{kind}|{source.as_posix()}|{stat_res.st_mtime}|{stat_res.st_size}|{variant}"
+        return hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+    def _load_index(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            return index
+
+        index_path = self.get_cache_root(user_id) / INDEX_FILE_NAME
+        index = {}
+        if index_path.exists():
+            try:
+                data = json.loads(index_path.read_text(encoding="utf-8"))
+                if isinstance(data, dict):
+                    index = data
+            except Exception as e:
+                logger.warning(f"预览缓存索引读取失败，将重建: {index_path}, {e}")
+        self._indexes[user_id] = index
+        self._flushed_at[user_id] = time.time()
+        return index
+
+    def _save_index(self, user_id: str, force: bool = True) -> None:
+        if user_id not in self._indexes:
+            return
+        now = time.time()
+        if not force and now - self._flushed_at.get(user_id, 0) < _INDEX_FLUSH_INTERVAL:
+            self._dirty.add(user_id)
+            return
+
+        cache_root = self.get_cache_root(user_id)
+        try:
+            cache_root.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_root / f"{INDEX_FILE_NAME}.tmp"
+            tmp_path.write_text(json.dumps(self._indexes[user_id], ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, cache_root / INDEX_FILE_NAME)
+            self._flushed_at[user_id] = now
+            self._dirty.discard(user_id)
+        except Exception as e:
+            logger.warning(f"预览缓存索引写入失败: {cache_root}, {e}")
+
+    def _remove_entry(self, user_id: str, key: str) -> int:
+        index = self._load_index(user_id)
+        entry = index.pop(key, None)
+        shutil.rmtree(self.get_cache_root(user_id) / key, ignore_errors=True)
+        return int(entry.get("bytes", 0)) if entry else 0
+
+    @staticmethod
+    def _dir_size(path: Path) -> int:
+        total = 0
+        for item in path.rglob("*"):
+            try:
+                if item.is_file():
+                    total += item.stat().st_size
+            except OSError:
+                continue
+        return total
+
+    # ---------- 读写接口 ----------
+
+    def lookup(self, user_id: str, source: Path, kind: str, filename: str, variant: str = "") -> Optional[Path]:
+        """
+        查询缓存，命中时刷新访问时间
+
+        Args:
+            user_id: 用户ID
+            source: 源文件
+            kind: 派生类型（如 pdf / thumb / html）
+            filename: 缓存文件名
+            variant: 同一源文件下的变体标识（如缩略图尺寸）
+
+        Returns:
+            命中时返回缓存文件路径，否则返回 None
+        """
+        key = self._make_key(kind, source, variant)
+        cached = self.get_cache_root(user_id) / key / filename
+        if not cached.exists():
+            return None
+
+        with self._lock:
+            index = self._load_index(user_id)
+            entry = index.get(key)
+            if entry is None:
+                # 旧版本遗留或索引丢失，补登记
+                self._register(user_id, key, source, kind, variant, cached)
+                self._save_index(user_id)
+            else:
+                entry["atime"] = time.time()
+                self._save_index(user_id, force=False)
+        return cached
+
+    def reserve(self, user_id: str, source: Path, kind: str, filename: str, variant: str = "") -> Path:
+        """为即将生成的缓存文件分配路径（目录已创建），生成完成后需调用 commit"""
+        key = self._make_key(kind, source, variant)
+        cache_dir = self.get_cache_root(user_id) / key
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cache_dir / filename
+
+    def commit(self, user_id: str, source: Path, kind: str, cached: Path, variant: str = "") -> None:
+        """登记新生成的缓存文件，移除同一源文件的旧版本并执行单用户容量淘汰"""
+        if not cached.exists():
+            return
+        key = cached.parent.name
+        with self._lock:
+            index = self._load_index(user_id)
+            source_key = source.as_posix()
+            for old_key, entry in list(index.items()):
+                if (
+                    old_key != key
+                    and entry.get("kind") == kind
+                    and entry.get("source") == source_key
+                    and entry.get("variant", "") == variant
+                ):
+                    self._remove_entry(user_id, old_key)
+            self._register(user_id, key, source, kind, variant, cached)
+            self._evict_user(user_id, self.user_max_bytes, protect={key})
+            self._save_index(user_id)
+
+    def _register(self, user_id: str, key: str, source: Path, kind: str, variant: str, cached: Path) -> None:
+        try:
+            stat_res = source.stat()
+            mtime, size = stat_res.st_mtime, stat_res.st_size
+        except OSError:
+            mtime, size = None, None
+        self._load_index(user_id)[key] = {
+            "kind": kind,
+            "source": source.as_posix(),
+            "variant": variant,
+            "mtime": mtime,
+            "size": size,
+            "file": cached.name,
+            "bytes": self._dir_size(cached.parent),
+            "atime": time.time(),
+        }
+
+    # ---------- 淘汰与清理 ----------
+
+    def _evict_user(self, user_id: str, max_bytes: int, protect: Iterable[str] = ()) -> int:
+        index = self._load_index(user_id)
+        total = sum(int(entry.get("bytes", 0)) for entry in index.values())
+        if total <= max_bytes:
+            return 0
+
+        protected = set(protect)
+        freed = 0
+        for key, _ in sorted(index.items(), key=lambda item: item[1].get("atime", 0)):
+            if total - freed <= max_bytes:
+                break
+            if key in protected:
+                continue
+            freed += self._remove_entry(user_id, key)
+        if freed:
+            logger.info(f"🧹 预览缓存淘汰: user={user_id}, 释放 {freed} 字节")
+        return freed
+
+    def cleanup_user(self, user_id: str) -> int:
+        """清理单个用户的过期缓存（源文件已删除/修改、孤儿目录），并执行单用户容量淘汰"""
+        cache_root = self.get_cache_root(user_id)
+        if not cache_root.exists():
+            return 0
+
+        freed = 0
+        with self._lock:
+            index = self._load_index(user_id)
+            for key, entry in list(index.items()):
+                source = Path(entry.get("source", ""))
+                try:
+                    stat_res = source.stat()
+                    stale = stat_res.st_mtime != entry.get("mtime") or stat_res.st_size != entry.get("size")
+                except OSError:
+                    stale = True
+                if stale or not (cache_root / key / entry.get("file", "")).exists():
+                    freed += self._remove_entry(user_id, key)
+
+            now = time.time()
+            for item in cache_root.iterdir():
+                if not item.is_dir() or item.name in index:
+                    continue
+                try:
+                    if now - item.stat().st_mtime < _ORPHAN_GRACE_SECONDS:
+                        continue
+                except OSError:
+                    continue
+                freed += self._dir_size(item)
+                shutil.rmtree(item, ignore_errors=True)
+
+            freed += self._evict_user(user_id, self.user_max_bytes)
+            self._save_index(user_id)
+        return freed
+
+    def _iter_cached_users(self) -> List[str]:
+        base_dir = config.get_work_base_dir()
+        if not base_dir.exists():
+            return []
+        users = []
+        for cache_root in base_dir.glob(f"userid_*/{config.PREVIEW_CACHE_DIR}"):
+            users.append(cache_root.parent.name[len("userid_"):])
+        return users
+
+    def cleanup_all(self) -> int:
+        """清理所有用户的过期缓存，并按全局上限淘汰最久未访问的条目"""
+        freed = 0
+        users = self._iter_cached_users()
+        for user_id in users:
+            try:
+                freed += self.cleanup_user(user_id)
+            except Exception as e:
+                logger.warning(f"预览缓存清理失败: user={user_id}, {e}")
+
+        with self._lock:
+            entries: List[Tuple[float, str, str, int]] = []
+            for user_id in users:
+                for key, entry in self._load_index(user_id).items():
+                    entries.append((entry.get("atime", 0), user_id, key, int(entry.get("bytes", 0))))
+            total = sum(item[3] for item in entries)
+            touched = set()
+            for _, user_id, key, _ in sorted(entries):
+                if total <= self.global_max_bytes:
+                    break
+                removed = self._remove_entry(user_id, key)
+                total -= removed
+                freed += removed
+                touched.add(user_id)
+            for user_id in touched | self._dirty:
+                self._save_index(user_id)
+
+            # 释放不活跃用户的索引内存，下次访问时重新加载
+            self._indexes.clear()
+            self._flushed_at.clear()
+        return freed
+
+    def flush(self) -> None:
+        """将尚未落盘的访问时间写入索引"""
+        with self._lock:
+            for user_id in list(self._dirty):
+                self._save_index(user_id)
+
+
+# 全局单例
+preview_cache = PreviewCacheManager()
@@ -0,0 +1,149 @@
+"""
+基于 Redis 的滑动窗口限流
+- 每个限流对象（手机号、IP、设备指纹、账号等）对应一个有序集合，成员为请求时间（毫秒）
+- 多条规则在一个 Lua 脚本内原子检查，全部通过才记一次，避免并发请求同时穿过限制
+- Redis 不可用时 acquire 返回 None，由调用方退回原有的数据库检查
+"""
+import logging
+import time
+import uuid
+from typing import List, NamedTuple, Optional
+
+from .redis_cache import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_KEY_PREFIX = "ratelimit:"
+
+# KEYS: 有序集合；ARGV: now_ms, member, 规则数, 然后每条规则 (KEYS 下标, 窗口毫秒, 上限)
+# 返回 {被拦截规则序号(从 1 开始，0 为通过), 需等待毫秒}
+_SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local count = tonumber(ARGV[3])
+local longest = {}
+for i = 0, count - 1 do
+    local k = tonumber(ARGV[4 + i * 3])
+    local window = tonumber(ARGV[5 + i * 3])
+    local limit = tonumber(ARGV[6 + i * 3])
+    if window > (longest[k] or 0) then
+        longest[k] = window
+    end
+    local since = '(' .. (now - window)
+    if redis.call('ZCOUNT', KEYS[k], since, '+inf') >= limit then
+        local oldest = redis.call('ZRANGEBYSCORE', KEYS[k], since, '+inf', 'WITHSCORES', 'LIMIT', 0, 1)
+        local wait = window
+        if oldest[2] then
+            wait = tonumber(oldest[2]) + window - now
+        end
+        return {i + 1, wait}
+    end
+end
+for k, window in pairs(longest) do
+    redis.call('ZREMRANGEBYSCORE', KEYS[k], '-inf', now - window)
+    redis.call('ZADD', KEYS[k], now, ARGV[2])
+    redis.call('PEXPIRE', KEYS[k], window)
+end
+return {0, 0}
+"""
+
+_script = None
+
+
+class Rule(NamedTuple):
+    """限流规则：key 在 window_seconds 内最多 limit 次（同一 key 可挂多条不同窗口的规则）"""
+    name: str  # 规则名称，调用方据此区分被哪条规则拦截
+    key: str
+    window_seconds: float
+    limit: int
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    rule: Optional[Rule] = None  # 被拦截时为触发的规则
+    retry_after: float = 0.0  # 被拦截时距离下次可请求的秒数
+    token: Optional[str] = None  # 通过时本次记录的标识，可传给 cancel 撤销
+
+
+def acquire(rules: List[Rule]) -> Optional[RateLimitResult]:
+    """
+    检查并记录一次请求（所有规则都通过才记录）
+
+    Args:
+        rules: 限流规则列表，window_seconds <= 0 的规则忽略
+
+    Returns:
+        RateLimitResult；Redis 不可用返回 None
+    """
+    global _script
+    rules = [rule for rule in rules if rule.window_seconds > 0]
+    if not rules:
+        return RateLimitResult(True)
+
+    client = get_redis_client()
+    if not client:
+        return None
+
+    token = uuid.uuid4().hex
+    keys: List[str] = []
+    args: List[object] = [int(time.time() * 1000), token, len(rules)]
+    for rule in rules:
+        key = _KEY_PREFIX + rule.key
+        if key not in keys:
+            keys.append(key)
+        args.extend([keys.index(key) + 1, int(rule.window_seconds * 1000), rule.limit])
+
+    try:
+        if _script is None:
+            _script = client.register_script(_SLIDING_WINDOW_LUA)
+        blocked, wait_ms = _script(keys=keys, args=args, client=client)
+    except Exception as e:
+        logger.warning(f"Redis 限流检查失败: {e}")
+        return None
+
+    blocked = int(blocked)
+    if not blocked:
+        return RateLimitResult(True, token=token)
+    return RateLimitResult(False, rules[blocked - 1], max(0.0, int(wait_ms) / 1000.0))
+
+
+def cancel(rules: List[Rule], token: Optional[str]) -> bool:
+    """
+    撤销 acquire 记录的一次请求（如请求最终未执行）
+
+    Returns:
+        是否撤销成功
+    """
+    if not token:
+        return False
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        pipe = client.pipeline()
+        for key in {_KEY_PREFIX + rule.key for rule in rules}:
+            pipe.zrem(key, token)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 撤销限流记录失败: {e}")
+        return False
+
+
+def reset(key: str) -> bool:
+    """
+    清除某个限流对象的记录（如登录成功后清空失败计数）
+
+    Returns:
+        是否清除成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        client.delete(_KEY_PREFIX + key)
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 清除限流记录失败: {e}")
+        return False
@@ -4,7 +4,8 @@ Redis 缓存工具类
 """
 import redis
 import logging
-from typing import Optional, Dict, Any
+from array import array
+from typing import Optional, Dict, Any, List, Tuple
 from ..system import config
 
 logger = logging.getLogger(__name__)
@@ -324,3 +325,318 @@ def clear_sms_verify_fail(phone: str) -> bool:
     except Exception as e:
         logger.warning(f"Redis 清除验证失败次数失败: {e}")
         return False
+
+
+# ==================== Embedding 向量缓存 ====================
+
+
+def get_cached_embedding(key: str) -> Optional[List[float]]:
+    """
+    获取缓存的文本向量
+
+    Args:
+        key: 内容哈希键（由模型、维度、文本计算）
+
+    Returns:
+        向量列表，未命中返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        cached = client.get(f"kb:emb:{key}")
+        if not cached:
+            return None
+        # 以 float32 紧凑存储，512 维约 2KB
+        return array("f", cached).tolist()
+    except Exception as e:
+        logger.warning(f"Redis 读取向量缓存失败: {e}")
+        return None
+
+
+def set_cached_embedding(key: str, embedding: List[float]) -> bool:
+    """
+    写入文本向量缓存
+
+    Args:
+        key: 内容哈希键
+        embedding: 向量
+
+    Returns:
+        是否写入成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        client.set(f"kb:emb:{key}", array("f", embedding).tobytes(), ex=config.KB_EMBEDDING_CACHE_TTL)
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 写入向量缓存失败: {e}")
+        return False
+
+
+# ==================== MCP 响应缓存 ====================
+
+def get_cached_mcp_response(key: str) -> Optional[bytes]:
+    """
+    获取缓存的 MCP 外部接口响应
+
+    Args:
+        key: 接口与参数哈希键
+
+    Returns:
+        响应 JSON 字节串，未命中返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        return client.get(f"mcp:http:{key}")
+    except Exception as e:
+        logger.warning(f"Redis 读取 MCP 响应缓存失败: {e}")
+        return None
+
+
+def set_cached_mcp_response(key: str, body: bytes, ttl: int) -> bool:
+    """
+    写入 MCP 外部接口响应缓存
+
+    Args:
+        key: 接口与参数哈希键
+        body: 响应 JSON 字节串
+        ttl: 过期时间（秒）
+
+    Returns:
+        是否写入成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        client.set(f"mcp:http:{key}", body, ex=ttl)
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 写入 MCP 响应缓存失败: {e}")
+        return False
+
+
+# ==================== 非会员消息配额计数 ====================
+
+def _quota_key(user_id: str, window_start: int) -> str:
+    return f"quota:msg:{user_id}:{window_start}"
+
+
+def incr_quota_count(user_id: str, window_start: int, expire_at: int, amount: int = 1) -> Optional[int]:
+    """
+    增加当前窗口的消息计数（INCRBY 与 EXPIREAT 放在同一事务管道中，一次往返）
+
+    Args:
+        user_id: 用户 ID
+        window_start: 窗口开始时间（Unix 时间戳）
+        expire_at: 计数过期时间（Unix 时间戳，与窗口结束对齐）
+        amount: 增加的数量
+
+    Returns:
+        增加后的计数，Redis 不可用返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        key = _quota_key(user_id, window_start)
+        pipe = client.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expireat(key, expire_at)
+        count, _ = pipe.execute()
+        return int(count)
+    except Exception as e:
+        logger.warning(f"Redis 更新消息配额计数失败: {e}")
+        return None
+
+
+def get_quota_count(user_id: str, window_start: int) -> Optional[int]:
+    """
+    读取当前窗口的消息计数
+
+    Returns:
+        计数，未命中或 Redis 不可用返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        value = client.get(_quota_key(user_id, window_start))
+        return int(value) if value is not None else None
+    except Exception as e:
+        logger.warning(f"Redis 读取消息配额计数失败: {e}")
+        return None
+
+
+# ==================== 会员状态缓存 ====================
+
+def get_cached_membership(user_id: str) -> Optional[bytes]:
+    """
+    获取缓存的会员状态
+
+    Returns:
+        会员记录 JSON 字节串（非会员为 b"null"），未命中返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        return client.get(f"membership:{user_id}")
+    except Exception as e:
+        logger.warning(f"Redis 读取会员缓存失败: {e}")
+        return None
+
+
+def set_cached_membership(user_id: str, body: bytes, ttl: int) -> bool:
+    """
+    写入会员状态缓存
+
+    Args:
+        user_id: 用户 ID
+        body: 会员记录 JSON 字节串
+        ttl: 过期时间（秒）
+
+    Returns:
+        是否写入成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        client.set(f"membership:{user_id}", body, ex=max(1, ttl))
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 写入会员缓存失败: {e}")
+        return False
+
+
+def invalidate_cached_membership(user_id: str) -> bool:
+    """
+    删除会员状态缓存（开通/续费后调用）
+
+    Returns:
+        是否删除成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        client.delete(f"membership:{user_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 删除会员缓存失败: {e}")
+        return False
+
+
+# ==================== 模型 API Key 变更通知 ====================
+
+_API_KEYS_VERSION_KEY = "api_keys:version"
+
+
+def get_api_keys_version() -> Optional[int]:
+    """
+    获取 api_keys 表的变更版本号（各 worker 据此判断是否需要重新加载）
+
+    Returns:
+        版本号，Redis 不可用返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        value = client.get(_API_KEYS_VERSION_KEY)
+        return int(value) if value is not None else 0
+    except Exception as e:
+        logger.warning(f"Redis 读取 API Key 版本失败: {e}")
+        return None
+
+
+def bump_api_keys_version() -> Optional[int]:
+    """
+    递增 api_keys 表的变更版本号（新增 / 修改状态后调用）
+
+    Returns:
+        新版本号，Redis 不可用返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        return int(client.incr(_API_KEYS_VERSION_KEY))
+    except Exception as e:
+        logger.warning(f"Redis 递增 API Key 版本失败: {e}")
+        return None
+
+
+# ==================== 知识库检索缓存版本 ====================
+
+_KB_CACHE_USER_VERSION_PREFIX = "kb_cache:version:user:"
+_KB_CACHE_PUBLIC_VERSION_KEY = "kb_cache:version:public"
+
+
+def get_kb_cache_versions(user_id: str) -> Optional[Tuple[int, int]]:
+    """
+    获取知识库检索缓存的 (用户版本号, 公开记忆版本号)（各 worker 共享，记忆变化时递增）
+
+    Returns:
+        版本号元组，Redis 不可用返回 None
+    """
+    client = get_redis_client()
+    if not client:
+        return None
+
+    try:
+        user_version, public_version = client.mget(
+            _KB_CACHE_USER_VERSION_PREFIX + user_id, _KB_CACHE_PUBLIC_VERSION_KEY
+        )
+        return int(user_version or 0), int(public_version or 0)
+    except Exception as e:
+        logger.warning(f"Redis 读取知识库缓存版本失败: {e}")
+        return None
+
+
+def bump_kb_cache_versions(user_ids: List[str], public: bool, expire_seconds: int) -> bool:
+    """
+    递增知识库检索缓存版本号（记忆增删改后调用）
+
+    Args:
+        user_ids: 记忆发生变化的用户
+        public: 是否递增公开记忆版本号
+        expire_seconds: 版本号有效期（需长于缓存条目有效期，过期后归零不会让旧条目重新生效）
+
+    Returns:
+        是否递增成功
+    """
+    client = get_redis_client()
+    if not client:
+        return False
+
+    try:
+        pipe = client.pipeline()
+        keys = [_KB_CACHE_USER_VERSION_PREFIX + user_id for user_id in user_ids]
+        if public:
+            keys.append(_KB_CACHE_PUBLIC_VERSION_KEY)
+        for key in keys:
+            pipe.incr(key)
+            pipe.expire(key, expire_seconds)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Redis 递增知识库缓存版本失败: {e}")
+        return False
@@ -0,0 +1,59 @@
+"""
+并发请求合并（single-flight）
+相同键的并发调用只执行一次，其余调用等待并共享结果（或异常）。
+执行者被取消时不会把取消传给等待者：等待者重新竞争，由其中一个接着执行。
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _LeaderCancelled(Exception):
+    """执行者被取消（只在内部用于唤醒等待者重试）"""
+
+
+class SingleFlight(Generic[T]):
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future[T]"] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        执行 fn 或等待正在进行的同键调用
+
+        Returns:
+            (结果, 是否来自其他调用)
+        """
+        while True:
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending), True
+            except _LeaderCancelled:
+                continue
+
+        future: "asyncio.Future[T]" = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
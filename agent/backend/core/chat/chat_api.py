@@ -9,6 +9,7 @@ import psycopg2.extras
 import asyncio
 import sys
 import os
+import time
 import logging
 from datetime import datetime
 from pathlib import Path
@@ -20,8 +21,10 @@ from ..auth.auth_filter import get_current_user_id
 from ..db.dbutil import DatabaseUtil
 from ..system import config
 from ..membership.sub_api import check_user_message_quota
+from ..membership.pub_key_api import api_key_router
 from ..firewall.firewall_bash import check_user_storage_quota
 from ..kbs import service as kbs_service
+from ..kbs import retrieval_cache as kb_retrieval_cache
 
 # 创建路由器
 router = APIRouter(prefix="/api/v1/chat", tags=["chat"])
@@ -48,6 +51,8 @@ def get_agent_lock(agent_id: str) -> asyncio.Lock:
 # 针对同一会话的发送队列，允许把短时间内的多条消息合并后再请求Claude
 pending_message_queues: Dict[str, List[str]] = {}
 queue_processing_flags: Dict[str, bool] = {}
+# 等待本批消息处理完成的调用方（进程内派发的定时任务用来控制并发）
+pending_message_waiters: Dict[str, List[asyncio.Future]] = {}
 def _queue_key(agent_id: str, session_id: str) -> str:
     return f"{agent_id}:{session_id}"
 
@@ -56,12 +61,18 @@ async def _build_kb_context(user_id: str, message: str, topk: int = 10) -> Optio
         return None
     if not message or not message.strip():
         return None
+    # 命中缓存时直接复用格式化结果（空字符串表示无相关记忆），跳过向量化和数据库查询
+    cached = kb_retrieval_cache.get("context", user_id, message, topk)
+    if cached is not None:
+        return cached or None
+    versions = kb_retrieval_cache.snapshot(user_id)
     try:
         rows = await kbs_service.query_memory(user_id=user_id, content=message, topk=topk)
     except Exception as exc:
         logger.warning("KB query failed: %s", exc)
         return None
     if not rows:
+        kb_retrieval_cache.put("context", user_id, message, topk, "", versions)
         return None
     lines: List[str] = []
     for row in rows:
@@ -74,7 +85,9 @@ async def _build_kb_context(user_id: str, message: str, topk: int = 10) -> Optio
         if title:
             header = f"{header} | {title}"
         lines.append(f"{header}\n  {content}")
-    return "\n".join(lines)
+    context = "\n".join(lines)
+    kb_retrieval_cache.put("context", user_id, message, topk, context, versions)
+    return context
 
 async def _record_chat_fragment(user_id: str, message: str) -> None:
     if not config.KB_ENABLED:
@@ -91,6 +104,7 @@ async def _record_chat_fragment(user_id: str, message: str) -> None:
             title="聊天碎片",
             content=content,
             is_public=0,
+            defer_embedding=True,
         )
     except Exception as exc:
         logger.warning("KB add_memory failed: %s", exc)
@@ -523,6 +537,10 @@ async def _ensure_agent_client(agent_id: str, user_id: str, session_claude_id: O
                 rebuild_reasons.append("work_dir_mismatch")
         except Exception:
             pass
+        if api_key_router.take_rebuild(agent_id):
+            # 当前 API Key 已被摘除，重建客户端以换用可用的 Key
+            need_rebuild = True
+            rebuild_reasons.append("api_key_failover")
         if session_claude_id and session_claude_id != current_resume:
             if current_resume:
                 # 已有 resume 但与DB不一致，重建
@@ -579,15 +597,44 @@ async def _ensure_agent_client(agent_id: str, user_id: str, session_claude_id: O
 
     return client
 
+def _elapsed_ms(start: float) -> int:
+    return int((time.monotonic() - start) * 1000)
+
+async def _timed(spans: Dict[str, int], name: str, coro):
+    """执行协程并把耗时（毫秒）记入 spans[name]"""
+    start = time.monotonic()
+    try:
+        return await coro
+    finally:
+        spans[name] = _elapsed_ms(start)
+
+async def _await_kb_context(kb_task: "asyncio.Task", deadline: float) -> Optional[str]:
+    """
+    在耗时预算内等待知识库检索结果，超时则放弃本轮知识库片段
+
+    超时后检索任务继续在后台完成（结果写入检索缓存，下一轮可直接命中），不阻塞本轮对话。
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(kb_task), timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        kb_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return None
+
 async def _process_ai_response(session_id: str, agent_id: str, message: str, _retry: bool = False):
     """
     异步处理AI回复（后台任务）
 
+    知识库检索与客户端准备（可能需要拉起 CLI）互不依赖，并发执行：
+    首包等待时间取两者较大值而不是两者之和。知识库检索受 KB_CONTEXT_TIMEOUT 预算约束。
+
     Args:
         session_id: 会话ID
         agent_id: AI智能体ID
         message: 用户消息
     """
+    spans: Dict[str, int] = {}
+    pipeline_start = time.monotonic()
+    query_sent = False
     try:
         # 获取会话信息以找到 user_id
         conn = db.get_connection()
@@ -597,6 +644,7 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
         ''', (session_id,))
         session_info = cursor.fetchone()
         conn.close()
+        spans["session"] = _elapsed_ms(pipeline_start)
 
         if not session_info:
             logger.warning("Session not found: %s", session_id)
@@ -605,12 +653,10 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
         user_id = session_info["user_id"]
         session_claude_id = session_info["session_claude_id"]
 
-        kb_context = await _build_kb_context(user_id, message)
-        if kb_context:
-            message = f"{message}\n==========\n根据用户消息查到的知识库片段：\n{kb_context}"
-
-        # 3. 获取AI客户端，确保绑定正确的会话ID以保持记忆
-        client = await _ensure_agent_client(agent_id, user_id, session_claude_id)
+        # 3. 知识库检索与获取AI客户端并发进行（客户端需绑定正确的会话ID以保持记忆）
+        kb_deadline = time.monotonic() + config.KB_CONTEXT_TIMEOUT
+        kb_task = asyncio.create_task(_timed(spans, "kb", _build_kb_context(user_id, message)))
+        client = await _timed(spans, "client", _ensure_agent_client(agent_id, user_id, session_claude_id))
 
         # 4. 发送消息给AI（加锁避免并发写入同一传输流）
         if not client:
@@ -623,23 +669,36 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
         overall_start = datetime.now()
         async with lock:
             # 仅在未连接或超过空闲阈值时重连
-            connect_start = datetime.now()
+            connect_start = time.monotonic()
             try:
                 from ..agent.agent_manager import ensure_agent_connected
                 await ensure_agent_connected(agent_id)
             except Exception:
                 pass
-            connect_cost_ms = int((datetime.now() - connect_start).total_seconds() * 1000)
-
-            query_start = datetime.now()
-            await client.query(message)
-            query_cost_ms = int((datetime.now() - query_start).total_seconds() * 1000)
-            # 记录调用耗时，便于定位延迟来源
+            spans["connect"] = _elapsed_ms(connect_start)
+
+            kb_wait_start = time.monotonic()
+            kb_context = await _await_kb_context(kb_task, kb_deadline)
+            spans["kb_wait"] = _elapsed_ms(kb_wait_start)
+            prompt = message
+            if kb_context:
+                prompt = f"{message}\n==========\n根据用户消息查到的知识库片段：\n{kb_context}"
+
+            query_start = time.monotonic()
+            query_sent = True
+            await client.query(prompt)
+            spans["query"] = _elapsed_ms(query_start)
+            # 记录各阶段耗时，便于定位延迟来源（kb 缺失表示超出预算未等到结果）
             logger.info(
-                "======== [chat/send] agent=%s connect=%sms query=%sms",
+                "======== [chat/send] agent=%s session=%sms kb=%s client=%sms connect=%sms kb_wait=%sms query=%sms to_query=%sms",
                 agent_id,
-                connect_cost_ms,
-                query_cost_ms,
+                spans.get("session"),
+                f"{spans['kb']}ms" if "kb" in spans else "timeout",
+                spans.get("client"),
+                spans.get("connect"),
+                spans.get("kb_wait"),
+                spans.get("query"),
+                _elapsed_ms(pipeline_start),
             )
 
             # 5. 接收AI回复并实时保存进度
@@ -647,6 +706,7 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
             recv_start = datetime.now()
             text_block_count = 0
             first_block_ms: Optional[int] = None
+            result_error: Optional[str] = None
 
             def log_progress(content: str, subtype: Optional[str] = None):
                 if not content:
@@ -716,6 +776,8 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
                     result_text = getattr(msg, "result", None)
                     if status == "error":
                         log_progress(f"❌ 任务失败: {result_text}", "error")
+                    if getattr(msg, "is_error", False):
+                        result_error = str(result_text or status)
                     # 任务完成不显示，由 AI 的回复内容自然结束
                     break
             recv_cost_ms = int((datetime.now() - recv_start).total_seconds() * 1000)
@@ -728,6 +790,8 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
                 first_block_ms,
                 total_cost_ms,
             )
+            # 反馈本次请求结果给 API Key 路由（用于错误率 / 延迟统计与故障摘除）
+            api_key_router.record_result(agent_id, result_error is None, first_block_ms or total_cost_ms, result_error)
 
         # 保存完整AI回复（汇总）
         if ai_response and not text_logged:
@@ -742,6 +806,8 @@ async def _process_ai_response(session_id: str, agent_id: str, message: str, _re
     except Exception as e:
         err_msg = str(e)
         logger.exception("Error in _process_ai_response: %s", err_msg)
+        if query_sent:
+            api_key_router.record_result(agent_id, False, error=err_msg)
         if not _retry and (
             "terminated process" in err_msg.lower()
             or "message reader" in err_msg.lower()
@@ -774,14 +840,71 @@ async def _process_queue(agent_id: str, session_id: str, key: str):
             # 把当前队列的消息取出并清空队列
             messages = pending_message_queues.get(key, [])
             pending_message_queues[key] = []
+            waiters = pending_message_waiters.pop(key, [])
             if not messages:
                 break
             combined_message = "\n".join(messages)
-            await _process_ai_response(session_id, agent_id, combined_message)
+            try:
+                await _process_ai_response(session_id, agent_id, combined_message)
+            finally:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
     finally:
         queue_processing_flags[key] = False
 
 
+def _enqueue_message(agent_id: str, session_id: str, message: str, wait: bool = False) -> Optional[asyncio.Future]:
+    """
+    将消息加入会话队列，同一会话的多条消息会自动合并后再请求Claude
+
+    Returns:
+        wait 为 True 时返回本条消息所在批次处理完成的 Future，否则为 None
+    """
+    key = _queue_key(agent_id, session_id)
+    if key not in pending_message_queues:
+        pending_message_queues[key] = []
+    pending_message_queues[key].append(message)
+
+    waiter = None
+    if wait:
+        waiter = asyncio.get_running_loop().create_future()
+        pending_message_waiters.setdefault(key, []).append(waiter)
+
+    if not queue_processing_flags.get(key):
+        queue_processing_flags[key] = True
+        asyncio.create_task(_process_queue(agent_id, session_id, key))
+    return waiter
+
+
+async def dispatch_internal_message(
+    user_id: str,
+    agent_id: str,
+    session_id: Optional[str],
+    message: str,
+    wait: bool = False,
+) -> tuple:
+    """
+    进程内发送消息（定时任务等内部调用，不经过 HTTP 与鉴权）
+
+    与 /send 相同：计入配额、保存用户消息、记录记忆片段后入队处理。
+
+    Returns:
+        (session_id, waiter)：wait 为 True 时 waiter 在 AI 回复处理完成后完成
+
+    Raises:
+        PermissionError: 超过非会员配额
+    """
+    quota = check_user_message_quota(user_id, increment=True)
+    if not quota['allowed']:
+        raise PermissionError("quota_exceeded")
+
+    session_id, _ = get_or_create_session(user_id, agent_id, session_id)
+    save_message(session_id, user_id, "human", message, "text", None)
+    await _record_chat_fragment(user_id, message)
+    return session_id, _enqueue_message(agent_id, session_id, message, wait)
+
+
 # API端点实现
 @router.post("/send", response_model=ChatMessageResponse)
 async def send_message(
@@ -848,14 +971,7 @@ async def send_message(
 
         # 4. 异步处理AI回复（不阻塞响应）
         # 将消息入队，同一会话的多条消息会自动合并后再请求Claude
-        key = _queue_key(request.ai_agent_id, session_id)
-        if key not in pending_message_queues:
-            pending_message_queues[key] = []
-        pending_message_queues[key].append(request.message)
-
-        if not queue_processing_flags.get(key):
-            queue_processing_flags[key] = True
-            asyncio.create_task(_process_queue(request.ai_agent_id, session_id, key))
+        _enqueue_message(request.ai_agent_id, session_id, request.message)
 
         return response
 
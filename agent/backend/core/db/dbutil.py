@@ -7,6 +7,7 @@ import psycopg2.extras
 from psycopg2 import pool
 import os
 import sys
+import threading
 import uuid
 from datetime import datetime
 from typing import Optional, List, Dict, Any
@@ -50,11 +51,14 @@ class PooledConnection:
         """退出上下文时归还连接"""
         self.close()
 
-    def cursor(self, cursor_factory=None):
-        """创建游标，支持 cursor_factory 参数"""
+    def cursor(self, name=None, cursor_factory=None):
+        """创建游标，支持 name（服务端命名游标）与 cursor_factory 参数"""
+        kwargs = {}
+        if name:
+            kwargs['name'] = name
         if cursor_factory:
-            return self._connection.cursor(cursor_factory=cursor_factory)
-        return self._connection.cursor()
+            kwargs['cursor_factory'] = cursor_factory
+        return self._connection.cursor(**kwargs)
 
     def rollback(self):
         """回滚事务"""
@@ -73,6 +77,7 @@ class DatabaseUtil:
     # 类级别的连接池（所有实例共享）
     _connection_pool = None
     _pool_initialized = False
+    _pool_lock = threading.Lock()
 
     def __init__(self):
         """初始化，确保数据库和连接池存在"""
@@ -81,9 +86,14 @@ class DatabaseUtil:
 
     def _ensure_connection_pool(self):
         """确保连接池已初始化（线程安全）"""
-        if not DatabaseUtil._pool_initialized:
+        if DatabaseUtil._pool_initialized:
+            return
+        with DatabaseUtil._pool_lock:
+            if DatabaseUtil._pool_initialized:
+                return
             try:
-                DatabaseUtil._connection_pool = pool.SimpleConnectionPool(
+                # 数据库操作会在 asyncio.to_thread / 线程池中执行，需使用线程安全的连接池
+                DatabaseUtil._connection_pool = pool.ThreadedConnectionPool(
                     minconn=10,     # 最小连接数（支持100并发用户）
                     maxconn=50,     # 最大连接数（留有余量）
                     host=config.POSTGRES_HOST,
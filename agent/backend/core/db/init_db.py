@@ -296,6 +296,9 @@ def check_tables_exist(conn):
         'quota_usage',
         'api_keys',
         'task_custom_mcp',
+        'task_runs',
+        'task_scheduler_state',
+        'memory_embedding_queue',
     }
 
     # 找出缺失的表
@@ -366,6 +369,12 @@ def check_and_init(verbose=True):
                 seed_api_keys(cursor)
             if 'task_custom_mcp' in missing_tables:
                 create_task_custom_mcp_table(cursor)
+            if 'task_runs' in missing_tables:
+                create_task_runs_table(cursor)
+            if 'task_scheduler_state' in missing_tables:
+                create_task_scheduler_state_table(cursor)
+            if 'memory_embedding_queue' in missing_tables:
+                create_memory_embedding_queue_table(cursor)
 
             conn.commit()
 
@@ -376,6 +385,11 @@ def check_and_init(verbose=True):
                 print(f"数据库已连接: PostgreSQL@{config.POSTGRES_HOST}:{config.POSTGRES_PORT}/{config.POSTGRES_DB}")
                 print("所有必需的表都已存在")
 
+        if 'task_custom_mcp' not in missing_tables:
+            cursor = conn.cursor()
+            upgrade_task_custom_mcp_table(cursor)
+            conn.commit()
+
         _initialized = True
         conn.close()
 
@@ -644,10 +658,17 @@ def create_memory_units_table(cursor):
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_units_status ON memory_units(status)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_units_public ON memory_units(is_public)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_units_tsv ON memory_units USING GIN (content_tsv)')
+    # HNSW 向量索引：全量索引用于按用户检索，部分索引专供公开记忆检索
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_memory_units_embedding_hnsw
+        ON memory_units USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    ''')
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_memory_units_embedding
-        ON memory_units USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100)
+        CREATE INDEX IF NOT EXISTS idx_memory_units_embedding_public_hnsw
+        ON memory_units USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+        WHERE is_public = 1 AND status = 1
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_memory_units_user_status ON memory_units(user_id, status)')
     cursor.execute('''
         CREATE OR REPLACE FUNCTION memory_units_tsv_trigger() RETURNS trigger AS $$
         BEGIN
@@ -685,6 +706,7 @@ def create_task_custom_mcp_table(cursor):
             cron_expr TEXT,
             run_at TIMESTAMP,
             status TEXT NOT NULL DEFAULT 'pending',
+            priority INT NOT NULL DEFAULT 0,
             last_run_at TIMESTAMP,
             next_run_at TIMESTAMP,
             last_error TEXT,
@@ -705,6 +727,69 @@ def create_task_custom_mcp_table(cursor):
     print("✅ 定时任务表创建完成")
 
 
+def create_task_runs_table(cursor):
+    """创建定时任务执行记录表（只追加，用于统计执行耗时与结果）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_runs (
+            id TEXT PRIMARY KEY,
+            task_id TEXT NOT NULL,
+            user_id TEXT,
+            agent_id TEXT,
+            scheduled_at TIMESTAMP,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP NOT NULL,
+            duration_ms INT NOT NULL,
+            outcome TEXT NOT NULL,
+            error TEXT,
+            node TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_runs_task ON task_runs(task_id, started_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_task_runs_started ON task_runs(started_at)
+    ''')
+    print("✅ 定时任务执行记录表创建完成")
+
+
+def create_task_scheduler_state_table(cursor):
+    """创建定时任务调度状态表（单行，记录集群最近一次轮询时间，用于识别停机）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_scheduler_state (
+            id INT PRIMARY KEY,
+            last_poll_at TIMESTAMPTZ
+        )
+    ''')
+    print("✅ 定时任务调度状态表创建完成")
+
+
+def upgrade_task_custom_mcp_table(cursor):
+    """为已存在的定时任务表补充新增字段"""
+    cursor.execute('''
+        ALTER TABLE task_custom_mcp ADD COLUMN IF NOT EXISTS priority INT NOT NULL DEFAULT 0
+    ''')
+
+
+def create_memory_embedding_queue_table(cursor):
+    """创建记忆向量化队列表（先入库、后台补全 embedding）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS memory_embedding_queue (
+            memory_id TEXT PRIMARY KEY,
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            FOREIGN KEY (memory_id) REFERENCES memory_units (id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_memory_embedding_queue_next ON memory_embedding_queue(next_attempt_at)
+    ''')
+    print("✅ 记忆向量化队列表创建完成")
+
+
 
 def create_agent_settings_table(cursor):
     """创建AI智能体配置表"""
@@ -0,0 +1,76 @@
+"""
+数据库迁移脚本：memory_units 向量索引由 ivfflat 切换为 HNSW
+- 删除旧的 ivfflat 索引 idx_memory_units_embedding
+- 创建全量 HNSW 索引与公开记忆部分 HNSW 索引
+- 创建 (user_id, status) 复合索引，供按用户候选检索使用
+需要 pgvector >= 0.5.0；大表建索引耗时较长，使用 CONCURRENTLY 避免锁表。
+"""
+import psycopg2
+import sys
+from ..system import config
+from ..system.logging_setup import setup_logging
+
+setup_logging()
+
+def migrate_memory_units_hnsw():
+    """为 memory_units 创建 HNSW 索引并删除 ivfflat 索引"""
+    try:
+        conn = psycopg2.connect(
+            host=config.POSTGRES_HOST,
+            port=config.POSTGRES_PORT,
+            database=config.POSTGRES_DB,
+            user=config.POSTGRES_USER,
+            password=config.POSTGRES_PASSWORD
+        )
+        # CREATE INDEX CONCURRENTLY 不能在事务中执行
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        result = cursor.fetchone()
+        if not result:
+            print("❌ 未安装 pgvector 扩展，无法迁移", file=sys.stderr)
+            sys.exit(1)
+        print(f"pgvector 版本: {result[0]}")
+
+        print("⏳ 创建 HNSW 索引（全量）...")
+        cursor.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_memory_units_embedding_hnsw
+            ON memory_units USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+        """)
+
+        print("⏳ 创建 HNSW 索引（公开记忆）...")
+        cursor.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_memory_units_embedding_public_hnsw
+            ON memory_units USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+            WHERE is_public = 1 AND status = 1
+        """)
+
+        print("⏳ 创建 (user_id, status) 索引...")
+        cursor.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_memory_units_user_status
+            ON memory_units(user_id, status)
+        """)
+
+        print("⏳ 删除旧 ivfflat 索引...")
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_memory_units_embedding")
+
+        cursor.execute("""
+            SELECT indexname, indexdef
+            FROM pg_indexes
+            WHERE tablename = 'memory_units'
+            ORDER BY indexname
+        """)
+        print("\n📋 memory_units 索引:")
+        for row in cursor.fetchall():
+            print(f"  - {row[0]}: {row[1]}")
+
+        conn.close()
+        print("\n✅ 迁移完成！")
+
+    except Exception as e:
+        print(f"❌ 迁移失败: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    migrate_memory_units_hnsw()
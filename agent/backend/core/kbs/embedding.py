@@ -0,0 +1,181 @@
+"""
+文本向量化（BigModel embeddings）
+- 共享 httpx 连接池，避免每次调用重新建连
+- 按内容哈希缓存：进程内 LRU + Redis
+- 相同文本的并发请求合并为一次远程调用（single-flight）
+- 批量接口按多文本输入分批请求，并限制并发
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
+
+import httpx
+
+from ..cache.redis_cache import get_cached_embedding, set_cached_embedding
+from ..cache.single_flight import SingleFlight
+from ..system import config
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_URL = "https://open.bigmodel.cn/api/paas/v4/embeddings"
+
+_client: Optional[httpx.AsyncClient] = None
+_lru: "OrderedDict[str, List[float]]" = OrderedDict()
+_flight: "SingleFlight[List[float]]" = SingleFlight()
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def close_embedding_client() -> None:
+    """关闭共享连接池（应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _cache_key(text: str) -> str:
+    # 模型和维度变化时向量不可复用，一并计入键
+    raw = f"{config.BIGMODEL_EMBEDDING_MODEL}|{config.BIGMODEL_EMBEDDING_DIMENSIONS}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _lru_get(key: str) -> Optional[List[float]]:
+    embedding = _lru.get(key)
+    if embedding is not None:
+        _lru.move_to_end(key)
+    return embedding
+
+
+def _lru_put(key: str, embedding: List[float]) -> None:
+    _lru[key] = embedding
+    _lru.move_to_end(key)
+    while len(_lru) > config.KB_EMBEDDING_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+async def _request_embeddings(texts: Union[str, List[str]]) -> List[List[float]]:
+    if not config.BIGMODEL_API_KEY:
+        raise RuntimeError("BIGMODEL_API_KEY 未配置")
+    payload = {
+        "model": config.BIGMODEL_EMBEDDING_MODEL,
+        "input": texts,
+        "dimensions": config.BIGMODEL_EMBEDDING_DIMENSIONS,
+    }
+    headers = {
+        "Authorization": f"Bearer {config.BIGMODEL_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    resp = await _get_client().post(EMBEDDING_URL, json=payload, headers=headers)
+    if resp.status_code != 200:
+        raise RuntimeError(f"向量化失败: {resp.text}")
+    data = resp.json().get("data") or []
+    expected = 1 if isinstance(texts, str) else len(texts)
+    # 多文本输入时按 index 对齐返回顺序
+    embeddings: List[Optional[List[float]]] = [None] * expected
+    for pos, item in enumerate(data):
+        idx = item.get("index", pos)
+        if 0 <= idx < expected:
+            embeddings[idx] = item.get("embedding")
+    if any(not embedding for embedding in embeddings):
+        raise RuntimeError("向量化返回为空")
+    return embeddings
+
+
+async def _request_embedding(text: str) -> List[float]:
+    return (await _request_embeddings(text))[0]
+
+
+async def get_embedding(text: str) -> List[float]:
+    """获取文本向量（依次查询进程内缓存、Redis、远程接口）"""
+    key = _cache_key(text)
+    embedding = _lru_get(key)
+    if embedding is not None:
+        return embedding
+
+    async def _load() -> List[float]:
+        embedding = get_cached_embedding(key)
+        if embedding is None:
+            embedding = await _request_embedding(text)
+            set_cached_embedding(key, embedding)
+        _lru_put(key, embedding)
+        return embedding
+
+    embedding, _ = await _flight.do(key, _load)
+    return embedding
+
+
+async def get_embeddings(texts: List[str]) -> List[Union[List[float], Exception]]:
+    """
+    批量获取文本向量
+
+    先查缓存，未命中的文本去重后按 KB_EMBEDDING_BATCH_SIZE 分批请求，批次间并发受限。
+    某一批失败只影响该批文本：对应位置返回异常对象，其余位置返回向量。
+    """
+    results: List[Union[List[float], Exception, None]] = [None] * len(texts)
+    keys = [_cache_key(text) for text in texts]
+
+    missing: Dict[str, str] = {}
+    waiting: Dict[str, str] = {}
+    for pos, key in enumerate(keys):
+        embedding = _lru_get(key)
+        if embedding is None and key not in missing and key not in waiting:
+            if key in _flight:
+                waiting[key] = texts[pos]
+                continue
+            embedding = get_cached_embedding(key)
+            if embedding is not None:
+                _lru_put(key, embedding)
+            else:
+                missing[key] = texts[pos]
+        if embedding is not None:
+            results[pos] = embedding
+
+    resolved: Dict[str, Union[List[float], Exception]] = {}
+    semaphore = asyncio.Semaphore(max(1, config.KB_EMBEDDING_BATCH_CONCURRENCY))
+    batch_size = max(1, config.KB_EMBEDDING_BATCH_SIZE)
+    missing_items = list(missing.items())
+
+    async def _run_batch(batch: List[tuple]) -> None:
+        async with semaphore:
+            try:
+                embeddings = await _request_embeddings([text for _, text in batch])
+            except Exception as e:
+                logger.warning(f"批量向量化失败（{len(batch)} 条）: {e}")
+                for key, _ in batch:
+                    resolved[key] = e
+                return
+        for (key, _), embedding in zip(batch, embeddings):
+            set_cached_embedding(key, embedding)
+            _lru_put(key, embedding)
+            resolved[key] = embedding
+
+    async def _wait_inflight(key: str, text: str) -> None:
+        # 同一文本已有请求在进行，经 get_embedding 等待其结果
+        try:
+            resolved[key] = await get_embedding(text)
+        except Exception as e:
+            resolved[key] = e
+
+    tasks = [
+        _run_batch(missing_items[i:i + batch_size])
+        for i in range(0, len(missing_items), batch_size)
+    ]
+    tasks.extend(_wait_inflight(key, text) for key, text in waiting.items())
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    for pos, key in enumerate(keys):
+        if results[pos] is None:
+            results[pos] = resolved.get(key) or RuntimeError("向量化返回为空")
+    return results
@@ -0,0 +1,182 @@
+"""
+后台向量化队列
+聊天碎片等高频写入先以 embedding = NULL 入库并登记到 memory_embedding_queue，
+由后台 worker 批量补全向量，失败按指数退避重试。未补全的记录在混合检索中只参与关键词匹配。
+重试次数用尽（KB_EMBEDDING_QUEUE_MAX_ATTEMPTS）的任务从队列删除，记录保留为纯关键词检索。
+"""
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+import psycopg2.extras
+
+from ..db.dbutil import DatabaseUtil
+from ..system import config
+from . import retrieval_cache
+from .embedding import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+db = DatabaseUtil()
+
+# 领取任务后的租约时长（秒），worker 异常退出时到期自动被重新领取
+_CLAIM_LEASE_SECONDS = 300
+
+_wakeup = asyncio.Event()
+
+
+def notify_embedding_queue() -> None:
+    """有新任务入队时唤醒 worker，避免等待下一次轮询"""
+    _wakeup.set()
+
+
+def _claim_batch(limit: int) -> List[Dict]:
+    conn = db.get_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        # 清理重试次数已用尽且租约已过期的任务（worker 在最后一次尝试中异常退出的情况）
+        cursor.execute(
+            """
+            DELETE FROM memory_embedding_queue
+            WHERE next_attempt_at <= now() AND attempts >= %s
+            """,
+            (config.KB_EMBEDDING_QUEUE_MAX_ATTEMPTS,),
+        )
+        if cursor.rowcount:
+            logger.warning(f"后台向量化放弃 {cursor.rowcount} 条重试次数用尽的任务")
+        cursor.execute(
+            """
+            UPDATE memory_embedding_queue AS q
+            SET attempts = q.attempts + 1,
+                next_attempt_at = now() + make_interval(secs => %s)
+            FROM (
+                SELECT memory_id FROM memory_embedding_queue
+                WHERE next_attempt_at <= now() AND attempts < %s
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) AS c
+            WHERE q.memory_id = c.memory_id
+            RETURNING q.memory_id, q.attempts
+            """,
+            (_CLAIM_LEASE_SECONDS, config.KB_EMBEDDING_QUEUE_MAX_ATTEMPTS, limit),
+        )
+        claimed = {row["memory_id"]: row["attempts"] for row in cursor.fetchall()}
+        conn.commit()
+        if not claimed:
+            return []
+        cursor.execute(
+            "SELECT id, user_id, is_public, content FROM memory_units WHERE id = ANY(%s)",
+            (list(claimed.keys()),),
+        )
+        return [
+            {
+                "id": row["id"],
+                "user_id": row["user_id"],
+                "is_public": row["is_public"],
+                "content": row["content"],
+                "attempts": claimed[row["id"]],
+            }
+            for row in cursor.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def _store_results(done: List[Tuple[str, str]], failed: List[Tuple[str, int, str]]) -> None:
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        if done:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                UPDATE memory_units AS m
+                SET embedding = v.embedding
+                FROM (VALUES %s) AS v(id, embedding)
+                WHERE m.id = v.id
+                """,
+                done,
+                template="(%s, (%s)::vector)",
+            )
+            cursor.execute(
+                "DELETE FROM memory_embedding_queue WHERE memory_id = ANY(%s)",
+                ([memory_id for memory_id, _ in done],),
+            )
+        exhausted = [item for item in failed if item[1] >= config.KB_EMBEDDING_QUEUE_MAX_ATTEMPTS]
+        if exhausted:
+            cursor.execute(
+                "DELETE FROM memory_embedding_queue WHERE memory_id = ANY(%s)",
+                ([memory_id for memory_id, _, _ in exhausted],),
+            )
+            logger.warning(f"后台向量化放弃 {len(exhausted)} 条重试次数用尽的任务: {exhausted[0][2][:200]}")
+        for memory_id, attempts, error in failed:
+            if attempts >= config.KB_EMBEDDING_QUEUE_MAX_ATTEMPTS:
+                continue
+            backoff = min(
+                config.KB_EMBEDDING_QUEUE_BACKOFF_BASE * (2 ** max(attempts - 1, 0)),
+                config.KB_EMBEDDING_QUEUE_BACKOFF_MAX,
+            )
+            cursor.execute(
+                """
+                UPDATE memory_embedding_queue
+                SET next_attempt_at = now() + make_interval(secs => %s), last_error = %s
+                WHERE memory_id = %s
+                """,
+                (backoff, error[:500], memory_id),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def process_embedding_batch() -> int:
+    """处理一批待向量化记录，返回领取的条数"""
+    rows = await asyncio.to_thread(_claim_batch, config.KB_EMBEDDING_BATCH_SIZE * config.KB_EMBEDDING_BATCH_CONCURRENCY)
+    if not rows:
+        return 0
+
+    embeddings = await get_embeddings([row["content"] for row in rows])
+    done: List[Tuple[str, str]] = []
+    failed: List[Tuple[str, int, str]] = []
+    for row, embedding in zip(rows, embeddings):
+        if isinstance(embedding, Exception):
+            failed.append((row["id"], row["attempts"], str(embedding)))
+        else:
+            done.append((row["id"], "[" + ",".join(str(x) for x in embedding) + "]"))
+
+    await asyncio.to_thread(_store_results, done, failed)
+    if done:
+        # 补全向量后这些记录开始参与语义检索，相关用户的检索缓存需要失效
+        stored = {memory_id for memory_id, _ in done}
+        embedded = [row for row in rows if row["id"] in stored]
+        retrieval_cache.invalidate(
+            [row["user_id"] for row in embedded],
+            public=any(row["is_public"] == 1 for row in embedded),
+        )
+    if failed:
+        logger.warning(f"后台向量化失败 {len(failed)} 条，将退避重试: {failed[0][2]}")
+    return len(rows)
+
+
+async def embedding_queue_worker() -> None:
+    """后台向量化 worker：有任务时连续处理，空闲时等待唤醒或轮询"""
+    interval = config.KB_EMBEDDING_QUEUE_POLL_INTERVAL
+    logger.info(f"🧠 启动后台向量化任务，轮询间隔: {interval}秒")
+
+    while True:
+        try:
+            _wakeup.clear()
+            processed = await process_embedding_batch()
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            logger.info("🛑 后台向量化任务已停止")
+            break
+        except Exception as e:
+            logger.error(f"❌ 后台向量化任务异常: {e}")
+            await asyncio.sleep(30)
@@ -0,0 +1,113 @@
+"""
+知识库检索结果缓存
+- 按 (用户, 规范化查询文本, topk) 缓存 query_memory 的结果以及格式化后的上下文字符串
+- 短 TTL + LRU 上限；用户记忆变化时递增该用户版本号，公开记忆变化时递增全局公开版本号，
+  条目写入时记录版本号，读取时版本不一致即视为失效
+- 版本号存放在 Redis 中由所有 worker 共享，任一 worker 修改记忆后其他 worker 立即失效；
+  Redis 不可用时退回进程内版本号，此时其他 worker 最多在 KB_RETRIEVAL_CACHE_TTL 秒内读到旧结果
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+from ..cache.redis_cache import bump_kb_cache_versions, get_kb_cache_versions
+from ..system import config
+
+_WHITESPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_entries: "OrderedDict[Tuple[str, str, str, int], Tuple[float, Tuple, Any]]" = OrderedDict()
+# 进程内版本号（Redis 不可用时使用）：user_id -> (版本号, 递增时间)，按递增时间排序
+_user_versions: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+_public_version = 0
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：去首尾空白，连续空白合并为一个空格"""
+    return _WHITESPACE.sub(" ", (text or "").strip())
+
+
+def _versions(user_id: str) -> Tuple:
+    """当前版本号：优先取 Redis 中共享的版本号，带上来源以免与进程内版本号混用"""
+    shared = get_kb_cache_versions(user_id)
+    if shared is not None:
+        return ("redis",) + shared
+    with _lock:
+        return "local", _user_versions.get(user_id, (0, 0.0))[0], _public_version
+
+
+def snapshot(user_id: str) -> Tuple:
+    """取当前版本号（查询前调用，写入时带回，避免查询期间发生的修改被缓存覆盖）"""
+    return _versions(user_id)
+
+
+def get(kind: str, user_id: str, query: str, topk: int) -> Optional[Any]:
+    """
+    读取缓存
+
+    Args:
+        kind: 缓存类别（rows 为检索结果，context 为格式化后的上下文）
+        user_id: 用户ID
+        query: 查询文本
+        topk: 返回条数
+    """
+    if config.KB_RETRIEVAL_CACHE_TTL <= 0:
+        return None
+    key = (kind, user_id, normalize_query(query), topk)
+    with _lock:
+        if key not in _entries:
+            return None
+    versions = _versions(user_id)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        expires_at, entry_versions, value = entry
+        if expires_at < time.monotonic() or entry_versions != versions:
+            _entries.pop(key, None)
+            return None
+        _entries.move_to_end(key)
+        return value
+
+
+def put(kind: str, user_id: str, query: str, topk: int, value: Any, versions: Tuple) -> None:
+    """写入缓存（versions 为查询前 snapshot 的结果）"""
+    if config.KB_RETRIEVAL_CACHE_TTL <= 0:
+        return
+    key = (kind, user_id, normalize_query(query), topk)
+    if versions != _versions(user_id):
+        return
+    with _lock:
+        _entries[key] = (time.monotonic() + config.KB_RETRIEVAL_CACHE_TTL, versions, value)
+        _entries.move_to_end(key)
+        while len(_entries) > config.KB_RETRIEVAL_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate(user_ids: Iterable[str] = (), public: bool = False) -> None:
+    """
+    使缓存失效
+
+    Args:
+        user_ids: 记忆发生变化的用户
+        public: 是否涉及公开记忆（公开记忆对所有用户可见，需全部失效）
+    """
+    global _public_version
+    user_ids = list(set(user_ids))
+    # 版本号过期归零前至少经过一个条目有效期，旧条目已过期，不会重新生效
+    bump_kb_cache_versions(user_ids, public, max(3600, config.KB_RETRIEVAL_CACHE_TTL * 2))
+    now = time.monotonic()
+    with _lock:
+        for user_id in user_ids:
+            version = _user_versions.pop(user_id, (0, 0.0))[0]
+            _user_versions[user_id] = (version + 1, now)
+        if public:
+            _public_version += 1
+        # 清理超过一个条目有效期未变化的用户：按该版本号写入的条目均已过期，归零不影响正确性
+        while _user_versions:
+            user_id, (_, bumped_at) = next(iter(_user_versions.items()))
+            if now - bumped_at <= config.KB_RETRIEVAL_CACHE_TTL:
+                break
+            del _user_versions[user_id]
@@ -2,6 +2,8 @@
 Knowledge base service layer.
 Shared by HTTP API and MCP.
 """
+import asyncio
+import logging
 import uuid
 import json
 from datetime import datetime
@@ -9,13 +11,67 @@ from zoneinfo import ZoneInfo
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Tuple
 
-import httpx
 import psycopg2.extras
 
 from ..db.dbutil import DatabaseUtil
 from ..system import config
+from .embedding import get_embedding, get_embeddings
+from .embedding_queue import notify_embedding_queue
+from . import retrieval_cache
 
 db = DatabaseUtil()
+logger = logging.getLogger(__name__)
+
+# pgvector 是否支持 hnsw.iterative_scan（首次设置失败后不再尝试）
+_iterative_scan_supported = True
+
+# 用户一路候选：走全局 HNSW 索引（依赖迭代扫描补足过滤后的结果）
+_USER_ANN_INDEX = """
+                    SELECT id FROM memory_units
+                    WHERE user_id = %(user_id)s AND status = 1 AND embedding IS NOT NULL
+                    ORDER BY embedding <=> %(embedding)s::vector
+                    LIMIT %(candidates)s
+"""
+
+# 用户一路候选：按 user_id 索引取出该用户全部记录精确排序（OFFSET 0 阻止改走 HNSW）
+_USER_ANN_EXACT = """
+                    SELECT id FROM (
+                        SELECT id, embedding <=> %(embedding)s::vector AS distance
+                        FROM memory_units
+                        WHERE user_id = %(user_id)s AND status = 1 AND embedding IS NOT NULL
+                        OFFSET 0
+                    ) AS scoped
+                    ORDER BY distance
+                    LIMIT %(candidates)s
+"""
+
+
+def _count_user_memories(cursor, user_id: str, limit: int) -> int:
+    """统计用户的有效记忆条数，最多数到 limit + 1"""
+    cursor.execute(
+        """
+        SELECT COUNT(*) AS count FROM (
+            SELECT 1 FROM memory_units WHERE user_id = %s AND status = 1 LIMIT %s
+        ) AS t
+        """,
+        (user_id, limit + 1),
+    )
+    return cursor.fetchone()["count"]
+
+
+def _set_iterative_scan(cursor) -> None:
+    global _iterative_scan_supported
+    if not config.KB_HNSW_ITERATIVE_SCAN or not _iterative_scan_supported:
+        return
+    cursor.execute("SAVEPOINT kb_iterative_scan")
+    try:
+        cursor.execute("SET LOCAL hnsw.iterative_scan = %s", (config.KB_HNSW_ITERATIVE_SCAN,))
+        cursor.execute("RELEASE SAVEPOINT kb_iterative_scan")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT kb_iterative_scan")
+        _iterative_scan_supported = False
+        logger.warning(f"pgvector 不支持 hnsw.iterative_scan，已停用: {e}")
+
 
 def _ensure_user_exists(user_id: str) -> None:
     if not user_id:
@@ -30,43 +86,24 @@ def _ensure_user_exists(user_id: str) -> None:
         conn.close()
 
 
-async def get_embedding(text: str) -> List[float]:
-    if not config.BIGMODEL_API_KEY:
-        raise RuntimeError("BIGMODEL_API_KEY 未配置")
-    payload = {
-        "model": config.BIGMODEL_EMBEDDING_MODEL,
-        "input": text,
-        "dimensions": config.BIGMODEL_EMBEDDING_DIMENSIONS,
-    }
-    headers = {
-        "Authorization": f"Bearer {config.BIGMODEL_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            "https://open.bigmodel.cn/api/paas/v4/embeddings",
-            json=payload,
-            headers=headers,
-        )
-    if resp.status_code != 200:
-        raise RuntimeError(f"向量化失败: {resp.text}")
-    data = resp.json()
-    embedding = data.get("data", [{}])[0].get("embedding")
-    if not embedding:
-        raise RuntimeError("向量化返回为空")
-    return embedding
-
-
 async def add_memory(
     user_id: str,
     memory_type: str,
     content: str,
     title: Optional[str] = None,
     is_public: int = 0,
+    defer_embedding: bool = False,
 ) -> Dict[str, Any]:
+    """
+    新增记忆
+
+    defer_embedding=True 时先以 embedding = NULL 入库并登记到后台向量化队列，
+    不在请求路径上等待远程向量化（用于聊天碎片等高频写入）。
+    """
     _ensure_user_exists(user_id)
     embedding_str = None
-    if config.KB_USE_VECTOR:
+    enqueue = defer_embedding and config.KB_USE_VECTOR
+    if config.KB_USE_VECTOR and not enqueue:
         embedding = await get_embedding(content)
         embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
     now = datetime.utcnow()
@@ -115,7 +152,15 @@ async def add_memory(
                 ),
             )
         row = cursor.fetchone()
+        if enqueue:
+            cursor.execute(
+                "INSERT INTO memory_embedding_queue (memory_id) VALUES (%s) ON CONFLICT (memory_id) DO NOTHING",
+                (memory_id,),
+            )
         conn.commit()
+        retrieval_cache.invalidate([user_id], public=bool(is_public))
+        if enqueue:
+            notify_embedding_queue()
         return {
             "id": row["id"],
             "user_id": row["user_id"],
@@ -145,7 +190,7 @@ async def update_memory(
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     try:
         cursor.execute(
-            "SELECT id, user_id FROM memory_units WHERE id = %s",
+            "SELECT id, user_id, is_public FROM memory_units WHERE id = %s",
             (memory_id,),
         )
         row = cursor.fetchone()
@@ -153,6 +198,7 @@ async def update_memory(
             raise RuntimeError("记忆不存在")
         if row["user_id"] != user_id:
             raise RuntimeError("无权限修改该记忆")
+        was_public = row["is_public"] == 1
 
         fields = []
         params: List[object] = []
@@ -201,6 +247,7 @@ async def update_memory(
         )
         updated = cursor.fetchone()
         conn.commit()
+        retrieval_cache.invalidate([user_id], public=was_public or updated["is_public"] == 1)
         return {
             "id": updated["id"],
             "user_id": updated["user_id"],
@@ -222,7 +269,7 @@ async def delete_memory(user_id: str, memory_id: str) -> None:
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     try:
         cursor.execute(
-            "SELECT id, user_id FROM memory_units WHERE id = %s",
+            "SELECT id, user_id, is_public FROM memory_units WHERE id = %s",
             (memory_id,),
         )
         row = cursor.fetchone()
@@ -232,6 +279,7 @@ async def delete_memory(user_id: str, memory_id: str) -> None:
             raise RuntimeError("无权限删除该记忆")
         cursor.execute("DELETE FROM memory_units WHERE id = %s", (memory_id,))
         conn.commit()
+        retrieval_cache.invalidate([user_id], public=row["is_public"] == 1)
     finally:
         conn.close()
 
@@ -243,18 +291,52 @@ async def query_memory(
 ) -> List[Dict[str, Any]]:
     _ensure_user_exists(user_id)
     topk = max(1, min(topk, 50))
+    cached = retrieval_cache.get("rows", user_id, content, topk)
+    if cached is not None:
+        return [dict(row) for row in cached]
+    versions = retrieval_cache.snapshot(user_id)
 
     conn = db.get_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     try:
+        candidates = max(topk * 3, config.KB_RETRIEVAL_CANDIDATES)
         if config.KB_USE_VECTOR:
+            # 三路候选分别走索引：用户向量（ANN 或小用户精确排序）、公开向量 ANN（部分 HNSW 索引）、关键词 GIN，
+            # 合并后按 0.55 * 语义 + 0.45 * 关键词重排。
+            # 尚未补全向量（embedding IS NULL）的记录只会从关键词一路进入候选，语义分为 0。
             embedding = await get_embedding(content)
             embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
+            cursor.execute("SET LOCAL hnsw.ef_search = %s", (max(config.KB_HNSW_EF_SEARCH, candidates),))
+            _set_iterative_scan(cursor)
+            # 记忆少的用户在全局 HNSW 近邻中占比很低，过滤后可能取不到结果，改为精确计算
+            exact = _count_user_memories(cursor, user_id, config.KB_EXACT_SCAN_MAX_ROWS) <= config.KB_EXACT_SCAN_MAX_ROWS
             cursor.execute(
                 """
-                WITH query AS (
-                    SELECT (%s)::vector AS embedding,
-                           plainto_tsquery('simple', %s) AS tsq
+                WITH user_ann AS (""" + (_USER_ANN_EXACT if exact else _USER_ANN_INDEX) + """                ),
+                public_ann AS (
+                    SELECT id FROM memory_units
+                    WHERE is_public = 1 AND status = 1 AND embedding IS NOT NULL
+                    ORDER BY embedding <=> %(embedding)s::vector
+                    LIMIT %(candidates)s
+                ),
+                keyword AS (
+                    SELECT id FROM memory_units
+                    WHERE content_tsv @@ plainto_tsquery('simple', %(content)s)
+                      AND status = 1
+                      AND (user_id = %(user_id)s OR is_public = 1)
+                    ORDER BY ts_rank(content_tsv, plainto_tsquery('simple', %(content)s)) DESC
+                    LIMIT %(candidates)s
+                ),
+                candidates AS (
+                    SELECT id FROM user_ann
+                    UNION
+                    SELECT id FROM public_ann
+                    UNION
+                    SELECT id FROM keyword
+                ),
+                query AS (
+                    SELECT %(embedding)s::vector AS embedding,
+                           plainto_tsquery('simple', %(content)s) AS tsq
                 )
                 SELECT
                     m.id,
@@ -268,13 +350,19 @@ async def query_memory(
                     COALESCE((1 - (m.embedding <=> query.embedding)), 0) AS semantic_score,
                     ts_rank(m.content_tsv, query.tsq) AS keyword_score,
                     (0.55 * COALESCE((1 - (m.embedding <=> query.embedding)), 0) + 0.45 * ts_rank(m.content_tsv, query.tsq)) AS final_score
-                FROM memory_units m, query
-                WHERE m.status = 1
-                  AND (m.user_id = %s OR m.is_public = 1)
+                FROM candidates c
+                JOIN memory_units m ON m.id = c.id
+                CROSS JOIN query
                 ORDER BY final_score DESC
-                LIMIT %s
+                LIMIT %(topk)s
                 """,
-                (embedding_str, content, user_id, topk),
+                {
+                    "embedding": embedding_str,
+                    "content": content,
+                    "user_id": user_id,
+                    "candidates": candidates,
+                    "topk": topk,
+                },
             )
         else:
             cursor.execute(
@@ -295,7 +383,8 @@ async def query_memory(
                     ts_rank(m.content_tsv, query.tsq) AS keyword_score,
                     ts_rank(m.content_tsv, query.tsq) AS final_score
                 FROM memory_units m, query
-                WHERE m.status = 1
+                WHERE m.content_tsv @@ query.tsq
+                  AND m.status = 1
                   AND (m.user_id = %s OR m.is_public = 1)
                 ORDER BY final_score DESC
                 LIMIT %s
@@ -320,7 +409,8 @@ async def query_memory(
                     "final_score": float(row["final_score"] or 0),
                 }
             )
-        return results
+        retrieval_cache.put("rows", user_id, content, topk, results, versions)
+        return [dict(row) for row in results]
     finally:
         conn.close()
 
@@ -373,6 +463,8 @@ async def clear_chat_fragments(user_id: str) -> int:
         )
         deleted = cursor.rowcount or 0
         conn.commit()
+        if deleted:
+            retrieval_cache.invalidate([user_id])
         return deleted
     finally:
         conn.close()
@@ -397,90 +489,141 @@ def _parse_kb_param_content(content: Optional[str]) -> Dict[str, Any]:
         data["last_created_at"] = datetime.fromisoformat(last_created_at)
     except Exception as exc:
         raise RuntimeError("last_created_at 不是合法的 ISO 时间字符串") from exc
+    last_id = data.get("last_id")
+    if last_id is not None and (not isinstance(last_id, str) or not last_id.strip()):
+        raise RuntimeError("last_id 必须是非空字符串")
     return data
 
 
-async def dump_unprocessed_chat_records(user_id: str, output_dir: str) -> Tuple[str, int]:
-    _ensure_user_exists(user_id)
+def _read_memory_progress(cursor, user_id: str) -> Dict[str, Any]:
+    cursor.execute(
+        """
+        SELECT content, updated_at
+        FROM memory_units
+        WHERE user_id = %s
+          AND status = 1
+          AND memory_type = %s
+          AND title = %s
+        ORDER BY updated_at DESC NULLS LAST, created_at DESC
+        LIMIT 1
+        """,
+        (user_id, "参数", "已整理记忆参数"),
+    )
+    param_row = cursor.fetchone()
+    return _parse_kb_param_content(param_row["content"] if param_row else None)
+
+
+def _stream_chat_records(user_id: str, file_path: str, limit: Optional[int]) -> Tuple[int, Optional[Dict[str, Any]]]:
+    """
+    用服务端命名游标按 (created_at, id) 升序流式读取水位之后的聊天记录，边读边写入文件，
+    内存占用与记录总数无关。返回导出条数与最后一条记录的水位。
+    """
     conn = db.get_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    stream = None
     try:
-        cursor.execute(
-            """
-            SELECT content, updated_at
-            FROM memory_units
-            WHERE user_id = %s
-              AND status = 1
-              AND memory_type = %s
-              AND title = %s
-            ORDER BY updated_at DESC NULLS LAST, created_at DESC
-            LIMIT 1
+        params = _read_memory_progress(cursor, user_id)
+
+        conditions = ["s.user_id = %s"]
+        args: List[Any] = [user_id]
+        last_created_at = params.get("last_created_at")
+        if last_created_at and params.get("last_id"):
+            # 同一时间戳下按 id 断点续传，避免漏记或重复
+            conditions.append("(m.created_at, m.id) > (%s, %s)")
+            args.extend([last_created_at, params["last_id"]])
+        elif last_created_at:
+            conditions.append("m.created_at > %s")
+            args.append(last_created_at)
+        limit_sql = ""
+        if limit:
+            limit_sql = "LIMIT %s"
+            args.append(limit)
+
+        stream = conn.cursor(name=f"dump_chat_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+        stream.itersize = config.KB_DUMP_FETCH_SIZE
+        stream.execute(
+            f"""
+            SELECT m.id, m.session_id, m.sequence_number, m.sender_type, m.content, m.created_at
+            FROM chat_messages m
+            JOIN chat_sessions s ON s.id = m.session_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY m.created_at, m.id
+            {limit_sql}
             """,
-            (user_id, "参数", "已整理记忆参数"),
+            tuple(args),
         )
-        param_row = cursor.fetchone()
-        params = _parse_kb_param_content(param_row["content"] if param_row else None)
 
-        last_created_at = params.get("last_created_at")
-        if last_created_at:
-            cursor.execute(
-                """
-                SELECT m.id, m.session_id, m.sequence_number, m.sender_type, m.content, m.created_at
-                FROM chat_messages m
-                JOIN chat_sessions s ON s.id = m.session_id
-                WHERE s.user_id = %s
-                  AND m.created_at > %s
-                ORDER BY m.created_at DESC, m.id DESC
-                LIMIT 500
-                """,
-                (user_id, last_created_at),
-            )
-        else:
-            cursor.execute(
-                """
-                SELECT m.id, m.session_id, m.sequence_number, m.sender_type, m.content, m.created_at
-                FROM chat_messages m
-                JOIN chat_sessions s ON s.id = m.session_id
-                WHERE s.user_id = %s
-                ORDER BY m.created_at DESC, m.id DESC
-                LIMIT 500
-                """,
-                (user_id,),
-            )
-        rows = cursor.fetchall()
+        count = 0
+        last_row = None
+        current_session = None
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("当前未处理聊天记录：")
+            if params:
+                f.write(f"\n进度参数: {params}")
+            for row in stream:
+                session_id = row.get("session_id") or ""
+                if session_id != current_session:
+                    current_session = session_id
+                    f.write(f"\n\n会话 {session_id}:")
+                f.write(
+                    f"\n- {row.get('sequence_number')} | {row.get('sender_type')} | {row.get('created_at')}\n"
+                    f"  {row.get('content') or ''}"
+                )
+                count += 1
+                last_row = row
+            if not count:
+                f.write("\n无未处理记录")
+
+        watermark = None
+        if last_row is not None:
+            watermark = {
+                "last_created_at": last_row["created_at"].isoformat() if last_row["created_at"] else None,
+                "last_id": last_row["id"],
+            }
+            with open(file_path, "a", encoding="utf-8") as f:
+                f.write(f"\n\n导出水位: {json.dumps(watermark, ensure_ascii=False)}")
+        return count, watermark
     finally:
+        if stream is not None and not stream.closed:
+            stream.close()
         conn.close()
 
+
+async def dump_unprocessed_chat_records(
+    user_id: str,
+    output_dir: str,
+    limit: Optional[int] = None,
+) -> Tuple[str, int, Optional[Dict[str, Any]]]:
+    """
+    导出水位之后的聊天记录到 txt 文件
+
+    按时间升序流式导出，limit 为空时导出全部积压记录。返回 (文件路径, 条数, 水位)，
+    水位为最后一条记录的 {last_created_at, last_id}，整理完成后写回进度即可从该处继续。
+    """
+    _ensure_user_exists(user_id)
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     filename = f"unprocessed_chat_records_{user_id}_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.txt"
     file_path = str(Path(output_dir) / filename)
+    count, watermark = await asyncio.to_thread(_stream_chat_records, user_id, file_path, limit)
+    return file_path, count, watermark
 
-    lines: List[str] = ["当前未处理聊天记录："]
-    if params:
-        lines.append(f"进度参数: {params}")
-    if not rows:
-        lines.append("无未处理记录")
-    else:
-        current_session = None
-        for row in rows:
-            session_id = row.get("session_id") or ""
-            if session_id != current_session:
-                current_session = session_id
-                lines.append(f"\n会话 {session_id}:")
-            lines.append(
-                f"- {row.get('sequence_number')} | {row.get('sender_type')} | {row.get('created_at')}\n"
-                f"  {row.get('content') or ''}"
-            )
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-    return file_path, len(rows)
 
+async def set_memory_progress_now(user_id: str, watermark: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    更新已整理记忆进度
 
-async def set_memory_progress_now(user_id: str) -> Dict[str, Any]:
+    watermark 为导出时返回的 {last_created_at, last_id} 时写入该水位（下次从其后继续导出），
+    否则写入当前北京时间。
+    """
     _ensure_user_exists(user_id)
-    payload = {"last_created_at": datetime.now(ZoneInfo("Asia/Shanghai")).isoformat()}
+    if watermark and watermark.get("last_created_at"):
+        payload = {"last_created_at": watermark["last_created_at"]}
+        if watermark.get("last_id"):
+            payload["last_id"] = watermark["last_id"]
+    else:
+        payload = {"last_created_at": datetime.now(ZoneInfo("Asia/Shanghai")).isoformat()}
     content = json.dumps(payload, ensure_ascii=False)
+    _parse_kb_param_content(content)
 
     conn = db.get_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -511,6 +654,7 @@ async def set_memory_progress_now(user_id: str) -> Dict[str, Any]:
             )
             updated = cursor.fetchone()
             conn.commit()
+            retrieval_cache.invalidate([user_id])
             return {
                 "id": updated["id"],
                 "content": updated["content"],
@@ -528,6 +672,7 @@ async def set_memory_progress_now(user_id: str) -> Dict[str, Any]:
         )
         created = cursor.fetchone()
         conn.commit()
+        retrieval_cache.invalidate([user_id])
         return {
             "id": created["id"],
             "content": created["content"],
@@ -537,39 +682,237 @@ async def set_memory_progress_now(user_id: str) -> Dict[str, Any]:
         conn.close()
 
 
+def _existing_user_ids(cursor, user_ids: List[str]) -> set:
+    if not user_ids:
+        return set()
+    cursor.execute("SELECT id FROM users WHERE id = ANY(%s)", (list(user_ids),))
+    return {row["id"] for row in cursor.fetchall()}
+
+
+def _embedding_literal(embedding: Optional[List[float]]) -> Optional[str]:
+    if embedding is None:
+        return None
+    return "[" + ",".join(str(x) for x in embedding) + "]"
+
+
 async def add_memory_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    results: List[Dict[str, Any]] = []
-    for item in items:
+    """
+    批量新增记忆：一次校验用户、批量向量化、execute_values 单语句写入。
+    返回与 items 一一对应的结果，单条失败不影响其他条目。
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    pending: List[Dict[str, Any]] = []
+    for pos, item in enumerate(items):
+        user_id = (item.get("user_id") or "").strip()
+        memory_type = (item.get("memory_type") or "").strip()
+        content = (item.get("content") or "").strip()
+        if not user_id:
+            results[pos] = {"ok": False, "error": "user_id 不能为空"}
+            continue
+        if not memory_type or not content:
+            results[pos] = {"ok": False, "error": "memory_type 和 content 不能为空"}
+            continue
         try:
-            row = await add_memory(
-                user_id=(item.get("user_id") or "").strip(),
-                memory_type=(item.get("memory_type") or "").strip(),
-                title=item.get("title"),
-                content=(item.get("content") or "").strip(),
-                is_public=int(item.get("is_public") or 0),
-            )
-            results.append({"ok": True, "id": row.get("id")})
-        except Exception as exc:
-            results.append({"ok": False, "error": str(exc)})
+            is_public = int(item.get("is_public") or 0)
+        except (TypeError, ValueError):
+            results[pos] = {"ok": False, "error": "is_public 参数无效"}
+            continue
+        pending.append({
+            "pos": pos,
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "memory_type": memory_type,
+            "title": item.get("title"),
+            "content": content,
+            "is_public": is_public,
+        })
+
+    conn = db.get_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        existing = _existing_user_ids(cursor, list({row["user_id"] for row in pending}))
+        valid = []
+        for row in pending:
+            if row["user_id"] in existing:
+                valid.append(row)
+            else:
+                results[row["pos"]] = {"ok": False, "error": "用户不存在"}
+
+        if valid and config.KB_USE_VECTOR:
+            embeddings = await get_embeddings([row["content"] for row in valid])
+            embedded = []
+            for row, embedding in zip(valid, embeddings):
+                if isinstance(embedding, Exception):
+                    results[row["pos"]] = {"ok": False, "error": str(embedding)}
+                else:
+                    row["embedding"] = _embedding_literal(embedding)
+                    embedded.append(row)
+            valid = embedded
+
+        if valid:
+            now = datetime.utcnow()
+            try:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    INSERT INTO memory_units
+                    (id, user_id, memory_type, title, content, embedding, status, is_public, created_at, updated_at)
+                    VALUES %s
+                    """,
+                    [
+                        (
+                            row["id"],
+                            row["user_id"],
+                            row["memory_type"],
+                            row["title"],
+                            row["content"],
+                            row.get("embedding"),
+                            row["is_public"],
+                            now,
+                            now,
+                        )
+                        for row in valid
+                    ],
+                    template="(%s, %s, %s, %s, %s, (%s)::vector, 1, %s, %s, %s)",
+                )
+                conn.commit()
+                retrieval_cache.invalidate(
+                    [row["user_id"] for row in valid],
+                    public=any(row["is_public"] == 1 for row in valid),
+                )
+                for row in valid:
+                    results[row["pos"]] = {"ok": True, "id": row["id"]}
+            except Exception as exc:
+                conn.rollback()
+                for row in valid:
+                    results[row["pos"]] = {"ok": False, "error": str(exc)}
+    finally:
+        conn.close()
     return results
 
 
 async def update_memory_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    results: List[Dict[str, Any]] = []
-    for item in items:
+    """
+    批量更新记忆：一次校验用户与归属、批量向量化、UPDATE ... FROM (VALUES ...) 单语句写入。
+    返回与 items 一一对应的结果，单条失败不影响其他条目。
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    pending: List[Dict[str, Any]] = []
+    for pos, item in enumerate(items):
+        user_id = (item.get("user_id") or "").strip()
+        memory_id = (item.get("memory_id") or "").strip()
+        if not user_id:
+            results[pos] = {"ok": False, "error": "user_id 不能为空"}
+            continue
+        if not memory_id:
+            results[pos] = {"ok": False, "error": "memory_id 不能为空"}
+            continue
         try:
-            row = await update_memory(
-                user_id=(item.get("user_id") or "").strip(),
-                memory_id=(item.get("memory_id") or "").strip(),
-                memory_type=item.get("memory_type"),
-                title=item.get("title"),
-                content=item.get("content"),
-                is_public=int(item.get("is_public")) if item.get("is_public") is not None else None,
-                status=int(item.get("status")) if item.get("status") is not None else None,
+            is_public = int(item.get("is_public")) if item.get("is_public") is not None else None
+            status = int(item.get("status")) if item.get("status") is not None else None
+        except (TypeError, ValueError):
+            results[pos] = {"ok": False, "error": "is_public/status 参数无效"}
+            continue
+        row = {
+            "pos": pos,
+            "user_id": user_id,
+            "memory_id": memory_id,
+            "memory_type": item.get("memory_type"),
+            "title": item.get("title"),
+            "content": item.get("content"),
+            "is_public": is_public,
+            "status": status,
+            "embedding": None,
+        }
+        if all(row[field] is None for field in ("memory_type", "title", "content", "is_public", "status")):
+            results[pos] = {"ok": False, "error": "没有可更新字段"}
+            continue
+        pending.append(row)
+
+    conn = db.get_connection()
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        existing = _existing_user_ids(cursor, list({row["user_id"] for row in pending}))
+        owners: Dict[str, str] = {}
+        public_ids: set = set()
+        if pending:
+            cursor.execute(
+                "SELECT id, user_id, is_public FROM memory_units WHERE id = ANY(%s)",
+                (list({row["memory_id"] for row in pending}),),
             )
-            results.append({"ok": True, "id": row.get("id")})
-        except Exception as exc:
-            results.append({"ok": False, "error": str(exc)})
+            fetched = cursor.fetchall()
+            owners = {r["id"]: r["user_id"] for r in fetched}
+            public_ids = {r["id"] for r in fetched if r["is_public"] == 1}
+
+        valid = []
+        for row in pending:
+            if row["user_id"] not in existing:
+                results[row["pos"]] = {"ok": False, "error": "用户不存在"}
+            elif row["memory_id"] not in owners:
+                results[row["pos"]] = {"ok": False, "error": "记忆不存在"}
+            elif owners[row["memory_id"]] != row["user_id"]:
+                results[row["pos"]] = {"ok": False, "error": "无权限修改该记忆"}
+            else:
+                valid.append(row)
+
+        with_content = [row for row in valid if row["content"] is not None]
+        if with_content and config.KB_USE_VECTOR:
+            embeddings = await get_embeddings([row["content"] for row in with_content])
+            failed = set()
+            for row, embedding in zip(with_content, embeddings):
+                if isinstance(embedding, Exception):
+                    results[row["pos"]] = {"ok": False, "error": str(embedding)}
+                    failed.add(row["pos"])
+                else:
+                    row["embedding"] = _embedding_literal(embedding)
+            valid = [row for row in valid if row["pos"] not in failed]
+
+        if valid:
+            now = datetime.utcnow()
+            try:
+                # content 有变化时同步替换向量（未启用向量检索时置空），否则保留原向量
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    UPDATE memory_units AS m
+                    SET memory_type = COALESCE(v.memory_type, m.memory_type),
+                        title = COALESCE(v.title, m.title),
+                        content = COALESCE(v.content, m.content),
+                        is_public = COALESCE(v.is_public, m.is_public),
+                        status = COALESCE(v.status, m.status),
+                        embedding = CASE WHEN v.content IS NULL THEN m.embedding ELSE v.embedding END,
+                        updated_at = v.updated_at
+                    FROM (VALUES %s) AS v(id, memory_type, title, content, is_public, status, embedding, updated_at)
+                    WHERE m.id = v.id
+                    """,
+                    [
+                        (
+                            row["memory_id"],
+                            row["memory_type"],
+                            row["title"],
+                            row["content"],
+                            row["is_public"],
+                            row["status"],
+                            row["embedding"],
+                            now,
+                        )
+                        for row in valid
+                    ],
+                    template="(%s, %s::text, %s::text, %s::text, %s::smallint, %s::smallint, (%s)::vector, %s::timestamptz)",
+                )
+                conn.commit()
+                retrieval_cache.invalidate(
+                    [row["user_id"] for row in valid],
+                    public=any(row["memory_id"] in public_ids or row["is_public"] == 1 for row in valid),
+                )
+                for row in valid:
+                    results[row["pos"]] = {"ok": True, "id": row["memory_id"]}
+            except Exception as exc:
+                conn.rollback()
+                for row in valid:
+                    results[row["pos"]] = {"ok": False, "error": str(exc)}
+    finally:
+        conn.close()
     return results
 
 
@@ -1,7 +1,9 @@
 """MCP tools package and config helpers."""
 import copy
 import json
-from typing import Dict, List, Any
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
 
 import psycopg2.extras
 
@@ -21,6 +23,13 @@ from .kbs_custom_mcp import kbs_mcp
 db = DatabaseUtil()
 
 
+# 预先构建的 MCP 配置：全局配置与 SDK 服务器只构建一次，用户配置按用户缓存
+_bundle_lock = threading.Lock()
+_global_servers: Optional[Dict[str, Dict[str, Any]]] = None
+_sdk_servers: Optional[Dict[str, Any]] = None
+_user_bundles: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+
 def get_mcp_servers() -> Dict[str, Dict[str, Any]]:
     """Return MCP server configs shared by all agents."""
     return copy.deepcopy(config.GLOBAL_MCP_SERVERS)
@@ -31,20 +40,10 @@ def get_mcp_allowed_tools() -> List[str]:
     return config.MCP_ALLOWED_TOOLS
 
 
-def get_user_mcp_servers(user_id: str) -> Dict[str, Dict[str, Any]]:
-    """
-    获取用户自定义的 MCP 服务器配置
-
-    Args:
-        user_id: 用户ID
-
-    Returns:
-        用户自定义的 MCP 服务器配置字典
-    """
+def _load_user_mcp_servers(user_id: str) -> Dict[str, Dict[str, Any]]:
     user_mcps = {}
-
+    conn = db._get_connection()
     try:
-        conn = db._get_connection()
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
         cursor.execute(
@@ -80,46 +79,90 @@ def get_user_mcp_servers(user_id: str) -> Dict[str, Dict[str, Any]]:
                 mcp_config["args"] = json.loads(row["args"])
 
             user_mcps[row["name"]] = mcp_config
-
+    finally:
         conn.close()
 
+    return user_mcps
+
+
+def get_user_mcp_servers(user_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    获取用户自定义的 MCP 服务器配置
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        用户自定义的 MCP 服务器配置字典
+    """
+    try:
+        return _load_user_mcp_servers(user_id)
     except Exception as e:
         print(f"获取用户 MCP 配置失败: {e}")
-
-    return user_mcps
+        return {}
+
+
+def _get_base_bundles() -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+    """全局配置与 SDK MCP 服务器（进程内，无需独立进程），首次调用时构建"""
+    global _global_servers, _sdk_servers
+    if _global_servers is None or _sdk_servers is None:
+        sdk_servers = {
+            "pixabay-media": pixabay_mcp,
+            "pexels-media": pexels_mcp,
+            "polyhaven-3d": polyhaven_mcp,
+            "lordicon": lordicon_mcp,
+            "drawio-export": drawio_mcp,
+            "kroki-render": kroki_mcp,
+            "send": email_mcp,
+            "task-custom": task_custom_mcp,
+        }
+        if config.KB_ENABLED:
+            sdk_servers["kbs-memory"] = kbs_mcp
+        _sdk_servers = sdk_servers
+        _global_servers = get_mcp_servers()
+    return _global_servers, _sdk_servers
+
+
+def invalidate_user_mcp_servers(user_id: str) -> None:
+    """用户安装/删除 MCP 后调用，下次创建客户端时重新读取配置"""
+    with _bundle_lock:
+        _user_bundles.pop(user_id, None)
 
 
 def get_all_mcp_servers(user_id: str = None) -> Dict[str, Dict[str, Any]]:
     """
     获取所有 MCP 服务器配置（包括全局配置、用户自定义配置和 SDK MCP）
 
+    结果按用户缓存，稳态下创建客户端不再查询 mcps 表；返回的是缓存的浅拷贝，调用方不应修改其中的配置项。
+
     Args:
         user_id: 用户ID（可选），如果提供则包含用户自定义配置
 
     Returns:
         所有 MCP 服务器配置字典
     """
-    # 获取全局配置
-    all_mcps = get_mcp_servers()
+    global_servers, sdk_servers = _get_base_bundles()
+    if not user_id:
+        return {**global_servers, **sdk_servers}
 
-    # 如果提供了用户ID，合并用户自定义配置
-    if user_id:
-        user_mcps = get_user_mcp_servers(user_id)
-        all_mcps.update(user_mcps)
+    now = time.monotonic()
+    with _bundle_lock:
+        cached = _user_bundles.get(user_id)
+    if cached and cached[0] > now:
+        return dict(cached[1])
 
-    # 添加 SDK MCP 服务器（进程内，无需独立进程）
-    all_mcps["pixabay-media"] = pixabay_mcp
-    all_mcps["pexels-media"] = pexels_mcp
-    all_mcps["polyhaven-3d"] = polyhaven_mcp
-    all_mcps["lordicon"] = lordicon_mcp
-    all_mcps["drawio-export"] = drawio_mcp
-    all_mcps["kroki-render"] = kroki_mcp
-    all_mcps["send"] = email_mcp
-    all_mcps["task-custom"] = task_custom_mcp
-    if config.KB_ENABLED:
-        all_mcps["kbs-memory"] = kbs_mcp
+    try:
+        user_mcps = _load_user_mcp_servers(user_id)
+    except Exception as e:
+        # 读取失败时不缓存，仅返回全局配置
+        print(f"获取用户 MCP 配置失败: {e}")
+        return {**global_servers, **sdk_servers}
 
-    return all_mcps
+    # 用户配置可覆盖同名全局配置，SDK 服务器优先级最高
+    bundle = {**global_servers, **user_mcps, **sdk_servers}
+    with _bundle_lock:
+        _user_bundles[user_id] = (now + config.MCP_USER_CONFIG_CACHE_TTL, bundle)
+    return dict(bundle)
 
 
 __all__ = [
@@ -135,4 +178,5 @@ __all__ = [
     "get_mcp_allowed_tools",
     "get_user_mcp_servers",
     "get_all_mcp_servers",
+    "invalidate_user_mcp_servers",
 ]
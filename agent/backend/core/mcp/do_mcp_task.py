@@ -1,13 +1,36 @@
 """
 定时任务执行器
 负责调度并触发 MCP 任务执行
+
+多进程/多节点部署：
+- 通过 PostgreSQL advisory lock 选出一个主节点运行 APScheduler（按时触发），
+  持锁连接断开时锁自动释放，其他节点在下一轮检查中接管
+- 任务执行前按行领取（FOR UPDATE SKIP LOCKED + status='running'），同一次触发只会被一个节点执行
+- 所有节点定期按 next_run_at 领取到期任务，按本节点空闲名额分担执行，主节点漏触发时也能补上
+- 只有集群停机（所有节点超过 TASK_MISFIRE_GRACE_SECONDS 未轮询）期间错过的触发、以及租约回收的任务
+  按 misfire 跳过；集群运行中因名额不足排队的到期任务延后照常执行
+
+领取后的任务进入派发阶段：cron 任务随机抖动打散整点触发，按优先级排队，
+受全局与单用户并发上限约束，agent 客户端过多时延后低优先级任务。
+默认在进程内直接把任务消息入队聊天处理流程，TASK_DISPATCH_MODE=http 时退回调用
+/api/v1/chat/send（任务由远程节点执行）。
 """
 import asyncio
+import heapq
+import itertools
 import logging
-from datetime import datetime
-from typing import Optional
+import os
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import httpx
+import psycopg2
+import psycopg2.extras
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
@@ -21,6 +44,45 @@ db = DatabaseUtil()
 
 _scheduler: Optional[AsyncIOScheduler] = None
 
+# 调度主节点 advisory lock 键（全库唯一）
+_LEADER_LOCK_KEY = 0x51427461
+# APScheduler 触发时允许提前领取的秒数（应用与数据库时钟的微小偏差）
+_CLAIM_EARLY_SECONDS = 5
+
+# 持有（或尝试获取）advisory lock 的专用连接，不占用连接池
+_lock_conn = None
+_is_leader = False
+_coordinator: Optional["asyncio.Task"] = None
+# 主节点已注册的调度：task_id -> (schedule_type, cron_expr, run_at)
+_job_specs: Dict[str, Tuple] = {}
+# 本节点正在执行的任务
+_local_runs: Set["asyncio.Task"] = set()
+# 本节点已领取（status = 'running'）尚未结束的任务，租约由协调循环定期续期
+_held_tasks: Set[str] = set()
+# 其中处于抖动等待、单用户限流等待、延后等待的任务（不占用领取名额）
+_parked_tasks: Set[str] = set()
+
+_TASK_PREFIX = "[TASK] 这是系统定时任务，请直接执行任务内容，不要对用户提问或对话。\n"
+
+# 派发阶段：优先级队列 + TASK_DISPATCH_CONCURRENCY 个 worker（全局并发上限）
+_dispatch_queue: Optional["asyncio.PriorityQueue[DispatchJob]"] = None
+_dispatch_workers: List["asyncio.Task"] = []
+_dispatch_seq = itertools.count()
+# 每个用户执行中的任务数 / 因达到单用户并发上限而等待的任务（按优先级排列的堆）
+_user_running: Dict[str, int] = {}
+_user_waiting: Dict[str, List["DispatchJob"]] = {}
+_dispatch_metrics: Dict[str, int] = {"jitter_waiting": 0, "deferred": 0, "dispatched": 0, "failed": 0}
+_dispatch_wait_ms: deque = deque(maxlen=200)
+# 延后后重新入队的等待任务（持有引用，避免被垃圾回收导致任务丢失）
+_requeue_tasks: Set["asyncio.Task"] = set()
+
+# 执行过程中的状态变更先合并在内存（task_id -> 待写字段），由后台批量写回；执行记录追加到 task_runs
+_pending_states: Dict[str, Dict[str, Any]] = {}
+_pending_runs: List[tuple] = []
+_state_wakeup = asyncio.Event()
+_state_flusher: Optional["asyncio.Task"] = None
+_NODE_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
 
 def _get_scheduler() -> AsyncIOScheduler:
     global _scheduler
@@ -30,33 +92,173 @@ def _get_scheduler() -> AsyncIOScheduler:
 
 
 def start_task_scheduler() -> None:
-    scheduler = _get_scheduler()
-    if scheduler.running:
+    global _coordinator, _state_flusher
+    if _coordinator is not None and not _coordinator.done():
         return
-    scheduler.start()
-    _load_and_schedule_tasks()
+    _state_flusher = asyncio.create_task(_state_flush_loop())
+    _coordinator = asyncio.create_task(_coordinator_loop())
     logger.info("✅ 定时任务调度器已启动")
 
 
 async def stop_task_scheduler() -> None:
+    global _coordinator
+    if _coordinator is not None:
+        _coordinator.cancel()
+        try:
+            await _coordinator
+        except asyncio.CancelledError:
+            pass
+        _coordinator = None
     scheduler = _get_scheduler()
     if scheduler.running:
         scheduler.shutdown(wait=False)
         logger.info("🛑 定时任务调度器已停止")
+    _job_specs.clear()
+    await asyncio.to_thread(_release_leadership)
+    for task in _requeue_tasks:
+        task.cancel()
+    for worker in _dispatch_workers:
+        worker.cancel()
+    for worker in _dispatch_workers:
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+    _dispatch_workers.clear()
+    await _stop_state_flusher()
+
+
+# ==================== 主节点选举 ====================
+
+def _check_leadership(holding: bool) -> bool:
+    """
+    检查/竞争调度主节点（在线程中执行）
+
+    Args:
+        holding: 当前是否已是主节点（是则只检查持锁连接是否存活）
+    """
+    global _lock_conn
+    try:
+        if _lock_conn is None or _lock_conn.closed:
+            _lock_conn = psycopg2.connect(**config.get_postgres_config())
+            _lock_conn.autocommit = True
+            holding = False
+        cursor = _lock_conn.cursor()
+        if holding:
+            cursor.execute("SELECT 1")
+            return True
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (_LEADER_LOCK_KEY,))
+        return bool(cursor.fetchone()[0])
+    except psycopg2.Error as exc:
+        # 连接断开时数据库会释放锁，本节点必须同时退出主节点身份
+        logger.warning("task_scheduler: leader lock connection error %s", exc)
+        _release_leadership()
+        return False
 
 
-def _load_and_schedule_tasks() -> None:
-    rows = db.execute_query(
+def _release_leadership() -> None:
+    global _lock_conn
+    conn, _lock_conn = _lock_conn, None
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def _become_leader() -> None:
+    global _is_leader
+    _is_leader = True
+    scheduler = _get_scheduler()
+    if not scheduler.running:
+        scheduler.start()
+    else:
+        scheduler.resume()
+    logger.info("task_scheduler: became leader")
+
+
+def _step_down() -> None:
+    global _is_leader
+    _is_leader = False
+    scheduler = _get_scheduler()
+    if scheduler.running:
+        scheduler.remove_all_jobs()
+        scheduler.pause()
+    _job_specs.clear()
+    logger.warning("task_scheduler: lost leadership")
+
+
+async def _coordinator_loop() -> None:
+    """选主、主节点同步调度、所有节点领取到期任务"""
+    while True:
+        try:
+            leader = await asyncio.to_thread(_check_leadership, _is_leader)
+            if leader and not _is_leader:
+                _become_leader()
+            elif not leader and _is_leader:
+                _step_down()
+            if _held_tasks:
+                await asyncio.to_thread(_renew_leases, list(_held_tasks))
+            for task in await asyncio.to_thread(_claim_misfired_tasks, _is_leader):
+                _skip_misfired(task)
+            if _is_leader:
+                rows = await asyncio.to_thread(_load_schedulable_tasks)
+                _sync_jobs(rows)
+            await _run_due_tasks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.error("task_scheduler: coordinator error %s", exc)
+        await asyncio.sleep(config.TASK_SCHEDULER_POLL_INTERVAL)
+
+
+# ==================== 调度（主节点） ====================
+
+def _load_schedulable_tasks() -> List[dict]:
+    return db.execute_query(
         """
-        SELECT id FROM task_custom_mcp
-        WHERE status IN ('pending', 'active')
+        SELECT id, schedule_type, cron_expr, run_at
+        FROM task_custom_mcp
+        WHERE status IN ('pending', 'active', 'running')
         """,
         fetch="all",
     ) or []
+
+
+def _sync_jobs(rows: List[dict]) -> None:
+    """按数据库中的任务定义增删 APScheduler 任务（其他节点新增/修改/取消的任务在此生效）"""
+    seen = set()
     for row in rows:
         task_id = row.get("id")
-        if task_id:
-            schedule_task(task_id)
+        if not task_id:
+            continue
+        seen.add(task_id)
+        spec = (row.get("schedule_type"), row.get("cron_expr"), row.get("run_at"))
+        if _job_specs.get(task_id) == spec:
+            continue
+        try:
+            _add_job(task_id, _build_trigger(row))
+            _job_specs[task_id] = spec
+        except Exception as exc:
+            logger.error("task_scheduler: trigger error (task_id=%s) %s", task_id, exc)
+            _mark_task_failed(task_id, f"trigger_error:{exc}")
+    for task_id in list(_job_specs):
+        if task_id not in seen:
+            cancel_task(task_id)
+
+
+def _add_job(task_id: str, trigger) -> None:
+    _get_scheduler().add_job(
+        _execute_task,
+        trigger=trigger,
+        args=[task_id],
+        id=task_id,
+        replace_existing=True,
+        misfire_grace_time=60,
+        coalesce=True,
+        max_instances=1,
+    )
 
 
 def schedule_task(task_id: str) -> None:
@@ -76,7 +278,6 @@ def schedule_task(task_id: str) -> None:
         )
         return
 
-    scheduler = _get_scheduler()
     try:
         trigger = _build_trigger(task)
     except Exception as exc:
@@ -84,17 +285,11 @@ def schedule_task(task_id: str) -> None:
         _mark_task_failed(task_id, f"trigger_error:{exc}")
         return
 
-    scheduler.add_job(
-        _execute_task,
-        trigger=trigger,
-        args=[task_id],
-        id=task_id,
-        replace_existing=True,
-        misfire_grace_time=60,
-        coalesce=True,
-        max_instances=1,
-    )
-    _refresh_next_run(task_id)
+    # 非主节点只写入 next_run_at，主节点在下一轮同步时注册触发
+    if _is_leader:
+        _add_job(task_id, trigger)
+        _job_specs[task_id] = (task.get("schedule_type"), task.get("cron_expr"), task.get("run_at"))
+    _refresh_next_run(task_id, trigger)
     logger.info(
         "task_scheduler: scheduled task_id=%s type=%s",
         task_id,
@@ -103,6 +298,7 @@ def schedule_task(task_id: str) -> None:
 
 
 def cancel_task(task_id: str) -> None:
+    _job_specs.pop(task_id, None)
     scheduler = _get_scheduler()
     try:
         scheduler.remove_job(task_id)
@@ -124,10 +320,16 @@ def _build_trigger(task: dict):
     return CronTrigger.from_crontab(cron_expr, timezone=config.TASK_TIMEZONE)
 
 
-def _refresh_next_run(task_id: str) -> None:
-    scheduler = _get_scheduler()
-    job = scheduler.get_job(task_id)
-    next_run = job.next_run_time if job else None
+def _next_run_time(trigger) -> Optional[datetime]:
+    # 从触发器直接计算，任意节点执行完成后都能写入；跳过可能被提前领取的本次触发
+    now = datetime.now(timezone.utc) + timedelta(seconds=_CLAIM_EARLY_SECONDS)
+    return trigger.get_next_fire_time(None, now)
+
+
+def _refresh_next_run(task_id: str, trigger) -> None:
+    next_run = _next_run_time(trigger)
+    # 执行中尚未写回的旧 next_run_at 不能覆盖本次（任务定义可能刚被修改）
+    _pending_states.get(task_id, {}).pop("next_run_at", None)
     conn = db._get_connection()
     try:
         cursor = conn.cursor()
@@ -172,42 +374,349 @@ def _mark_task_failed(task_id: str, reason: str) -> None:
     logger.warning("task_scheduler: task failed task_id=%s reason=%s", task_id, reason)
 
 
-async def _execute_task(task_id: str) -> None:
-    task = db.execute_query(
-        "SELECT * FROM task_custom_mcp WHERE id = %s",
-        (task_id,),
+# ==================== 领取与执行（所有节点） ====================
+
+def _claim_due_tasks(limit: int, task_id: Optional[str] = None, early_seconds: int = 0) -> List[dict]:
+    """
+    按行领取到期任务并标记为 running（其他节点已锁定/领取的行直接跳过）
+
+    Args:
+        limit: 最多领取条数
+        task_id: 只领取指定任务（APScheduler 触发时）
+        early_seconds: 允许提前领取的秒数
+    """
+    if limit <= 0:
+        return []
+    task_filter = "AND id = %s" if task_id else ""
+    params: list = [early_seconds]
+    if task_id:
+        params.append(task_id)
+    params.append(limit)
+    conn = db._get_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(
+            f"""
+            UPDATE task_custom_mcp AS t
+            SET status = 'running',
+                updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT id FROM task_custom_mcp
+                WHERE status IN ('pending', 'active')
+                  AND next_run_at <= now() + make_interval(secs => %s)
+                  {task_filter}
+                ORDER BY priority DESC, next_run_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) AS c
+            WHERE t.id = c.id
+            RETURNING t.*
+            """,
+            tuple(params),
+        )
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _touch_heartbeat() -> bool:
+    """记录本次轮询时间，返回此前集群是否停机（超过 TASK_MISFIRE_GRACE_SECONDS 无节点轮询）"""
+    row = db.execute_query(
+        """
+        WITH prev AS (
+            SELECT last_poll_at FROM task_scheduler_state WHERE id = 1 FOR UPDATE
+        )
+        INSERT INTO task_scheduler_state (id, last_poll_at)
+        VALUES (1, now())
+        ON CONFLICT (id) DO UPDATE SET last_poll_at = EXCLUDED.last_poll_at
+        RETURNING COALESCE(
+            (SELECT last_poll_at FROM prev) < now() - make_interval(secs => %s), TRUE
+        ) AS was_down
+        """,
+        (config.TASK_MISFIRE_GRACE_SECONDS,),
         fetch="one",
     )
-    if not task:
-        logger.warning("task_executor: task not found (task_id=%s)", task_id)
-        return
-    if task.get("status") in {"cancelled", "completed", "failed"}:
-        logger.info(
-            "task_executor: skip task status=%s (task_id=%s)",
-            task.get("status"),
-            task_id,
+    return bool(row and row.get("was_down"))
+
+
+def _claim_misfired_tasks(leader: bool) -> List[dict]:
+    """
+    领取需要按 misfire 跳过的任务（标记为 running，由调用方直接写回下一次触发时间）
+
+    - 集群停机恢复后：停机期间到期、超过宽限时间的任务
+    - 主节点回收执行节点异常退出后遗留的 running 任务（超过租约时长）；
+      其中未到期或仍在宽限时间内的任务恢复为 active 正常领取
+    """
+    rows: List[dict] = []
+    if leader:
+        db.execute_query(
+            """
+            UPDATE task_custom_mcp
+            SET status = 'active', updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running'
+              AND updated_at < now() - make_interval(secs => %s)
+              AND (next_run_at IS NULL OR next_run_at >= now() - make_interval(secs => %s))
+            """,
+            (config.TASK_RUN_LEASE_SECONDS, config.TASK_MISFIRE_GRACE_SECONDS),
+            fetch=None,
         )
+        rows += db.execute_query(
+            """
+            UPDATE task_custom_mcp
+            SET updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running'
+              AND updated_at < now() - make_interval(secs => %s)
+              AND next_run_at < now() - make_interval(secs => %s)
+            RETURNING *
+            """,
+            (config.TASK_RUN_LEASE_SECONDS, config.TASK_MISFIRE_GRACE_SECONDS),
+            fetch="all",
+        ) or []
+    if _touch_heartbeat():
+        rows += db.execute_query(
+            """
+            UPDATE task_custom_mcp
+            SET status = 'running', updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('pending', 'active')
+              AND next_run_at < now() - make_interval(secs => %s)
+            RETURNING *
+            """,
+            (config.TASK_MISFIRE_GRACE_SECONDS,),
+            fetch="all",
+        ) or []
+    return [dict(row) for row in rows]
+
+
+def _skip_misfired(task: dict) -> None:
+    """错过的触发不再补跑：date 任务标记失败，cron 任务写入下一次触发时间"""
+    task_id = task.get("id")
+    started_at = datetime.now()
+    logger.info("task_executor: misfired, skip task_id=%s", task_id)
+    try:
+        if (task.get("schedule_type") or "cron").lower() == "date":
+            _queue_state(task_id, status="failed", last_error="misfired")
+            cancel_task(task_id)
+        else:
+            _queue_state(task_id, status="active", next_run_at=_next_run_time(_build_trigger(task)))
+        _queue_run(task, started_at, "misfired")
+    except Exception as exc:
+        reason = f"trigger_error:{exc}"
+        _queue_state(task_id, status="failed", last_error=reason)
+        _queue_run(task, started_at, "failed", reason)
+
+
+def _renew_leases(task_ids: List[str]) -> None:
+    """为本节点持有的 running 任务续租（排队、抖动、延后期间不会被主节点当作遗留任务回收）"""
+    db.execute_query(
+        """
+        UPDATE task_custom_mcp
+        SET updated_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s) AND status = 'running'
+        """,
+        (task_ids,),
+        fetch=None,
+    )
+
+
+def _free_capacity() -> int:
+    # 抖动、限流、延后等待中的任务不占名额，只按实际排队执行的任务计算
+    return max(1, config.TASK_DISPATCH_CONCURRENCY) - len(_held_tasks - _parked_tasks)
+
+
+async def _run_due_tasks() -> None:
+    """按本节点空闲名额领取到期任务，后台执行"""
+    tasks = await asyncio.to_thread(_claim_due_tasks, _free_capacity())
+    for task in tasks:
+        _held_tasks.add(task.get("id"))
+        run = asyncio.create_task(_run_claimed_task(task))
+        _local_runs.add(run)
+        run.add_done_callback(_local_runs.discard)
+
+
+async def _execute_task(task_id: str) -> None:
+    """APScheduler 触发：领取该任务后执行（已被其他节点领取或未到期时跳过）"""
+    if _free_capacity() <= 0:
+        # 本节点名额已满，留给有空闲名额的节点在轮询中领取
+        logger.info("task_executor: at capacity, leave for polling (task_id=%s)", task_id)
+        return
+    tasks = await asyncio.to_thread(_claim_due_tasks, 1, task_id, _CLAIM_EARLY_SECONDS)
+    if not tasks:
+        logger.info("task_executor: not due or claimed elsewhere (task_id=%s)", task_id)
         return
+    _held_tasks.add(task_id)
+    await _run_claimed_task(tasks[0])
+
 
+async def _run_claimed_task(task: dict) -> None:
+    task_id = task.get("id")
+    try:
+        await _run_task(task)
+    finally:
+        _held_tasks.discard(task_id)
+        _parked_tasks.discard(task_id)
+
+
+async def _run_task(task: dict) -> None:
+    task_id = task.get("id")
     schedule_type = (task.get("schedule_type") or "cron").lower()
+    started_at = datetime.now()
+
     if schedule_type == "cron" and _is_cron_too_frequent(task):
         logger.info("任务触发频率过高，跳过执行: %s", task_id)
-        _refresh_next_run(task_id)
+        _queue_state(task_id, status="active", next_run_at=_next_run_time(_build_trigger(task)))
+        _queue_run(task, started_at, "too_frequent")
         return
 
-    _update_status(task_id, "running")
     try:
+        _queue_state(task_id, last_run_at=started_at)
         logger.info("task_executor: executing task_id=%s", task_id)
         await _dispatch_task(task)
         if schedule_type == "date":
-            _update_status(task_id, "completed")
+            _queue_state(task_id, status="completed", last_run_at=datetime.now())
             cancel_task(task_id)
         else:
-            _update_status(task_id, "active")
-            _refresh_next_run(task_id)
+            _queue_state(
+                task_id,
+                status="active",
+                last_run_at=datetime.now(),
+                next_run_at=_next_run_time(_build_trigger(task)),
+            )
+        _queue_run(task, started_at, "success")
         logger.info("task_executor: completed task_id=%s", task_id)
     except Exception as exc:
-        _mark_task_failed(task_id, f"dispatch_error:{exc}")
+        reason = f"dispatch_error:{exc}"
+        _queue_state(task_id, status="failed", last_error=reason)
+        _queue_run(task, started_at, "failed", reason)
+        logger.warning("task_scheduler: task failed task_id=%s reason=%s", task_id, reason)
+
+
+# ==================== 状态批量写回 ====================
+
+def _queue_state(task_id: str, **fields: Any) -> None:
+    """登记任务状态变更（同一任务多次变更合并为一次写入，后写的字段覆盖先写的）"""
+    _pending_states.setdefault(task_id, {}).update(fields)
+    _state_wakeup.set()
+
+
+def _queue_run(task: dict, started_at: datetime, outcome: str, error: Optional[str] = None) -> None:
+    """登记一条执行记录（success / failed / misfired / too_frequent）"""
+    finished_at = datetime.now()
+    _pending_runs.append((
+        str(uuid.uuid4()),
+        task.get("id"),
+        task.get("user_id"),
+        task.get("agent_id"),
+        task.get("next_run_at"),
+        started_at,
+        finished_at,
+        int((finished_at - started_at).total_seconds() * 1000),
+        outcome,
+        error[:500] if error else None,
+        _NODE_NAME,
+    ))
+    _state_wakeup.set()
+
+
+def _write_task_state(states: Dict[str, Dict[str, Any]], runs: List[tuple]) -> None:
+    conn = db._get_connection()
+    try:
+        cursor = conn.cursor()
+        if states:
+            # 只改仍处于 running（本节点领取）的行，执行期间被取消或已被回收的任务不受影响
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                UPDATE task_custom_mcp AS t
+                SET status = COALESCE(v.status, t.status),
+                    last_run_at = COALESCE(v.last_run_at, t.last_run_at),
+                    next_run_at = COALESCE(v.next_run_at, t.next_run_at),
+                    last_error = COALESCE(v.last_error, t.last_error),
+                    updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, status, last_run_at, next_run_at, last_error)
+                WHERE t.id = v.id AND t.status = 'running'
+                """,
+                [
+                    (
+                        task_id,
+                        fields.get("status"),
+                        fields.get("last_run_at"),
+                        fields.get("next_run_at"),
+                        fields.get("last_error"),
+                    )
+                    for task_id, fields in states.items()
+                ],
+                template="(%s, %s, %s::timestamp, %s::timestamptz, %s)",
+            )
+        if runs:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO task_runs (
+                    id, task_id, user_id, agent_id, scheduled_at, started_at,
+                    finished_at, duration_ms, outcome, error, node
+                )
+                VALUES %s
+                """,
+                runs,
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+async def _flush_task_state() -> None:
+    global _pending_states, _pending_runs
+    states, _pending_states = _pending_states, {}
+    runs, _pending_runs = _pending_runs, []
+    if not states and not runs:
+        return
+    try:
+        await asyncio.to_thread(_write_task_state, states, runs)
+    except Exception as exc:
+        logger.error("task_scheduler: state flush failed, retry later %s", exc)
+        # 放回待写缓冲，期间产生的新变更优先
+        for task_id, fields in states.items():
+            _pending_states[task_id] = {**fields, **_pending_states.get(task_id, {})}
+        _pending_runs[:0] = runs
+        raise
+
+
+async def _state_flush_loop() -> None:
+    """攒一小段时间内的状态变更后批量写回"""
+    while True:
+        await _state_wakeup.wait()
+        _state_wakeup.clear()
+        await asyncio.sleep(config.TASK_STATE_FLUSH_INTERVAL)
+        try:
+            await _flush_task_state()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _state_wakeup.set()
+            await asyncio.sleep(5)
+
+
+async def _stop_state_flusher() -> None:
+    global _state_flusher
+    if _state_flusher is not None:
+        _state_flusher.cancel()
+        try:
+            await _state_flusher
+        except asyncio.CancelledError:
+            pass
+        _state_flusher = None
+    try:
+        await _flush_task_state()
+    except Exception:
+        pass
 
 
 async def _dispatch_task(task: dict) -> None:
@@ -218,52 +727,197 @@ async def _dispatch_task(task: dict) -> None:
     if not (user_id and agent_id and session_id and message):
         raise ValueError("missing required fields")
 
+    # cron 任务多设在整点，随机延后一段时间打散同一时刻的触发
+    schedule_type = (task.get("schedule_type") or "cron").lower()
+    if schedule_type == "cron" and config.TASK_DISPATCH_JITTER_SECONDS > 0:
+        _dispatch_metrics["jitter_waiting"] += 1
+        _parked_tasks.add(task.get("id"))
+        try:
+            await asyncio.sleep(random.uniform(0, config.TASK_DISPATCH_JITTER_SECONDS))
+        finally:
+            _dispatch_metrics["jitter_waiting"] -= 1
+            _parked_tasks.discard(task.get("id"))
+
+    logger.info(
+        "task_executor: dispatch task_id=%s agent_id=%s session_id=%s mode=%s",
+        task.get("id"),
+        agent_id,
+        session_id,
+        config.TASK_DISPATCH_MODE,
+    )
+    job = DispatchJob(task)
+    _ensure_dispatch_workers().put_nowait(job)
+    await job.future
+    logger.info("task_executor: dispatch success task_id=%s", task.get("id"))
+
+
+class DispatchJob:
+    """派发阶段中的任务（优先级高的先出队，同优先级先到先出）"""
+
+    def __init__(self, task: dict):
+        self.task = task
+        self.user_id = task.get("user_id")
+        self.priority = int(task.get("priority") or 0)
+        self.seq = next(_dispatch_seq)
+        self.enqueued_at = time.monotonic()
+        self.deferred_since: Optional[float] = None
+        self.future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+
+    def __lt__(self, other: "DispatchJob") -> bool:
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+
+def _ensure_dispatch_workers() -> "asyncio.PriorityQueue[DispatchJob]":
+    global _dispatch_queue
+    if _dispatch_queue is None:
+        _dispatch_queue = asyncio.PriorityQueue()
+    _dispatch_workers[:] = [worker for worker in _dispatch_workers if not worker.done()]
+    while len(_dispatch_workers) < max(1, config.TASK_DISPATCH_CONCURRENCY):
+        _dispatch_workers.append(asyncio.create_task(_dispatch_worker(_dispatch_queue)))
+    return _dispatch_queue
+
+
+def _should_defer(job: DispatchJob) -> bool:
+    """agent 客户端数量过多时延后低优先级任务（最长 TASK_DEFER_MAX_SECONDS，之后照常执行）"""
+    threshold = config.TASK_DEFER_AGENT_CLIENTS
+    if threshold <= 0 or job.priority >= config.TASK_DEFER_PRIORITY_BELOW:
+        return False
+    # 延迟导入，避免与 agent_manager -> core.mcp 的循环导入
+    from ..agent.agent_manager import agent_manager
+
+    # 智能体已有客户端时执行任务不会新增内存占用
+    if job.task.get("agent_id") in agent_manager._clients or len(agent_manager._clients) < threshold:
+        return False
+    now = time.monotonic()
+    if job.deferred_since is None:
+        job.deferred_since = now
+    return now - job.deferred_since < config.TASK_DEFER_MAX_SECONDS
+
+
+async def _requeue_later(queue: "asyncio.PriorityQueue[DispatchJob]", job: DispatchJob, delay: float) -> None:
+    _dispatch_metrics["deferred"] += 1
+    _parked_tasks.add(job.task.get("id"))
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        _dispatch_metrics["deferred"] -= 1
+        _parked_tasks.discard(job.task.get("id"))
+    queue.put_nowait(job)
+
+
+def _release_user_slot(queue: "asyncio.PriorityQueue[DispatchJob]", user_id: str) -> None:
+    count = _user_running.get(user_id, 0) - 1
+    if count > 0:
+        _user_running[user_id] = count
+    else:
+        _user_running.pop(user_id, None)
+    waiting = _user_waiting.get(user_id)
+    if waiting:
+        job = heapq.heappop(waiting)
+        _parked_tasks.discard(job.task.get("id"))
+        queue.put_nowait(job)
+        if not waiting:
+            _user_waiting.pop(user_id, None)
+
+
+async def _dispatch_worker(queue: "asyncio.PriorityQueue[DispatchJob]") -> None:
+    while True:
+        job = await queue.get()
+        try:
+            if job.future.done():
+                continue
+            if _should_defer(job):
+                task = asyncio.create_task(_requeue_later(queue, job, config.TASK_DEFER_RETRY_SECONDS))
+                _requeue_tasks.add(task)
+                task.add_done_callback(_requeue_tasks.discard)
+                continue
+            if _user_running.get(job.user_id, 0) >= max(1, config.TASK_DISPATCH_PER_USER_LIMIT):
+                # 该用户已达并发上限，等其任务完成后再放回队列
+                heapq.heappush(_user_waiting.setdefault(job.user_id, []), job)
+                _parked_tasks.add(job.task.get("id"))
+                continue
+
+            _user_running[job.user_id] = _user_running.get(job.user_id, 0) + 1
+            _dispatch_wait_ms.append(int((time.monotonic() - job.enqueued_at) * 1000))
+            try:
+                if config.TASK_DISPATCH_MODE == "http":
+                    message = job.task.get("task_message") or job.task.get("task_description") or ""
+                    await _dispatch_task_http(job.task, f"{_TASK_PREFIX}{message}")
+                else:
+                    await _dispatch_task_local(job.task)
+            finally:
+                _release_user_slot(queue, job.user_id)
+            _dispatch_metrics["dispatched"] += 1
+            if not job.future.done():
+                job.future.set_result(None)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as exc:
+            _dispatch_metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(exc)
+        finally:
+            queue.task_done()
+
+
+def get_task_dispatch_metrics() -> Dict[str, Any]:
+    """派发阶段指标：队列深度、抖动/限流/延后中的任务数、执行中任务数、排队耗时分位数"""
+    waits = sorted(_dispatch_wait_ms)
+    return {
+        "is_leader": _is_leader,
+        "queue_depth": _dispatch_queue.qsize() if _dispatch_queue is not None else 0,
+        "jitter_waiting": _dispatch_metrics["jitter_waiting"],
+        "user_limited": sum(len(jobs) for jobs in _user_waiting.values()),
+        "deferred": _dispatch_metrics["deferred"],
+        "running": sum(_user_running.values()),
+        "dispatched": _dispatch_metrics["dispatched"],
+        "failed": _dispatch_metrics["failed"],
+        "queue_wait_ms_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None,
+    }
+
+
+async def _dispatch_task_local(task: dict) -> None:
+    """进程内派发：直接入队聊天处理流程，并等待本轮 AI 回复完成（占用一个并发名额）"""
+    # 延迟导入，避免与 agent_manager -> core.mcp 的循环导入
+    from ..chat.chat_api import dispatch_internal_message
+
+    message = task.get("task_message") or task.get("task_description") or ""
+    _, waiter = await dispatch_internal_message(
+        task.get("user_id"),
+        task.get("agent_id"),
+        task.get("session_id"),
+        f"{_TASK_PREFIX}{message}",
+        wait=True,
+    )
+    try:
+        await asyncio.wait_for(asyncio.shield(waiter), timeout=config.TASK_DISPATCH_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(
+            "task_executor: reply still running after %ss, release slot task_id=%s",
+            config.TASK_DISPATCH_WAIT_TIMEOUT,
+            task.get("id"),
+        )
+
+
+async def _dispatch_task_http(task: dict, message: str) -> None:
+    """HTTP 派发：以任务所属用户身份调用 /api/v1/chat/send（供远程执行节点使用）"""
+    user_id = task.get("user_id")
     user = db.get_user_by_id(user_id)
     if not user or not user.get("username"):
         raise ValueError("user not found")
 
     token = generate_token(user_id, user["username"])
-    task_prefix = "[TASK] 这是系统定时任务，请直接执行任务内容，不要对用户提问或对话。\n"
     payload = {
-        "ai_agent_id": agent_id,
-        "message": f"{task_prefix}{message}",
-        "session_id": session_id,
+        "ai_agent_id": task.get("agent_id"),
+        "message": message,
+        "session_id": task.get("session_id"),
     }
     url = f"{config.TASK_DISPATCH_BASE_URL}/api/v1/chat/send"
     headers = {"Authorization": f"Bearer {token}"}
-
-    logger.info(
-        "task_executor: dispatch task_id=%s agent_id=%s session_id=%s",
-        task.get("id"),
-        agent_id,
-        session_id,
-    )
     async with httpx.AsyncClient(timeout=60.0) as client:
         resp = await client.post(url, json=payload, headers=headers)
         resp.raise_for_status()
-    logger.info("task_executor: dispatch success task_id=%s", task.get("id"))
-
-
-def _update_status(task_id: str, status: str) -> None:
-    conn = db._get_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE task_custom_mcp
-            SET status = %s,
-                last_run_at = %s,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-            """,
-            (status, datetime.now(), task_id),
-        )
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
 
 
 def _is_cron_too_frequent(task: dict) -> bool:
@@ -8,6 +8,9 @@ from pathlib import Path
 
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
+from .mcp_http import get_mcp_http_client
+from .render_cache import CONTENT_TYPES, render_to_file
+
 logger = logging.getLogger(__name__)
 
 
@@ -67,23 +70,22 @@ async def drawio_export(args: dict) -> dict:
     if not output_path:
         return {"content": [{"type": "text", "text": "请提供 output_path（必须落盘；不要读取图片内容回显）"}]}
 
-    import httpx
     from ..system.config import DRAWIO_EXPORT_URL
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(DRAWIO_EXPORT_URL, data={"format": fmt, "xml": xml})
+    async def _render() -> bytes:
+        client = get_mcp_http_client()
+        resp = await client.post(DRAWIO_EXPORT_URL, data={"format": fmt, "xml": xml}, timeout=60.0)
         resp.raise_for_status()
-        content = resp.content
-    elapsed = time.time() - start_time
-    logger.info("drawio_export: format=%s size=%s bytes elapsed=%.3fs", fmt, len(content), elapsed)
+        return resp.content
 
     saved_xml_path = None
     if output_path:
         path = Path(output_path)
         if not path.is_absolute():
             path = Path.cwd() / path
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_bytes(content)
+        size, cache_hit = await render_to_file("drawio", "drawio", fmt, xml, path, _render)
+        elapsed = time.time() - start_time
+        logger.info("drawio_export: format=%s size=%s bytes cache_hit=%s elapsed=%.3fs", fmt, size, cache_hit, elapsed)
         if xml_inline:
             xml_file = path.with_suffix(".xml")
             xml_file.write_text(xml, encoding="utf-8")
@@ -91,8 +93,8 @@ async def drawio_export(args: dict) -> dict:
 
     payload = {
         "format": fmt,
-        "content_type": resp.headers.get("content-type", "application/octet-stream"),
-        "size_bytes": len(content),
+        "content_type": CONTENT_TYPES.get(fmt, "application/octet-stream"),
+        "size_bytes": size,
         "saved_path": str(Path(output_path).resolve()),
         "saved_xml_path": saved_xml_path,
         "xml": xml,
@@ -1,46 +1,12 @@
 """SMTP email sender MCP."""
+import asyncio
 import json
-import mimetypes
-import smtplib
-from email import encoders
-from email.header import Header
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import formataddr
 from pathlib import Path
 
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
 from ..system import config
-
-
-def _get_smtp_connection() -> smtplib.SMTP:
-    if config.SMTP_USE_SSL:
-        client = smtplib.SMTP_SSL(config.SMTP_HOST, config.SMTP_PORT, timeout=30)
-    else:
-        client = smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT, timeout=30)
-        if config.SMTP_USE_TLS:
-            client.starttls()
-    client.login(config.SMTP_USERNAME, config.SMTP_PASSWORD)
-    return client
-
-
-def _attach_file(msg: MIMEMultipart, file_path: Path) -> None:
-    content_type, encoding = mimetypes.guess_type(str(file_path))
-    if content_type is None or encoding is not None:
-        content_type = "application/octet-stream"
-    maintype, subtype = content_type.split("/", 1)
-
-    with file_path.open("rb") as f:
-        payload = f.read()
-
-    part = MIMEBase(maintype, subtype)
-    part.set_payload(payload)
-    encoders.encode_base64(part)
-    filename = Header(file_path.name, "utf-8").encode()
-    part.add_header("Content-Disposition", "attachment", filename=filename)
-    msg.attach(part)
+from .mail_sender import enqueue_mail
 
 
 @tool(
@@ -71,26 +37,32 @@ async def send_email(args: dict) -> dict:
     subject = (args.get("subject") or "Queen Bee 通知").strip()
     attachments = args.get("attachments") or []
 
-    msg = MIMEMultipart()
-    from_name = config.SMTP_FROM_NAME or config.SMTP_USERNAME
-    msg["From"] = formataddr((from_name, config.SMTP_USERNAME))
-    msg["To"] = to_address
-    msg["Subject"] = Header(subject, "utf-8")
-
-    msg.attach(MIMEText(content, "html", "utf-8"))
-
+    paths = []
     for item in attachments:
         path = Path(item)
         if not path.is_absolute():
             path = Path.cwd() / path
         if not path.exists() or not path.is_file():
             return {"content": [{"type": "text", "text": f"附件不存在: {item}"}]}
-        _attach_file(msg, path)
+        paths.append(path)
 
+    # 发送在后台队列中进行；超过等待时间仍未完成时继续在后台重试，不阻塞当前对话
+    try:
+        future = enqueue_mail(to_address, subject, content, paths)
+    except ValueError as exc:
+        return {"content": [{"type": "text", "text": f"发送失败: {exc}"}]}
     try:
-        client = _get_smtp_connection()
-        client.sendmail(config.SMTP_USERNAME, [to_address], msg.as_string())
-        client.quit()
+        result = await asyncio.wait_for(asyncio.shield(future), timeout=config.SMTP_SEND_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        payload = {
+            "to": to_address,
+            "subject": subject,
+            "attachments": len(attachments),
+            "success": False,
+            "status": "pending",
+            "message": "邮件仍在发送队列中重试，尚未确认送达",
+        }
+        return {"content": [{"type": "text", "text": json.dumps(payload, ensure_ascii=True)}]}
     except Exception as exc:
         return {"content": [{"type": "text", "text": f"发送失败: {exc}"}]}
 
@@ -99,6 +71,7 @@ async def send_email(args: dict) -> dict:
         "subject": subject,
         "attachments": len(attachments),
         "success": True,
+        "attempts": result.get("attempts"),
     }
     return {"content": [{"type": "text", "text": json.dumps(payload, ensure_ascii=True)}]}
 
@@ -2,6 +2,8 @@
 Knowledge Base (Memory) MCP
 提供记忆的增删改查
 """
+import json
+
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
 from ..kbs import service
@@ -181,7 +183,11 @@ async def kbs_add_memory_batch(args: dict) -> dict:
         results = await service.add_memory_batch(items=items)
         ok = sum(1 for r in results if r.get("ok"))
         fail = len(results) - ok
-        return {"content": [{"type": "text", "text": f"批量新增完成：成功 {ok} 条，失败 {fail} 条"}]}
+        text = f"批量新增完成：成功 {ok} 条，失败 {fail} 条"
+        errors = [f"第{i + 1}条: {r.get('error')}" for i, r in enumerate(results) if not r.get("ok")]
+        if errors:
+            text += "\n" + "\n".join(errors)
+        return {"content": [{"type": "text", "text": text}]}
     except Exception as exc:
         return {"content": [{"type": "text", "text": f"批量新增失败: {exc}"}]}
 
@@ -223,7 +229,11 @@ async def kbs_update_memory_batch(args: dict) -> dict:
         results = await service.update_memory_batch(items=items)
         ok = sum(1 for r in results if r.get("ok"))
         fail = len(results) - ok
-        return {"content": [{"type": "text", "text": f"批量更新完成：成功 {ok} 条，失败 {fail} 条"}]}
+        text = f"批量更新完成：成功 {ok} 条，失败 {fail} 条"
+        errors = [f"第{i + 1}条: {r.get('error')}" for i, r in enumerate(results) if not r.get("ok")]
+        if errors:
+            text += "\n" + "\n".join(errors)
+        return {"content": [{"type": "text", "text": text}]}
     except Exception as exc:
         return {"content": [{"type": "text", "text": f"批量更新失败: {exc}"}]}
 
@@ -350,10 +360,11 @@ async def kbs_clear_chat_fragments(args: dict) -> dict:
 @tool(
     name="kbs_dump_unprocessed_chat_records",
     description=(
-        "将未处理聊天记录导出为 txt 文件（用于整理完整对话）。参数：user_id, output_dir(工作空间路径)。"
+        "将未处理聊天记录按时间升序导出为 txt 文件（用于整理完整对话）。参数：user_id, output_dir(工作空间路径), "
+        "limit(可选，本次最多导出条数，不填导出全部)。"
         "内部会读取 title='已整理记忆参数' 且 memory_type='参数' 的记忆内容作为处理进度。"
-        "进度格式必须为 JSON: {\"last_created_at\": \"...\"}。"
-        "整理完成后请调用 kbs_set_memory_progress 更新进度（写入当前北京时间）。"
+        "进度格式必须为 JSON: {\"last_created_at\": \"...\", \"last_id\": \"...(可选)\"}。"
+        "返回结果包含导出水位，整理完成后请调用 kbs_set_memory_progress 并传入该水位，下次从水位之后继续导出。"
         "提示：user_id 可从工作目录名推导，形如 userid_xxx，去掉 userid_ 即为用户ID。"
     ),
     input_schema={
@@ -361,17 +372,23 @@ async def kbs_clear_chat_fragments(args: dict) -> dict:
         "properties": {
             "user_id": {"type": "string"},
             "output_dir": {"type": "string"},
+            "limit": {"type": "integer"},
         },
         "required": ["user_id", "output_dir"],
     },
 )
 async def kbs_dump_unprocessed_chat_records(args: dict) -> dict:
     try:
-        file_path, count = await service.dump_unprocessed_chat_records(
+        limit = int(args.get("limit") or 0) or None
+        file_path, count, watermark = await service.dump_unprocessed_chat_records(
             user_id=(args.get("user_id") or "").strip(),
             output_dir=(args.get("output_dir") or "").strip(),
+            limit=limit,
         )
-        return {"content": [{"type": "text", "text": f"已导出 {count} 条到: {file_path}"}]}
+        text = f"已导出 {count} 条到: {file_path}"
+        if watermark:
+            text += f"\n导出水位: {json.dumps(watermark, ensure_ascii=False)}"
+        return {"content": [{"type": "text", "text": text}]}
     except Exception as exc:
         return {"content": [{"type": "text", "text": f"导出失败: {exc}"}]}
 
@@ -379,7 +396,8 @@ async def kbs_dump_unprocessed_chat_records(args: dict) -> dict:
 @tool(
     name="kbs_set_memory_progress",
     description=(
-        "更新已整理记忆参数（自动使用当前北京时间）。参数：user_id。"
+        "更新已整理记忆参数。参数：user_id, last_created_at(可选), last_id(可选)。"
+        "传入导出时返回的水位则记录到该水位，不传则使用当前北京时间。"
         "会写入 title='已整理记忆参数' 且 memory_type='参数' 的 JSON 内容。"
         "提示：user_id 可从工作目录名推导，形如 userid_xxx，去掉 userid_ 即为用户ID。"
     ),
@@ -387,6 +405,8 @@ async def kbs_dump_unprocessed_chat_records(args: dict) -> dict:
         "type": "object",
         "properties": {
             "user_id": {"type": "string"},
+            "last_created_at": {"type": "string"},
+            "last_id": {"type": "string"},
         },
         "required": ["user_id"],
     },
@@ -395,6 +415,10 @@ async def kbs_set_memory_progress(args: dict) -> dict:
     try:
         result = await service.set_memory_progress_now(
             user_id=(args.get("user_id") or "").strip(),
+            watermark={
+                "last_created_at": (args.get("last_created_at") or "").strip(),
+                "last_id": (args.get("last_id") or "").strip(),
+            },
         )
         return {"content": [{"type": "text", "text": f"更新成功: {result.get('id')}"}]}
     except Exception as exc:
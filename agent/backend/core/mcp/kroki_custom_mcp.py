@@ -9,6 +9,9 @@ from pathlib import Path
 
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
+from .mcp_http import get_mcp_http_client
+from .render_cache import CONTENT_TYPES, render_to_file
+
 logger = logging.getLogger(__name__)
 
 _TYPE_RE = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
@@ -91,22 +94,30 @@ async def kroki_render(args: dict) -> dict:
     if not output_path:
         return {"content": [{"type": "text", "text": "请提供 output_path（必须落盘；不要读取图片内容回显）"}]}
 
-    import httpx
     from ..system.config import KROKI_URL
 
     endpoint = f"{KROKI_URL.rstrip('/')}/{dtype}/{fmt}"
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(endpoint, content=diagram.encode("utf-8"), headers={"Content-Type": "text/plain"})
+
+    async def _render() -> bytes:
+        client = get_mcp_http_client()
+        resp = await client.post(
+            endpoint,
+            content=diagram.encode("utf-8"),
+            headers={"Content-Type": "text/plain"},
+            timeout=60.0,
+        )
         resp.raise_for_status()
-        content = resp.content
-    elapsed = time.time() - start_time
-    logger.info("kroki_render: type=%s format=%s size=%s bytes elapsed=%.3fs", dtype, fmt, len(content), elapsed)
+        return resp.content
 
     path = Path(output_path)
     if not path.is_absolute():
         path = Path.cwd() / path
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_bytes(content)
+    size, cache_hit = await render_to_file("kroki", dtype, fmt, diagram, path, _render)
+    elapsed = time.time() - start_time
+    logger.info(
+        "kroki_render: type=%s format=%s size=%s bytes cache_hit=%s elapsed=%.3fs",
+        dtype, fmt, size, cache_hit, elapsed,
+    )
 
     saved_source_path = None
     if diagram_inline:
@@ -117,8 +128,8 @@ async def kroki_render(args: dict) -> dict:
     payload = {
         "diagram_type": dtype,
         "format": fmt,
-        "content_type": resp.headers.get("content-type", "application/octet-stream"),
-        "size_bytes": len(content),
+        "content_type": CONTENT_TYPES.get(fmt, "application/octet-stream"),
+        "size_bytes": size,
         "saved_path": str(path.resolve()),
         "saved_source_path": saved_source_path,
     }
@@ -3,22 +3,26 @@ Lordicon 动态图标工具
 """
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
+from ..system import config
+from .mcp_http import ApiKeyRotator, fetch_json
+
+# 单个 key 也经过轮询器，以便记录限流冷却状态
+_key_rotator = ApiKeyRotator("lordicon", lambda: [config.LORDICON_API_KEY])
+
+
+def _apply_key(key: str, params: dict, headers: dict) -> None:
+    headers["Authorization"] = f"Bearer {key}"
+
 
 async def fetch_lordicon(endpoint: str, params: dict = None) -> dict:
-    """请求 Lordicon API"""
-    import httpx
-    from ..system.config import LORDICON_API_KEY
-
-    url = f"https://api.lordicon.com{endpoint}"
-    headers = {"Authorization": f"Bearer {LORDICON_API_KEY}"}
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        if params:
-            resp = await client.get(url, params=params, headers=headers)
-        else:
-            resp = await client.get(url, headers=headers)
-        resp.raise_for_status()
-        return resp.json()
+    """请求 Lordicon API（共享连接池 + 响应缓存）"""
+    return await fetch_json(
+        "lordicon",
+        f"https://api.lordicon.com{endpoint}",
+        params,
+        rotator=_key_rotator,
+        apply_key=_apply_key,
+    )
 
 
 def format_lordicon_icon(icon: dict) -> str:
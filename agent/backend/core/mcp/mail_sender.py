@@ -0,0 +1,356 @@
+"""
+SMTP 异步发送
+- 复用少量已登录的 SMTP 连接（空闲超时或 NOOP 检测失败时重建）
+- 发送队列 + 指数退避重试（4xx / 断连等临时错误重试，5xx 等永久错误直接失败）
+- 附件按块 base64 编码写入临时文件，发送时逐行流式写入 DATA，不整体读入内存
+- SMTP 调用在专用线程池中执行，不阻塞事件循环
+- 记录发送耗时等指标
+"""
+import asyncio
+import base64
+import logging
+import mimetypes
+import smtplib
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
+from email.utils import formataddr, formatdate, make_msgid, parseaddr
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..system import config
+
+logger = logging.getLogger(__name__)
+
+# base64 每行 76 字符对应 57 字节原文，按其整数倍读取可保证分块编码结果与整体编码一致
+_B64_CHUNK = 57 * 256
+_SPOOL_MEMORY_BYTES = 1024 * 1024
+_SEND_BUFFER_BYTES = 64 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=max(1, config.SMTP_POOL_SIZE), thread_name_prefix="smtp")
+
+
+class SmtpConnectionPool:
+    """已登录 SMTP 连接池（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[smtplib.SMTP, float]] = []
+
+    @staticmethod
+    def _connect() -> smtplib.SMTP:
+        if config.SMTP_USE_SSL:
+            client = smtplib.SMTP_SSL(config.SMTP_HOST, config.SMTP_PORT, timeout=30)
+        else:
+            client = smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT, timeout=30)
+            if config.SMTP_USE_TLS:
+                client.starttls()
+        client.login(config.SMTP_USERNAME, config.SMTP_PASSWORD)
+        return client
+
+    @staticmethod
+    def _close(client: smtplib.SMTP) -> None:
+        try:
+            client.quit()
+        except Exception:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def acquire(self) -> smtplib.SMTP:
+        """取一个可用连接：优先复用空闲连接，过期或失效的直接关闭"""
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return self._connect()
+            client, last_used = item
+            if time.monotonic() - last_used <= config.SMTP_IDLE_TIMEOUT:
+                try:
+                    if client.noop()[0] == 250:
+                        return client
+                except (smtplib.SMTPException, OSError):
+                    pass
+            self._close(client)
+
+    def release(self, client: smtplib.SMTP, reusable: bool = True) -> None:
+        """归还连接；出错的连接不再复用"""
+        if reusable:
+            with self._lock:
+                if len(self._idle) < config.SMTP_POOL_SIZE:
+                    self._idle.append((client, time.monotonic()))
+                    return
+        self._close(client)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            self._close(client)
+
+
+smtp_pool = SmtpConnectionPool()
+
+
+def normalize_address(address: str) -> str:
+    """
+    校验收件地址并返回纯地址部分
+
+    Raises:
+        ValueError: 地址为空、格式不正确或包含换行（防止邮件头注入）
+    """
+    if any(ch in address for ch in "\r\n"):
+        raise ValueError("收件邮箱不能包含换行")
+    _, addr = parseaddr(address)
+    if not addr or "@" not in addr or any(ch.isspace() for ch in addr):
+        raise ValueError(f"收件邮箱格式不正确: {address}")
+    return addr
+
+
+class MailJob:
+    """待发送邮件"""
+
+    def __init__(self, to_address: str, subject: str, html: str, attachments: List[Path]):
+        self.to_address = to_address
+        self.subject = subject
+        self.html = html
+        self.attachments = attachments
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.spool = None
+        self.future: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+
+
+# ==================== 邮件构建（流式） ====================
+
+def _write_base64_file(spool, path: Path) -> None:
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(_B64_CHUNK)
+            if not chunk:
+                break
+            spool.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+
+
+def _build_message(job: MailJob):
+    """把邮件按 MIME 格式写入临时文件（小邮件留在内存，超过 1MB 落盘）"""
+    boundary = f"===============queenbee{uuid.uuid4().hex}=="
+    from_name = config.SMTP_FROM_NAME or config.SMTP_USERNAME
+    domain = config.SMTP_USERNAME.split("@")[-1] if "@" in config.SMTP_USERNAME else None
+    headers = [
+        f"From: {formataddr((from_name, config.SMTP_USERNAME), charset='utf-8')}",
+        f"To: {formataddr((None, job.to_address))}",
+        f"Subject: {Header(job.subject, 'utf-8').encode(linesep=chr(13) + chr(10))}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {make_msgid(domain=domain)}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        f"--{boundary}",
+        'Content-Type: text/html; charset="utf-8"',
+        "Content-Transfer-Encoding: base64",
+        "",
+    ]
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MEMORY_BYTES)
+    spool.write("\r\n".join(headers).encode("utf-8") + b"\r\n")
+    spool.write(base64.encodebytes(job.html.encode("utf-8")).replace(b"\n", b"\r\n"))
+
+    for path in job.attachments:
+        content_type, encoding = mimetypes.guess_type(str(path))
+        if content_type is None or encoding is not None:
+            content_type = "application/octet-stream"
+        filename = Header(path.name, "utf-8").encode(maxlinelen=0)
+        part_headers = [
+            f"--{boundary}",
+            f"Content-Type: {content_type}",
+            "Content-Transfer-Encoding: base64",
+            f'Content-Disposition: attachment; filename="{filename}"',
+            "",
+        ]
+        spool.write("\r\n".join(part_headers).encode("ascii") + b"\r\n")
+        _write_base64_file(spool, path)
+
+    spool.write(f"--{boundary}--\r\n".encode("ascii"))
+    return spool
+
+
+def _stream_data(client: smtplib.SMTP, spool) -> None:
+    """逐行发送 DATA 内容（按 RFC 5321 对行首的 . 做转义）"""
+    spool.seek(0)
+    buffer = bytearray()
+    for line in spool:
+        if line.startswith(b"."):
+            buffer += b"."
+        buffer += line
+        if len(buffer) >= _SEND_BUFFER_BYTES:
+            client.send(bytes(buffer))
+            buffer.clear()
+    buffer += b".\r\n"
+    client.send(bytes(buffer))
+
+
+def _deliver(job: MailJob) -> None:
+    """在线程池中执行一次投递"""
+    if job.spool is None:
+        job.spool = _build_message(job)
+
+    client = smtp_pool.acquire()
+    reusable = False
+    try:
+        client.ehlo_or_helo_if_needed()
+        code, resp = client.mail(config.SMTP_USERNAME)
+        if code != 250:
+            client.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, config.SMTP_USERNAME)
+        code, resp = client.rcpt(job.to_address)
+        if code not in (250, 251):
+            client.rset()
+            raise smtplib.SMTPRecipientsRefused({job.to_address: (code, resp)})
+        code, resp = client.docmd("data")
+        if code != 354:
+            client.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        _stream_data(client, job.spool)
+        code, resp = client.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        reusable = True
+    finally:
+        smtp_pool.release(client, reusable)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """临时错误（4xx、断连、网络异常）可重试，其余视为永久失败"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(exc, smtplib.SMTPException):
+        return False
+    return isinstance(exc, OSError)
+
+
+# ==================== 队列与指标 ====================
+
+_queue: Optional["asyncio.Queue[MailJob]"] = None
+_workers: List["asyncio.Task"] = []
+_latencies_ms: deque = deque(maxlen=200)
+_metrics: Dict[str, int] = {"sent": 0, "failed": 0, "retried": 0}
+# 等待重试的任务（持有引用，避免被垃圾回收导致重试丢失）
+_retry_tasks: Set["asyncio.Task"] = set()
+
+
+def _ensure_workers() -> "asyncio.Queue[MailJob]":
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    _workers[:] = [task for task in _workers if not task.done()]
+    while len(_workers) < max(1, config.SMTP_POOL_SIZE):
+        _workers.append(asyncio.create_task(_worker(_queue)))
+    return _queue
+
+
+async def _retry_later(queue: "asyncio.Queue[MailJob]", job: MailJob, delay: float) -> None:
+    await asyncio.sleep(delay)
+    await queue.put(job)
+
+
+async def _worker(queue: "asyncio.Queue[MailJob]") -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await queue.get()
+        job.attempts += 1
+        start = time.monotonic()
+        try:
+            await loop.run_in_executor(_executor, _deliver, job)
+        except Exception as exc:
+            if _is_transient(exc) and job.attempts < config.SMTP_MAX_ATTEMPTS:
+                delay = min(
+                    config.SMTP_RETRY_BACKOFF_BASE * (2 ** (job.attempts - 1)),
+                    config.SMTP_RETRY_BACKOFF_MAX,
+                )
+                _metrics["retried"] += 1
+                logger.warning(f"邮件发送失败（第 {job.attempts} 次），{delay} 秒后重试: {exc}")
+                task = asyncio.create_task(_retry_later(queue, job, delay))
+                _retry_tasks.add(task)
+                task.add_done_callback(_retry_tasks.discard)
+            else:
+                _metrics["failed"] += 1
+                logger.warning(f"邮件发送失败（共 {job.attempts} 次）: {exc}")
+                _finish(job, exc)
+        else:
+            send_ms = int((time.monotonic() - start) * 1000)
+            total_ms = int((time.monotonic() - job.enqueued_at) * 1000)
+            _latencies_ms.append(send_ms)
+            _metrics["sent"] += 1
+            logger.info(f"邮件已发送: attempts={job.attempts} send={send_ms}ms total={total_ms}ms")
+            _finish(job, {"attempts": job.attempts, "send_ms": send_ms, "total_ms": total_ms})
+        finally:
+            queue.task_done()
+
+
+def _finish(job: MailJob, result: Any) -> None:
+    if job.spool is not None:
+        job.spool.close()
+        job.spool = None
+    if job.future.done():
+        return
+    if isinstance(result, BaseException):
+        job.future.set_exception(result)
+        job.future.exception()
+    else:
+        job.future.set_result(result)
+
+
+def enqueue_mail(to_address: str, subject: str, html: str, attachments: List[Path]) -> "asyncio.Future[Dict[str, Any]]":
+    """
+    将邮件加入发送队列
+
+    Returns:
+        发送结果 Future：成功时为 {attempts, send_ms, total_ms}，最终失败时抛出最后一次的异常
+
+    Raises:
+        ValueError: 收件地址不合法
+    """
+    job = MailJob(normalize_address(to_address), subject, html, attachments)
+    _ensure_workers().put_nowait(job)
+    return job.future
+
+
+def get_mail_metrics() -> Dict[str, Any]:
+    """发送指标：成功/失败/重试次数、队列长度、最近发送耗时分位数"""
+    latencies = sorted(_latencies_ms)
+
+    def _percentile(p: float) -> Optional[int]:
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        **_metrics,
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "send_ms_p50": _percentile(0.5),
+        "send_ms_p95": _percentile(0.95),
+    }
+
+
+async def close_mail_sender() -> None:
+    """停止发送 worker 并关闭连接池（应用关闭时调用）"""
+    for task in _retry_tasks:
+        task.cancel()
+    for task in _workers:
+        task.cancel()
+    for task in _workers:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _workers.clear()
+    await asyncio.get_running_loop().run_in_executor(_executor, smtp_pool.close_all)
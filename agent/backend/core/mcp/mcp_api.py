@@ -16,6 +16,7 @@ from pydantic import BaseModel
 from ..auth.auth_filter import get_current_user_id
 from ..db.dbutil import DatabaseUtil
 from ..system import config
+from . import invalidate_user_mcp_servers
 
 router = APIRouter(prefix="/api/v1/mcp", tags=["mcp"])
 db = DatabaseUtil()
@@ -149,6 +150,7 @@ async def install_mcp(
         ''', (mcp_id, user_id, name, request.url, created_at, created_at))
 
         conn.commit()
+        invalidate_user_mcp_servers(user_id)
 
         # 重启用户的所有智能体以应用新的 MCP 配置
         from ..agent.agent_manager import agent_manager
@@ -221,6 +223,7 @@ async def remove_mcp(
         ''', (mcp_id, user_id))
 
         conn.commit()
+        invalidate_user_mcp_servers(user_id)
 
         # 重启用户的所有智能体以应用新的 MCP 配置
         from ..agent.agent_manager import agent_manager
@@ -0,0 +1,241 @@
+"""
+素材类 MCP 共享 HTTP 层
+- 共享 httpx 连接池（keep-alive；安装 h2 时启用 HTTP/2）
+- 按 (接口, 参数) 缓存 JSON 响应（不含 API key）：进程内 TTL + LRU，可选 Redis 共享
+- 相同请求并发时合并为一次远程调用
+- 按服务商记录每个 API key 的限流状态，轮询时跳过冷却中的 key
+"""
+import hashlib
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..cache.redis_cache import get_cached_mcp_response, set_cached_mcp_response
+from ..cache.single_flight import SingleFlight
+from ..system import config
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:  # 未安装 h2 时退回 HTTP/1.1 keep-alive
+    _HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+_lru: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+_flight: "SingleFlight[bytes]" = SingleFlight()
+
+
+def get_mcp_http_client() -> httpx.AsyncClient:
+    """获取共享连接池"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=config.MCP_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=max(1, config.MCP_HTTP_MAX_CONNECTIONS // 2),
+            ),
+        )
+    return _client
+
+
+async def close_mcp_http_client() -> None:
+    """关闭共享连接池（应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class ApiKeyRotator:
+    """
+    API key 轮询器
+
+    根据响应的限流头（X-RateLimit-Remaining / X-RateLimit-Reset / Retry-After）和 429 状态码
+    记录每个 key 的冷却截止时间，next_key 轮询时跳过冷却中的 key；全部冷却时返回最早恢复的 key。
+    """
+
+    def __init__(self, provider: str, load_keys: Callable[[], List[str]]):
+        self.provider = provider
+        self._load_keys = load_keys
+        self._keys: Optional[List[str]] = None
+        self._cycle = None
+        self._cooldown_until: Dict[str, float] = {}
+
+    def _ensure_keys(self) -> List[str]:
+        if self._keys is None:
+            self._keys = [key for key in self._load_keys() if key]
+            self._cycle = itertools.cycle(self._keys)
+        return self._keys
+
+    def next_key(self) -> str:
+        """获取下一个可用 API key"""
+        keys = self._ensure_keys()
+        if not keys:
+            raise RuntimeError(f"{self.provider} API key 未配置")
+        now = time.time()
+        for _ in range(len(keys)):
+            key = next(self._cycle)
+            if self._cooldown_until.get(key, 0) <= now:
+                return key
+        return min(keys, key=lambda k: self._cooldown_until.get(k, 0))
+
+    def available_count(self) -> int:
+        """当前未处于冷却的 key 数量"""
+        now = time.time()
+        return sum(1 for key in self._ensure_keys() if self._cooldown_until.get(key, 0) <= now)
+
+    def record_response(self, key: str, resp: httpx.Response) -> None:
+        """根据响应更新 key 的限流状态"""
+        remaining = _header_int(resp.headers, "x-ratelimit-remaining")
+        if resp.status_code == 429 or remaining == 0:
+            wait = (
+                _retry_after_seconds(resp.headers.get("retry-after"))
+                or _reset_seconds(resp.headers.get("x-ratelimit-reset"))
+                or config.MCP_HTTP_RATE_LIMIT_COOLDOWN
+            )
+            self._cooldown_until[key] = time.time() + wait
+            logger.warning(f"{self.provider} API key 触发限流，冷却 {int(wait)} 秒（剩余可用 {self.available_count()} 个）")
+        elif resp.status_code < 400:
+            self._cooldown_until.pop(key, None)
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _reset_seconds(value: Optional[str]) -> Optional[float]:
+    # 有的服务商给剩余秒数（Pixabay），有的给 Unix 时间戳（Pexels）
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1_000_000_000:
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+def _cache_key(provider: str, url: str, params: Optional[dict]) -> str:
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    raw = json.dumps([provider, url, items], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _lru_get(key: str) -> Optional[bytes]:
+    entry = _lru.get(key)
+    if entry is None:
+        return None
+    expires_at, body = entry
+    if expires_at < time.monotonic():
+        _lru.pop(key, None)
+        return None
+    _lru.move_to_end(key)
+    return body
+
+
+def _lru_put(key: str, body: bytes, ttl: int) -> None:
+    _lru[key] = (time.monotonic() + ttl, body)
+    _lru.move_to_end(key)
+    while len(_lru) > config.MCP_HTTP_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+
+async def _request(
+    url: str,
+    params: Optional[dict],
+    headers: Optional[dict],
+    rotator: Optional[ApiKeyRotator],
+    apply_key: Optional[Callable[[str, dict, dict], None]],
+) -> bytes:
+    client = get_mcp_http_client()
+    # 有多个 key 时，被限流可换一个 key 重试一次
+    attempts = 2 if rotator is not None and rotator.available_count() > 1 else 1
+    for attempt in range(attempts):
+        req_params = dict(params or {})
+        req_headers = dict(headers or {})
+        key = None
+        if rotator is not None:
+            key = rotator.next_key()
+            apply_key(key, req_params, req_headers)
+        resp = await client.get(url, params=req_params or None, headers=req_headers or None)
+        if rotator is not None:
+            rotator.record_response(key, resp)
+        if resp.status_code == 429 and attempt + 1 < attempts:
+            continue
+        resp.raise_for_status()
+        return resp.content
+    raise RuntimeError("unreachable")
+
+
+async def fetch_json(
+    provider: str,
+    url: str,
+    params: Optional[dict] = None,
+    headers: Optional[dict] = None,
+    rotator: Optional[ApiKeyRotator] = None,
+    apply_key: Optional[Callable[[str, dict, dict], None]] = None,
+    ttl: Optional[int] = None,
+) -> Any:
+    """
+    发起 GET 请求并返回 JSON（带响应缓存）
+
+    Args:
+        provider: 服务商名称（参与缓存键）
+        url: 接口地址
+        params: 查询参数（不含 API key，参与缓存键）
+        headers: 额外请求头（不参与缓存键）
+        rotator: API key 轮询器
+        apply_key: 把 key 写入请求参数或请求头的回调 (key, params, headers)
+        ttl: 缓存有效期（秒），默认 MCP_HTTP_CACHE_TTL，0 为不缓存
+    """
+    ttl = config.MCP_HTTP_CACHE_TTL if ttl is None else ttl
+    if ttl <= 0:
+        return json.loads(await _request(url, params, headers, rotator, apply_key))
+
+    key = _cache_key(provider, url, params)
+    body = _lru_get(key)
+    if body is not None:
+        return json.loads(body)
+
+    async def _load() -> bytes:
+        body = get_cached_mcp_response(key)
+        if body is None:
+            body = await _request(url, params, headers, rotator, apply_key)
+            json.loads(body)  # 先校验是合法 JSON 再写入缓存
+            set_cached_mcp_response(key, body, ttl)
+        else:
+            json.loads(body)
+        _lru_put(key, body, ttl)
+        return body
+
+    # 每个调用方各自解析，避免共享同一个可变对象
+    body, _ = await _flight.do(key, _load)
+    return json.loads(body)
@@ -2,30 +2,27 @@
 Pixabay 多媒体资源 SDK MCP 服务器
 在 Agent 进程内运行，无需独立进程
 """
-import itertools
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
-# API key 轮询器
-_key_pool = None
+from ..system import config
+from .mcp_http import ApiKeyRotator, fetch_json
+
+# API key 轮询器（跳过被限流冷却中的 key）
+_key_rotator = ApiKeyRotator("pixabay", lambda: config.PIXABAY_API_KEYS)
 
 
 def get_next_key() -> str:
     """获取下一个 API key（轮询）"""
-    global _key_pool
-    if _key_pool is None:
-        from ..system.config import PIXABAY_API_KEYS
-        _key_pool = itertools.cycle(PIXABAY_API_KEYS)
-    return next(_key_pool)
+    return _key_rotator.next_key()
+
+
+def _apply_key(key: str, params: dict, headers: dict) -> None:
+    params["key"] = key
 
 
 async def fetch_pixabay(endpoint: str, params: dict) -> dict:
-    """请求 Pixabay API"""
-    import httpx
-    params["key"] = get_next_key()
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.get(endpoint, params=params)
-        resp.raise_for_status()
-        return resp.json()
+    """请求 Pixabay API（共享连接池 + 响应缓存）"""
+    return await fetch_json("pixabay", endpoint, params, rotator=_key_rotator, apply_key=_apply_key)
 
 
 def format_image(hit: dict) -> str:
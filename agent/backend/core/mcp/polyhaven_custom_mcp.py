@@ -3,18 +3,12 @@ Poly Haven 3D 素材工具
 """
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
+from .mcp_http import fetch_json
+
 
 async def fetch_polyhaven(endpoint: str, params: dict = None) -> dict:
-    """请求 Poly Haven API（无需认证）"""
-    import httpx
-    url = f"https://api.polyhaven.com{endpoint}"
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        if params:
-            resp = await client.get(url, params=params)
-        else:
-            resp = await client.get(url)
-        resp.raise_for_status()
-        return resp.json()
+    """请求 Poly Haven API（无需认证；共享连接池 + 响应缓存）"""
+    return await fetch_json("polyhaven", f"https://api.polyhaven.com{endpoint}", params)
 
 
 def format_polyhaven_asset(asset_id: str, info: dict) -> str:
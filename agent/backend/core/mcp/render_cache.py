@@ -0,0 +1,214 @@
+"""
+Kroki / draw.io 渲染结果缓存
+按 (渲染器, 图表类型, 输出格式, 源码 sha256) 缓存渲染结果到磁盘，总容量超限时按最近使用（LRU）淘汰。
+命中时复制到 output_path（不用硬链接：各用户工作区的文件必须互不影响）；相同源码的并发渲染合并为一次远程调用。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from ..cache.single_flight import SingleFlight
+from ..system import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "pdf": "application/pdf",
+}
+
+
+class RenderCache:
+    """渲染结果磁盘缓存（内存中维护 LRU 索引：键 -> (大小, mtime_ns)）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional["OrderedDict[str, Tuple[int, int]]"] = None
+        self._total_bytes = 0
+
+    @staticmethod
+    def get_cache_root() -> Path:
+        return config.get_work_base_dir() / config.RENDER_CACHE_DIR
+
+    @staticmethod
+    def make_key(renderer: str, diagram_type: str, fmt: str, source: str) -> str:
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        return f"{renderer}-{diagram_type}-{fmt}-{digest}"
+
+    def _path_for(self, key: str) -> Path:
+        return self.get_cache_root() / key[-2:] / key
+
+    def _load_index(self) -> "OrderedDict[str, Tuple[int, int]]":
+        # 启动后首次使用时扫描缓存目录，按修改时间近似恢复 LRU 顺序
+        if self._index is not None:
+            return self._index
+        entries = []
+        root = self.get_cache_root()
+        if root.exists():
+            for path in root.glob("*/*"):
+                if path.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat_res = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat_res.st_mtime_ns, path.name, stat_res.st_size))
+        entries.sort()
+        self._index = OrderedDict((name, (size, mtime_ns)) for mtime_ns, name, size in entries)
+        self._total_bytes = sum(size for size, _ in self._index.values())
+        return self._index
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """查询缓存，文件缺失、被改写或仍被旧版本硬链接到工作区时视为未命中"""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            path = self._path_for(key)
+            try:
+                stat_res = path.stat()
+            except OSError:
+                stat_res = None
+            if (
+                stat_res is None
+                or (stat_res.st_size, stat_res.st_mtime_ns) != entry
+                or stat_res.st_nlink > 1
+            ):
+                self._drop(key)
+                return None
+            index.move_to_end(key)
+            return path
+
+    def store(self, key: str, content: bytes) -> Optional[Path]:
+        """写入缓存并按容量淘汰，失败时返回 None（不影响本次渲染结果）"""
+        if len(content) > config.RENDER_CACHE_MAX_BYTES:
+            return None
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+            stat_res = path.stat()
+        except OSError as e:
+            logger.warning(f"写入渲染缓存失败: {e}")
+            return None
+
+        with self._lock:
+            index = self._load_index()
+            previous = index.pop(key, None)
+            if previous:
+                self._total_bytes -= previous[0]
+            index[key] = (stat_res.st_size, stat_res.st_mtime_ns)
+            self._total_bytes += stat_res.st_size
+            while self._total_bytes > config.RENDER_CACHE_MAX_BYTES and len(index) > 1:
+                oldest = next(iter(index))
+                self._drop(oldest)
+        return path
+
+    def _drop(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry:
+            self._total_bytes -= entry[0]
+        try:
+            self._path_for(key).unlink()
+        except OSError:
+            pass
+
+
+render_cache = RenderCache()
+
+# 相同源码的并发请求等待同一次远程调用
+_flight: "SingleFlight[bytes]" = SingleFlight()
+
+
+def _materialize(cached: Optional[Path], content: Optional[bytes], output: Path) -> None:
+    """
+    把结果放到 output：有缓存文件时复制，没有时直接写入
+
+    一律先写临时文件再替换，不原地改写 output 原有的文件。
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+    try:
+        written = False
+        if cached is not None:
+            try:
+                shutil.copyfile(cached, tmp_path)
+                written = True
+            except OSError:
+                # 缓存文件可能刚被淘汰，有内容时退回直接写入
+                if content is None:
+                    raise
+        if not written:
+            tmp_path.write_bytes(content)
+        os.replace(tmp_path, output)
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def _output_from_cache(key: str, output: Path) -> Optional[int]:
+    """命中缓存时复制到 output 并返回大小，未命中返回 None"""
+    cached = render_cache.lookup(key)
+    if cached is None:
+        return None
+    _materialize(cached, None, output)
+    return output.stat().st_size
+
+
+async def render_to_file(
+    renderer: str,
+    diagram_type: str,
+    fmt: str,
+    source: str,
+    output: Path,
+    render: Callable[[], Awaitable[bytes]],
+) -> Tuple[int, bool]:
+    """
+    带缓存地渲染图表并保存到 output
+
+    Args:
+        renderer: 渲染器名称（kroki / drawio）
+        diagram_type: 图表类型
+        fmt: 输出格式
+        source: 图表源码
+        output: 保存路径
+        render: 未命中时调用的远程渲染函数，返回输出字节
+
+    Returns:
+        (输出大小, 是否命中缓存)
+    """
+    if config.RENDER_CACHE_MAX_BYTES <= 0:
+        content = await render()
+        await asyncio.to_thread(_materialize, None, content, output)
+        return len(content), False
+
+    key = render_cache.make_key(renderer, diagram_type, fmt, source)
+    try:
+        size = await asyncio.to_thread(_output_from_cache, key, output)
+        if size is not None:
+            return size, True
+    except OSError as e:
+        logger.warning(f"从渲染缓存输出失败，重新渲染: {e}")
+
+    async def _render() -> bytes:
+        content = await render()
+        await asyncio.to_thread(render_cache.store, key, content)
+        return content
+
+    content, shared = await _flight.do(key, _render)
+    await asyncio.to_thread(_materialize, None, content, output)
+    return len(content), shared
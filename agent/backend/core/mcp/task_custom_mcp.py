@@ -11,6 +11,7 @@ from typing import List
 from claude_agent_sdk import create_sdk_mcp_server, tool
 
 from ..db.dbutil import DatabaseUtil
+from ..system import config
 from .do_mcp_task import schedule_task, cancel_task
 
 db = DatabaseUtil()
@@ -33,6 +34,15 @@ def _parse_run_at(value: str):
         return None
 
 
+def _parse_priority(value) -> int:
+    """优先级截断到 TASK_PRIORITY_MIN ~ TASK_PRIORITY_MAX（来自用户/智能体输入，不能任意插队）"""
+    try:
+        priority = int(value or 0)
+    except (TypeError, ValueError):
+        priority = 0
+    return max(config.TASK_PRIORITY_MIN, min(priority, config.TASK_PRIORITY_MAX))
+
+
 def _has_timezone_suffix(value: str) -> bool:
     if not value:
         return False
@@ -43,9 +53,10 @@ def _has_timezone_suffix(value: str) -> bool:
     name="add_task",
     description=(
         "任务必须前提条件调用先获取当前系统时间mcp__22222222222222__now-time_info"
-        "创建定时任务（批量）。输入 cron 或 date 计划，任务触发时会调用 /api/v1/chat/send 执行。"
+        "创建定时任务（批量）。输入 cron 或 date 计划，任务触发时会把 task_message 作为消息发给该智能体的会话执行。"
         "参数：tasks(数组；每项包含 task_name, task_message, schedule_type[cron/date], "
-        "cron_expr(仅cron), run_at(仅date, ISO), current_time(仅date, ISO), agent_id(必填)。"
+        "cron_expr(仅cron), run_at(仅date, ISO), current_time(仅date, ISO), agent_id(必填), "
+        f"priority(可选，整数，范围 {config.TASK_PRIORITY_MIN}~{config.TASK_PRIORITY_MAX}，越大越先执行，默认0)。"
     ),
     input_schema={
         "type": "object",
@@ -63,6 +74,7 @@ def _has_timezone_suffix(value: str) -> bool:
                         "run_at": {"type": "string"},
                         "current_time": {"type": "string"},
                         "agent_id": {"type": "string"},
+                        "priority": {"type": "integer"},
                     },
                     "required": ["task_name", "agent_id"],
                 },
@@ -139,9 +151,9 @@ async def add_task(args: dict) -> dict:
             """
             INSERT INTO task_custom_mcp (
                 id, user_id, agent_id, session_id, task_name, task_description,
-                task_message, schedule_type, cron_expr, run_at, status, created_at, updated_at
+                task_message, schedule_type, cron_expr, run_at, priority, status, created_at, updated_at
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
             """,
             (
                 task_id,
@@ -154,6 +166,7 @@ async def add_task(args: dict) -> dict:
                 schedule_type,
                 cron_expr if schedule_type == "cron" else None,
                 run_at if schedule_type == "date" else None,
+                _parse_priority(task.get("priority")),
             ),
             fetch=None,
         )
@@ -192,7 +205,7 @@ async def list_tasks(args: dict) -> dict:
     rows = db.execute_query(
         f"""
         SELECT id, task_name, task_description, task_message, schedule_type,
-               cron_expr, run_at, status, last_run_at, next_run_at, created_at, updated_at
+               cron_expr, run_at, priority, status, last_run_at, next_run_at, created_at, updated_at
         FROM task_custom_mcp
         WHERE {' AND '.join(where)}
         ORDER BY created_at DESC
@@ -229,7 +242,8 @@ async def cancel_task_tool(args: dict) -> dict:
     name="update_task",
     description=(
         "更新定时任务并重新调度。参数：task_id、task_name、task_description、task_message、"
-        "schedule_type、cron_expr、run_at"
+        "schedule_type、cron_expr、run_at、"
+        f"priority(范围 {config.TASK_PRIORITY_MIN}~{config.TASK_PRIORITY_MAX})"
     ),
     input_schema={
         "type": "object",
@@ -241,6 +255,7 @@ async def cancel_task_tool(args: dict) -> dict:
             "schedule_type": {"type": "string"},
             "cron_expr": {"type": "string"},
             "run_at": {"type": "string"},
+            "priority": {"type": "integer"},
         },
         "required": ["task_id"],
     },
@@ -276,6 +291,9 @@ async def update_task(args: dict) -> dict:
         parsed = _parse_run_at(run_at)
         updates.append("run_at = %s")
         params.append(parsed)
+    if args.get("priority") is not None:
+        updates.append("priority = %s")
+        params.append(_parse_priority(args.get("priority")))
 
     if not updates:
         return {"content": [{"type": "text", "text": "没有更新字段"}]}
@@ -0,0 +1,118 @@
+"""
+会员状态缓存
+- 缓存 get_active_subscription 的结果（包括"非会员"），进程内短 TTL + Redis 跨 worker 共享
+- 会员条目在 min(TTL, end_date) 时过期，到期后不会被继续当作会员
+- 开通/续费（create_subscription、管理员开通）后调用 invalidate 立即失效
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from ..cache.redis_cache import get_cached_membership, set_cached_membership, invalidate_cached_membership
+from ..system import config
+
+_DATETIME_FIELDS = ("start_date", "end_date", "created_at", "updated_at")
+
+_MAX_LOCAL_ENTRIES = 10000
+
+_lock = threading.Lock()
+# user_id -> (过期时间 monotonic, 会员记录或 None)
+_entries: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+
+# 用户失效次数，查询前取快照，查询期间发生失效则不写回（避免旧结果覆盖刚开通的会员）
+_versions: Dict[str, int] = {}
+
+# 未命中标记（区分"没有缓存"与"缓存为非会员"）
+MISS = object()
+
+
+def _ttl_for(subscription: Optional[Dict[str, Any]], ttl: int) -> float:
+    if not subscription:
+        return ttl
+    end_date = subscription.get("end_date")
+    if not isinstance(end_date, datetime):
+        return ttl
+    return min(ttl, (end_date - datetime.utcnow()).total_seconds())
+
+
+def _encode(subscription: Optional[Dict[str, Any]]) -> bytes:
+    if subscription is None:
+        return b"null"
+    data = {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in subscription.items()
+    }
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def _decode(body: bytes) -> Optional[Dict[str, Any]]:
+    data = json.loads(body)
+    if data is None:
+        return None
+    for key in _DATETIME_FIELDS:
+        if data.get(key):
+            data[key] = datetime.fromisoformat(data[key])
+    return data
+
+
+def get(user_id: str) -> Any:
+    """读取缓存，未命中返回 MISS"""
+    if config.MEMBERSHIP_CACHE_TTL <= 0:
+        return MISS
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                return entry[1]
+            _entries.pop(user_id, None)
+
+    body = get_cached_membership(user_id)
+    if body is None:
+        return MISS
+    try:
+        subscription = _decode(body)
+    except (ValueError, TypeError):
+        return MISS
+    local_ttl = _ttl_for(subscription, config.MEMBERSHIP_LOCAL_CACHE_TTL)
+    if local_ttl <= 0:
+        return MISS
+    _put_local(user_id, subscription, local_ttl)
+    return subscription
+
+
+def _put_local(user_id: str, subscription: Optional[Dict[str, Any]], local_ttl: float) -> None:
+    with _lock:
+        _entries[user_id] = (time.monotonic() + local_ttl, subscription)
+        _entries.move_to_end(user_id)
+        while len(_entries) > _MAX_LOCAL_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def snapshot(user_id: str) -> int:
+    """取当前版本号（查库前调用，写入时带回）"""
+    with _lock:
+        return _versions.get(user_id, 0)
+
+
+def put(user_id: str, subscription: Optional[Dict[str, Any]], version: int) -> None:
+    """写入缓存（已到期的会员不缓存；version 为查库前 snapshot 的结果）"""
+    if config.MEMBERSHIP_CACHE_TTL <= 0 or snapshot(user_id) != version:
+        return
+    ttl = _ttl_for(subscription, config.MEMBERSHIP_CACHE_TTL)
+    if ttl < 1:
+        return
+    set_cached_membership(user_id, _encode(subscription), int(ttl))
+    local_ttl = _ttl_for(subscription, config.MEMBERSHIP_LOCAL_CACHE_TTL)
+    if local_ttl > 0:
+        _put_local(user_id, subscription, local_ttl)
+
+
+def invalidate(user_id: str) -> None:
+    """使用户的会员缓存失效（其他 worker 的进程内缓存最多再保留 MEMBERSHIP_LOCAL_CACHE_TTL 秒）"""
+    with _lock:
+        _entries.pop(user_id, None)
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+    invalidate_cached_membership(user_id)
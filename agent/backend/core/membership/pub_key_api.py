@@ -1,15 +1,47 @@
 """
 API Key utilities for selecting model credentials by membership level.
+Selection runs against an in-memory router (api_key_router) instead of locking rows per fetch.
 """
 
+import logging
+import random
+import threading
+import time
 import uuid
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List, Any, Set
 
 import psycopg2.extras
 
+from ..cache.redis_cache import get_api_keys_version, bump_api_keys_version
 from ..db.dbutil import DatabaseUtil
+from ..system import config
 
 db = DatabaseUtil()
+logger = logging.getLogger(__name__)
+
+# Smoothing factor for per-key error rate / latency moving averages.
+_EWMA_ALPHA = 0.2
+
+# Error text that points at the key or the provider behind it (auth, quota, rate limit, outage).
+# Anything else (max turns, tool failures, CLI crashes, DB errors) says nothing about the key.
+_KEY_ERROR_MARKERS = (
+    "api error",
+    "authentication_error",
+    "invalid api key",
+    "invalid x-api-key",
+    "unauthorized",
+    "credit balance",
+    "insufficient_quota",
+    "quota exceeded",
+    "rate_limit_error",
+    "overloaded",
+)
+
+
+def is_key_error(error: Optional[str]) -> bool:
+    """Whether a failed request should count against the API key that served it."""
+    text = (error or "").lower()
+    return any(marker in text for marker in _KEY_ERROR_MARKERS)
 
 
 def _next_priority(membership_type: str) -> int:
@@ -67,52 +99,22 @@ def create_api_key(
             ),
         )
         conn.commit()
-        return key_id
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
+    _notify_api_keys_changed()
+    return key_id
 
 
 def get_api_key_for_membership(membership_type: str) -> Optional[Dict[str, Any]]:
     """
-    Fetch an active API key for a membership type (lowest priority first).
+    Pick an active API key for a membership type from the in-memory router.
     Keys with membership_type 'all' are also eligible.
-    Each fetch bumps the selected key's priority to the end for simple rotation.
+    Use api_key_router.acquire() instead when the key backs a long-lived agent client.
     """
-    conn = db.get_connection()
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute(
-            """
-            WITH picked AS (
-                SELECT id
-                FROM api_keys
-                WHERE membership_type IN (%s, 'all') AND status = 'active'
-                ORDER BY priority ASC, created_at ASC
-                LIMIT 1
-                FOR UPDATE
-            )
-            UPDATE api_keys
-            SET priority = (
-                SELECT COALESCE(MAX(priority), 0) + 1
-                FROM api_keys
-                WHERE membership_type IN (%s, 'all')
-            )
-            WHERE id IN (SELECT id FROM picked)
-            RETURNING id, membership_type, base_url, auth_token, model_name, priority
-            """,
-            (membership_type, membership_type),
-        )
-        row = cursor.fetchone()
-        conn.commit()
-        return dict(row) if row else None
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+    return api_key_router.select(membership_type)
 
 
 def list_api_keys(membership_type: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -160,3 +162,281 @@ def update_api_key_status(key_id: str, status: str, error: Optional[str] = None)
         raise
     finally:
         conn.close()
+    _notify_api_keys_changed()
+
+
+def _load_active_keys() -> List[Dict[str, Any]]:
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(
+            """
+            SELECT id, membership_type, base_url, auth_token, model_name, priority
+            FROM api_keys
+            WHERE status = 'active'
+            ORDER BY priority ASC, created_at ASC
+            """
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def _notify_api_keys_changed() -> None:
+    """Tell every worker (via the Redis version) and this process to reload keys."""
+    bump_api_keys_version()
+    api_key_router.invalidate()
+
+
+class _KeyHealth:
+    """Runtime counters the router keeps for one key."""
+
+    __slots__ = (
+        "active",
+        "successes",
+        "failures",
+        "consecutive_failures",
+        "error_rate",
+        "latency_ms",
+        "cooldown_until",
+        "cooldowns",
+        "last_error",
+    )
+
+    def __init__(self):
+        self.active = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.error_rate = 0.0
+        self.latency_ms: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.cooldowns = 0
+        self.last_error: Optional[str] = None
+
+
+class ApiKeyRouter:
+    """
+    In-memory API key selection.
+
+    Active keys are loaded once and rotated locally, so building an agent client
+    no longer takes row locks. The cache is reloaded when the Redis change version
+    moves (create / status update on any worker) and every
+    API_KEY_ROUTER_REFRESH_INTERVAL seconds as a fallback.
+
+    Strategies (API_KEY_ROUTER_STRATEGY):
+    - least_loaded: fewest active agent clients, round-robin among ties
+    - round_robin: plain rotation in priority order
+    - weighted: random pick weighted by recent error rate, latency and load
+    Keys cooling down after repeated key errors are skipped while any other key is available.
+    When a key starts cooling down, the agents using it lose their assignment and are
+    flagged so their next request rebuilds the client with a healthy key (take_rebuild()).
+    Cooldowns are local and temporary; the database status only changes via update_api_key_status().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: List[Dict[str, Any]] = []
+        self._health: Dict[str, _KeyHealth] = {}
+        self._assignments: Dict[str, str] = {}  # agent_id -> key_id
+        self._cursor: Dict[str, int] = {}  # membership_type -> rotation offset
+        self._needs_rebuild: Set[str] = set()  # agent_ids whose client still carries a failed key
+        self._loaded_at = 0.0
+        self._version: Optional[int] = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def _refresh_if_needed(self) -> None:
+        version = get_api_keys_version()
+        with self._lock:
+            fresh = (
+                self._loaded_at
+                and time.monotonic() - self._loaded_at < config.API_KEY_ROUTER_REFRESH_INTERVAL
+            )
+            if fresh and (version is None or version == self._version):
+                return
+        try:
+            keys = _load_active_keys()
+        except Exception:
+            logger.exception("Failed to reload API keys, keeping %d cached", len(self._keys))
+            return
+        with self._lock:
+            self._keys = keys
+            self._version = version
+            self._loaded_at = time.monotonic()
+            loaded = {key["id"] for key in keys}
+            for key_id in loaded:
+                self._health.setdefault(key_id, _KeyHealth())
+            assigned = set(self._assignments.values())
+            for key_id in list(self._health):
+                if key_id not in loaded and key_id not in assigned:
+                    del self._health[key_id]
+
+    def _weight(self, key_id: str) -> float:
+        health = self._health[key_id]
+        latency = max(health.latency_ms or 1000.0, 50.0)
+        return max(0.05, 1.0 - health.error_rate) * 1000.0 / latency / (1 + health.active)
+
+    def _pick(self, membership_type: str) -> Optional[Dict[str, Any]]:
+        candidates = [key for key in self._keys if key["membership_type"] in (membership_type, "all")]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        pool = [key for key in candidates if self._health[key["id"]].cooldown_until <= now] or candidates
+
+        strategy = config.API_KEY_ROUTER_STRATEGY
+        if strategy == "weighted":
+            return random.choices(pool, weights=[self._weight(key["id"]) for key in pool])[0]
+
+        offset = self._cursor.get(membership_type, 0) % len(pool)
+        self._cursor[membership_type] = offset + 1
+        rotated = pool[offset:] + pool[:offset]
+        if strategy == "round_robin":
+            return rotated[0]
+        return min(rotated, key=lambda key: self._health[key["id"]].active)
+
+    def select(self, membership_type: str) -> Optional[Dict[str, Any]]:
+        """Pick a key without tracking who uses it."""
+        self._refresh_if_needed()
+        with self._lock:
+            key = self._pick(membership_type)
+            return dict(key) if key else None
+
+    def acquire(self, agent_id: str, membership_type: str) -> Optional[Dict[str, Any]]:
+        """Pick a key for an agent client and count it as active until release()."""
+        self._refresh_if_needed()
+        with self._lock:
+            self._release_locked(agent_id)
+            self._needs_rebuild.discard(agent_id)
+            key = self._pick(membership_type)
+            if not key:
+                return None
+            self._assignments[agent_id] = key["id"]
+            self._health[key["id"]].active += 1
+            return dict(key)
+
+    def release(self, agent_id: str) -> None:
+        with self._lock:
+            self._release_locked(agent_id)
+            self._needs_rebuild.discard(agent_id)
+
+    def take_rebuild(self, agent_id: str) -> bool:
+        """Return True (once) if the agent's client was built with a key that has since failed."""
+        with self._lock:
+            if agent_id not in self._needs_rebuild:
+                return False
+            self._needs_rebuild.discard(agent_id)
+            return True
+
+    def _release_locked(self, agent_id: str) -> None:
+        key_id = self._assignments.pop(agent_id, None)
+        health = self._health.get(key_id) if key_id else None
+        if health and health.active > 0:
+            health.active -= 1
+
+    def _has_alternative(self, failed: Dict[str, Any]) -> bool:
+        now = time.monotonic()
+        return any(
+            key["id"] != failed["id"]
+            and key["membership_type"] in (failed["membership_type"], "all")
+            and self._health[key["id"]].cooldown_until <= now
+            for key in self._keys
+        )
+
+    def record_result(
+        self,
+        agent_id: str,
+        ok: bool,
+        latency_ms: Optional[float] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Record the outcome of a request made with the agent's key.
+        Failures that are not key errors (see is_key_error) are ignored.
+        After API_KEY_FAILURE_THRESHOLD consecutive key errors the key cools down for
+        API_KEY_COOLDOWN_SECONDS and, if another key can take over, every agent holding
+        it is flagged for a client rebuild. Once the cooldown ends the key is tried again:
+        a success clears it, another key error starts a cooldown twice as long (up to
+        API_KEY_COOLDOWN_MAX_SECONDS).
+        """
+        if not ok and not is_key_error(error):
+            return
+        with self._lock:
+            key_id = self._assignments.get(agent_id)
+            health = self._health.get(key_id) if key_id else None
+            if not health:
+                return
+            health.error_rate = (1 - _EWMA_ALPHA) * health.error_rate + _EWMA_ALPHA * (0.0 if ok else 1.0)
+            if ok:
+                health.successes += 1
+                health.consecutive_failures = 0
+                health.cooldowns = 0
+                if latency_ms is not None:
+                    health.latency_ms = (
+                        float(latency_ms)
+                        if health.latency_ms is None
+                        else (1 - _EWMA_ALPHA) * health.latency_ms + _EWMA_ALPHA * latency_ms
+                    )
+                return
+
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.last_error = (error or "")[:500] or None
+            if health.cooldown_until > time.monotonic():
+                # Requests already in flight when the cooldown started.
+                return
+            # A key that already cooled down gets one probe request before the next cooldown.
+            if health.cooldowns == 0 and health.consecutive_failures < config.API_KEY_FAILURE_THRESHOLD:
+                return
+            health.consecutive_failures = 0
+            cooldown = min(
+                config.API_KEY_COOLDOWN_SECONDS * 2 ** health.cooldowns,
+                max(config.API_KEY_COOLDOWN_SECONDS, config.API_KEY_COOLDOWN_MAX_SECONDS),
+            )
+            health.cooldowns += 1
+            health.cooldown_until = time.monotonic() + cooldown
+            key = next((key for key in self._keys if key["id"] == key_id), None)
+            # Only move agents off the key when another key can take over.
+            if key is not None and self._has_alternative(key):
+                affected = [agent for agent, assigned in self._assignments.items() if assigned == key_id]
+                for agent in affected:
+                    self._release_locked(agent)
+                    self._needs_rebuild.add(agent)
+            message = health.last_error
+
+        logger.warning("API key %s cooling down for %ss after repeated key errors: %s", key_id, cooldown, message)
+
+    def get_metrics(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        metrics = []
+        with self._lock:
+            for key in self._keys:
+                health = self._health[key["id"]]
+                metrics.append({
+                    "id": key["id"],
+                    "membership_type": key["membership_type"],
+                    "active_clients": health.active,
+                    "successes": health.successes,
+                    "failures": health.failures,
+                    "error_rate": round(health.error_rate, 3),
+                    "latency_ms": health.latency_ms,
+                    "cooling_down": health.cooldown_until > now,
+                    "last_error": health.last_error,
+                })
+        return metrics
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Aggregate counts only (no key ids or error text), safe for public status endpoints."""
+        now = time.monotonic()
+        with self._lock:
+            health = [self._health[key["id"]] for key in self._keys]
+            return {
+                "keys": len(health),
+                "cooling_down": sum(1 for item in health if item.cooldown_until > now),
+                "active_clients": sum(item.active for item in health),
+            }
+
+
+api_key_router = ApiKeyRouter()
@@ -2,14 +2,19 @@
 会员订阅模块
 包含：会员管理、配额检查、使用记录
 """
+import asyncio
+import threading
 import uuid
 import sys
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Tuple
+import psycopg2.extras
 from fastapi import APIRouter, HTTPException, Depends
+from ..cache.redis_cache import incr_quota_count, get_quota_count
 from ..db.dbutil import DatabaseUtil
 from ..system import config
 from ..auth.auth_filter import get_current_user_id
+from . import membership_cache
 
 router = APIRouter()
 db = DatabaseUtil()
@@ -59,6 +64,7 @@ class SubscriptionRepository:
                 start_date, end_date, True
             ))
             conn.commit()
+            membership_cache.invalidate(user_id)
             print(f"[会员创建] 用户ID: {user_id}, 手机号: {phone}, 等级: {membership_level}, 过期时间: {end_date}")
             return sub_id
         except Exception as e:
@@ -68,15 +74,22 @@ class SubscriptionRepository:
         finally:
             conn.close()
 
-    def get_active_subscription(self, user_id: str) -> Optional[Dict]:
-        """获取用户的活跃会员"""
+    def get_active_subscription(self, user_id: str, use_cache: bool = True) -> Optional[Dict]:
+        """获取用户的活跃会员（默认走会员缓存，开通/续费等写操作前传 use_cache=False 读库）"""
+        if use_cache:
+            cached = membership_cache.get(user_id)
+            if cached is not membership_cache.MISS:
+                return cached
+        version = membership_cache.snapshot(user_id)
         query = '''
             SELECT * FROM sub_pro
             WHERE user_id = %s AND is_active = TRUE AND end_date > CURRENT_TIMESTAMP
             ORDER BY created_at DESC LIMIT 1
         '''
         result = self.db.execute_query(query, (user_id,), "one")
-        return dict(result) if result else None
+        subscription = dict(result) if result else None
+        membership_cache.put(user_id, subscription, version)
+        return subscription
 
     def has_valid_subscription(self, user_id: str) -> bool:
         """检查用户是否有有效会员"""
@@ -115,65 +128,65 @@ class UsageTracker:
                        timedelta(hours=hour_offset))
         return window_start
 
-    def _get_or_create_quota_record(self, user_id: str, window_start: datetime) -> Dict:
-        """获取或创建配额记录"""
-        # 先尝试获取现有记录
+    def _db_get_quota_count(self, user_id: str, window_start: datetime) -> int:
+        """从配额表读取当前窗口计数"""
         query = '''
-            SELECT * FROM quota_usage
+            SELECT message_count FROM quota_usage
             WHERE user_id = %s AND window_start = %s
         '''
         result = self.db.execute_query(query, (user_id, window_start), "one")
+        return result['message_count'] if result else 0
 
-        if result:
-            return dict(result)
+    def _db_increment_quota(self, user_id: str, window_start: datetime) -> Optional[int]:
+        """
+        在配额表中原子地计数 +1（Redis 不可用时的兜底）
 
-        # 不存在则创建新记录
-        record_id = str(uuid.uuid4())
-        insert_query = '''
+        Returns:
+            计数后的值；已达上限时返回 None（不计数）
+        """
+        upsert_query = '''
             INSERT INTO quota_usage (id, user_id, window_start, message_count)
-            VALUES (%s, %s, %s, 0)
+            VALUES (%s, %s, %s, 1)
+            ON CONFLICT (user_id, window_start) DO UPDATE
+            SET message_count = quota_usage.message_count + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE quota_usage.message_count < %s
+            RETURNING message_count
         '''
         conn = self.db.get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(insert_query, (record_id, user_id, window_start))
+            cursor.execute(upsert_query, (str(uuid.uuid4()), user_id, window_start, NON_MEMBER_LIMIT_MAX))
+            row = cursor.fetchone()
             conn.commit()
-            return {
-                'id': record_id,
-                'user_id': user_id,
-                'window_start': window_start,
-                'message_count': 0
-            }
+            return row[0] if row else None
         except Exception as e:
-            print(f"[配额记录创建失败] 错误: {str(e)}")
+            print(f"[配额计数更新失败] 错误: {str(e)}", file=sys.stderr)
             conn.rollback()
             raise
         finally:
             conn.close()
 
-    def _increment_quota_count(self, user_id: str, window_start: datetime) -> bool:
-        """增加配额计数"""
-        update_query = '''
-            UPDATE quota_usage
-            SET message_count = message_count + 1, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s AND window_start = %s
-        '''
-        conn = self.db.get_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(update_query, (user_id, window_start))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"[配额计数更新失败] 错误: {str(e)}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+    def _redis_increment_quota(self, user_id: str, window_start: datetime, reset_at: datetime) -> Optional[int]:
+        """
+        Redis 计数 +1（包括超限的请求），返回计数后的值；Redis 不可用返回 None
+
+        窗口内第一次计数时（Redis 重启或刚启用）用配额表中已有的计数补齐。
+        """
+        window_ts = _utc_timestamp(window_start)
+        expire_at = _utc_timestamp(reset_at) + 60
+        count = incr_quota_count(user_id, window_ts, expire_at)
+        if count == 1:
+            try:
+                existing = self._db_get_quota_count(user_id, window_start)
+            except Exception:
+                existing = 0
+            if existing > 0:
+                count = incr_quota_count(user_id, window_ts, expire_at, existing) or count
+        return count
 
     def check_message_quota(self, user_id: str, increment: bool = False) -> Dict:
         """
-        检查用户消息配额（使用配额表，不查聊天表）
+        检查用户消息配额（Redis 计数为准，配额表异步回写留档；Redis 不可用时直接使用配额表）
 
         Args:
             user_id: 用户ID
@@ -203,24 +216,30 @@ class UsageTracker:
                 'reset_at': None
             }
 
-        # 非会员：使用配额表查询
         window_start = self._get_current_window_start()
-        record = self._get_or_create_quota_record(user_id, window_start)
-        count = record.get('message_count', 0)
-
-        allowed = count < NON_MEMBER_LIMIT_MAX
-        remaining = max(0, NON_MEMBER_LIMIT_MAX - count)
         reset_at = window_start + timedelta(hours=NON_MEMBER_LIMIT_HOURS)
 
-        # 如果需要且允许，增加计数（异步执行，失败不影响主流程）
-        if increment and allowed:
-            try:
-                self._increment_quota_count(user_id, window_start)
-                remaining -= 1
-            except Exception as e:
-                # 计数失败只记录日志，不影响返回
-                print(f"[配额计数失败] 错误: {str(e)}", file=sys.stderr)
+        if not increment:
+            count = get_quota_count(user_id, _utc_timestamp(window_start))
+            if count is None:
+                count = self._db_get_quota_count(user_id, window_start)
+            count = min(count, NON_MEMBER_LIMIT_MAX)
+            allowed = count < NON_MEMBER_LIMIT_MAX
+        elif NON_MEMBER_LIMIT_MAX <= 0:
+            count, allowed = 0, False
+        else:
+            new_count = self._redis_increment_quota(user_id, window_start, reset_at)
+            if new_count is not None:
+                # 超限请求也会计入 Redis，对外只报告不超过上限的次数
+                allowed = new_count <= NON_MEMBER_LIMIT_MAX
+                count = min(new_count - 1, NON_MEMBER_LIMIT_MAX)
+                _schedule_quota_write_back(user_id, window_start, min(new_count, NON_MEMBER_LIMIT_MAX))
+            else:
+                new_count = self._db_increment_quota(user_id, window_start)
+                allowed = new_count is not None
+                count = new_count - 1 if allowed else NON_MEMBER_LIMIT_MAX
 
+        remaining = max(0, NON_MEMBER_LIMIT_MAX - count - (1 if increment and allowed else 0))
         return {
             'allowed': allowed,
             'is_member': False,
@@ -230,6 +249,66 @@ class UsageTracker:
             'reset_at': reset_at
         }
 
+
+def _utc_timestamp(value: datetime) -> int:
+    return int(value.replace(tzinfo=timezone.utc).timestamp())
+
+
+# ==================== 配额计数异步回写 ====================
+
+# (user_id, window_start) -> 最新计数，合并一段时间内的计数后批量写入 quota_usage
+_quota_write_back_lock = threading.Lock()
+_pending_quota_counts: Dict[Tuple[str, datetime], int] = {}
+_quota_write_back_scheduled = False
+
+
+def _schedule_quota_write_back(user_id: str, window_start: datetime, count: int) -> None:
+    global _quota_write_back_scheduled
+    key = (user_id, window_start)
+    with _quota_write_back_lock:
+        _pending_quota_counts[key] = max(_pending_quota_counts.get(key, 0), count)
+        if _quota_write_back_scheduled:
+            return
+        _quota_write_back_scheduled = True
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        _flush_quota_counts()
+    else:
+        loop.call_later(config.QUOTA_WRITE_BACK_DELAY, loop.run_in_executor, None, _flush_quota_counts)
+
+
+def _flush_quota_counts() -> None:
+    """把合并后的计数写入 quota_usage（只增不减，与 Redis 兜底路径的写入互不覆盖）"""
+    global _pending_quota_counts, _quota_write_back_scheduled
+    with _quota_write_back_lock:
+        pending, _pending_quota_counts = _pending_quota_counts, {}
+        _quota_write_back_scheduled = False
+    if not pending:
+        return
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(
+            cursor,
+            '''
+            INSERT INTO quota_usage (id, user_id, window_start, message_count)
+            VALUES %s
+            ON CONFLICT (user_id, window_start) DO UPDATE
+            SET message_count = GREATEST(quota_usage.message_count, EXCLUDED.message_count),
+                updated_at = CURRENT_TIMESTAMP
+            ''',
+            [(str(uuid.uuid4()), user_id, window_start, count) for (user_id, window_start), count in pending.items()],
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"[配额回写失败] 错误: {str(e)}", file=sys.stderr)
+        conn.rollback()
+    finally:
+        conn.close()
+
 # ==================== 公共接口函数 ====================
 
 def create_free_trial_subscription(user_id: str, phone: str) -> str:
@@ -389,7 +468,7 @@ async def admin_activate_membership(request: dict):
 
         # 检查会员记录（所有用户首次登录都会创建7天试用）
         print(f"[管理员开通] 检查会员状态...")
-        existing_sub = sub_repo.get_active_subscription(user_id)
+        existing_sub = sub_repo.get_active_subscription(user_id, use_cache=False)
 
         if existing_sub:
             print(f"[管理员开通] ✓ 找到活跃会员: {existing_sub}")
@@ -411,6 +490,7 @@ async def admin_activate_membership(request: dict):
                 cursor = conn.cursor()
                 cursor.execute(update_query, (new_end_date, package_info['type'], existing_sub['id']))
                 conn.commit()
+                membership_cache.invalidate(user_id)
                 print(f"[管理员开通] ✅ [续费成功] 手机号: {phone}, 套餐: {package_info['name']}, 原过期: {old_end_date}, 新过期: {new_end_date}")
             finally:
                 conn.close()
@@ -458,6 +538,7 @@ async def admin_activate_membership(request: dict):
                     cursor.execute(update_query, (start_date, end_date, package_info['type'], sub_result['id']))
                     affected_row = cursor.rowcount
                     conn.commit()
+                    membership_cache.invalidate(user_id)
                     print(f"[管理员开通] ✅ [重新开通成功] 手机号: {phone}, 套餐: {package_info['name']}, 新过期: {end_date}, 影响行数: {affected_row}")
                 finally:
                     conn.close()
@@ -12,9 +12,10 @@ from urllib.parse import quote
 import httpx
 import jwt
 from fastapi import APIRouter, HTTPException, Request, status
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import HTMLResponse
 
 from ..system import config
+from ..system.http_cache import conditional_file_response
 from ..agent.agent_manager import get_agent_work_dir
 from ..auth.auth_utils import verify_token
 from ..db.dbutil import DatabaseUtil
@@ -207,6 +208,7 @@ async def onlyoffice_file(
     session_id: str,
     path: str,
     token: str,
+    request: Request,
 ):
     user_id = _get_user_id_from_token(token)
     session_info = _get_session_workdir(session_id, user_id)
@@ -221,7 +223,7 @@ async def onlyoffice_file(
 
     media_type, _ = mimetypes.guess_type(target.name)
     media_type = media_type or "application/octet-stream"
-    return FileResponse(path=str(target), media_type=media_type, filename=None)
+    return conditional_file_response(request, target, media_type=media_type)
 
 
 @router.post("/callback")
@@ -9,7 +9,10 @@ from datetime import datetime, timedelta
 from typing import Set
 from ..system import config
 from ..agent.agent_manager import agent_manager
-from ..mcp.do_mcp_task import start_task_scheduler, stop_task_scheduler
+from ..cache.preview_cache import preview_cache
+from ..kbs.embedding_queue import embedding_queue_worker
+from ..mcp.do_mcp_task import start_task_scheduler, stop_task_scheduler, get_task_dispatch_metrics
+from ..membership.pub_key_api import api_key_router
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +69,31 @@ async def _idle_agent_cleanup_task():
             await asyncio.sleep(30)
 
 
+async def _preview_cache_cleanup_task():
+    """
+    定期清理预览缓存
+    移除源文件已删除/修改的缓存，并按单用户/全局容量上限淘汰
+    """
+    interval_seconds = config.PREVIEW_CACHE_CLEANUP_INTERVAL
+
+    logger.info(f"🧹 启动预览缓存清理任务，间隔: {interval_seconds}秒")
+
+    while True:
+        try:
+            await asyncio.sleep(interval_seconds)
+            freed = await asyncio.to_thread(preview_cache.cleanup_all)
+            if freed > 0:
+                logger.info(f"✅ 预览缓存清理完成: 共释放 {freed} 字节")
+
+        except asyncio.CancelledError:
+            preview_cache.flush()
+            logger.info("🛑 预览缓存清理任务已停止")
+            break
+        except Exception as e:
+            logger.error(f"❌ 预览缓存清理任务异常: {e}")
+            await asyncio.sleep(30)
+
+
 def start_background_tasks():
     """启动所有后台任务"""
     logger.info("🚀 启动后台任务...")
@@ -75,6 +103,17 @@ def start_background_tasks():
     _running_tasks.add(task)
     task.add_done_callback(_running_tasks.discard)
 
+    # 启动预览缓存清理任务
+    task = asyncio.create_task(_preview_cache_cleanup_task())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+
+    # 启动后台向量化任务（聊天碎片等延迟补全 embedding）
+    if config.KB_ENABLED and config.KB_USE_VECTOR:
+        task = asyncio.create_task(embedding_queue_worker())
+        _running_tasks.add(task)
+        task.add_done_callback(_running_tasks.discard)
+
     # 启动定时任务调度器（常驻）
     start_task_scheduler()
 
@@ -111,6 +150,13 @@ def get_background_tasks_status() -> dict:
                 "description": "清理超时的空闲agent",
                 "interval": f"{interval}秒 ({interval//60}分钟)",
                 "timeout": f"{timeout}秒 ({timeout//3600}小时)"
+            },
+            {
+                "name": "preview_cache_cleanup",
+                "description": "清理过期预览缓存并按容量上限淘汰",
+                "interval": f"{config.PREVIEW_CACHE_CLEANUP_INTERVAL}秒"
             }
-        ]
+        ],
+        "task_dispatch": get_task_dispatch_metrics(),
+        "api_keys": api_key_router.get_summary(),
     }
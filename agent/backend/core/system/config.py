@@ -107,6 +107,19 @@ ARCHIVE_DIR_NAME = "svn"
 # 预览缓存目录名称
 PREVIEW_CACHE_DIR = ".preview_cache"
 
+# 预览缓存容量上限（字节）：单用户 / 全局，超出后按最近访问时间（LRU）淘汰
+PREVIEW_CACHE_USER_MAX_BYTES = int(os.getenv('PREVIEW_CACHE_USER_MAX_BYTES', str(256 * 1024 * 1024)))
+PREVIEW_CACHE_GLOBAL_MAX_BYTES = int(os.getenv('PREVIEW_CACHE_GLOBAL_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))
+
+# 预览缓存清理间隔（秒），清理源文件已删除/已修改的缓存并执行全局容量淘汰
+PREVIEW_CACHE_CLEANUP_INTERVAL = int(os.getenv('PREVIEW_CACHE_CLEANUP_INTERVAL', '3600'))
+
+# 缩略图：默认宽度 / 最大宽度（像素）、编码质量、生成线程数
+THUMBNAIL_DEFAULT_WIDTH = int(os.getenv('THUMBNAIL_DEFAULT_WIDTH', '480'))
+THUMBNAIL_MAX_WIDTH = int(os.getenv('THUMBNAIL_MAX_WIDTH', '1600'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+
 # 公开技能目录名称
 PUBLIC_SKILLS_DIR = "skills_public"
 
@@ -149,11 +162,46 @@ FIREWALL_BASH_ISOLATION_PROMPT = (
 DRAWIO_EXPORT_URL = os.getenv("DRAWIO_EXPORT_URL", "http://127.0.0.1:8025/export")
 # Kroki 渲染服务地址（可自建）
 KROKI_URL = os.getenv("KROKI_URL", "http://127.0.0.1:8004")
+# Kroki / draw.io 渲染结果缓存：目录名（位于工作目录根路径下，命中时复制到用户工作区）、容量上限（字节，0 为关闭）
+RENDER_CACHE_DIR = ".render_cache"
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# 素材类 MCP（Pixabay/Pexels/Poly Haven/Lordicon）共享 HTTP 层：连接池上限、响应缓存有效期（秒，0 为关闭）/ 进程内条目数、
+# API key 被限流且服务商未给出重置时间时的默认冷却时长（秒）
+MCP_HTTP_MAX_CONNECTIONS = int(os.getenv("MCP_HTTP_MAX_CONNECTIONS", "50"))
+MCP_HTTP_CACHE_TTL = int(os.getenv("MCP_HTTP_CACHE_TTL", "1800"))
+MCP_HTTP_CACHE_SIZE = int(os.getenv("MCP_HTTP_CACHE_SIZE", "512"))
+MCP_HTTP_RATE_LIMIT_COOLDOWN = int(os.getenv("MCP_HTTP_RATE_LIMIT_COOLDOWN", "60"))
 
 # 定时任务调度配置
 TASK_TIMEZONE = os.getenv("TASK_TIMEZONE", "Asia/Shanghai")
 TASK_DISPATCH_BASE_URL = os.getenv("TASK_DISPATCH_BASE_URL", "http://127.0.0.1:8001")
 TASK_CRON_MIN_INTERVAL_SECONDS = int(os.getenv("TASK_CRON_MIN_INTERVAL_SECONDS", "1800"))
+# 任务派发方式：local 为进程内直接入队聊天处理流程，http 为调用 TASK_DISPATCH_BASE_URL（远程执行节点）
+TASK_DISPATCH_MODE = os.getenv("TASK_DISPATCH_MODE", "local").lower()
+# 进程内派发：同时执行的任务数上限、单个任务等待 AI 回复完成的最长时间（秒，超时后释放名额，回复继续在后台处理）
+TASK_DISPATCH_CONCURRENCY = int(os.getenv("TASK_DISPATCH_CONCURRENCY", "4"))
+TASK_DISPATCH_WAIT_TIMEOUT = int(os.getenv("TASK_DISPATCH_WAIT_TIMEOUT", "600"))
+# 多节点调度：选主/同步调度/领取到期任务的轮询间隔（秒）、集群停机超过该秒数期间错过的触发不再补跑、
+# running 状态的租约时长（秒，执行节点每个轮询间隔续租一次；节点异常退出、超过该时长未续租的任务由主节点回收）
+TASK_SCHEDULER_POLL_INTERVAL = int(os.getenv("TASK_SCHEDULER_POLL_INTERVAL", "15"))
+TASK_MISFIRE_GRACE_SECONDS = int(os.getenv("TASK_MISFIRE_GRACE_SECONDS", "300"))
+TASK_RUN_LEASE_SECONDS = int(os.getenv("TASK_RUN_LEASE_SECONDS", "1800"))
+# 派发削峰：cron 任务随机延后的最大秒数（0 为关闭）、单用户同时执行的任务数上限
+TASK_DISPATCH_JITTER_SECONDS = int(os.getenv("TASK_DISPATCH_JITTER_SECONDS", "120"))
+TASK_DISPATCH_PER_USER_LIMIT = int(os.getenv("TASK_DISPATCH_PER_USER_LIMIT", "1"))
+# agent 客户端数达到该值时延后优先级低于 TASK_DEFER_PRIORITY_BELOW 的任务（0 为关闭），
+# 每 TASK_DEFER_RETRY_SECONDS 秒重试，最长延后 TASK_DEFER_MAX_SECONDS 秒后照常执行
+TASK_DEFER_AGENT_CLIENTS = int(os.getenv("TASK_DEFER_AGENT_CLIENTS", "0"))
+TASK_DEFER_PRIORITY_BELOW = int(os.getenv("TASK_DEFER_PRIORITY_BELOW", "1"))
+TASK_DEFER_RETRY_SECONDS = int(os.getenv("TASK_DEFER_RETRY_SECONDS", "30"))
+TASK_DEFER_MAX_SECONDS = int(os.getenv("TASK_DEFER_MAX_SECONDS", "600"))
+# 用户/智能体可设置的任务优先级范围（超出时截断）；默认上限 0，只能调低自己任务的优先级，
+# 不能插队到其他用户之前或绕过延后（上限应小于 TASK_DEFER_PRIORITY_BELOW）
+TASK_PRIORITY_MIN = int(os.getenv("TASK_PRIORITY_MIN", "-5"))
+TASK_PRIORITY_MAX = int(os.getenv("TASK_PRIORITY_MAX", "0"))
+# 任务执行状态批量写回的合并窗口（秒）
+TASK_STATE_FLUSH_INTERVAL = float(os.getenv("TASK_STATE_FLUSH_INTERVAL", "1"))
 
 # SMTP 邮件发送配置（QQ/163/网易）
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.163.com")
@@ -163,6 +211,14 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "true").lower() in ("true", "1", "yes")
 SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "false").lower() in ("true", "1", "yes")
 SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "queenbee")
+# SMTP 发送队列：复用的已登录连接数（同时也是并发发送数）、空闲连接保留时长（秒）、
+# 最大尝试次数、重试退避基数/上限（秒）、工具调用等待发送结果的最长时间（秒，超时后继续在后台重试）
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+SMTP_MAX_ATTEMPTS = int(os.getenv("SMTP_MAX_ATTEMPTS", "3"))
+SMTP_RETRY_BACKOFF_BASE = int(os.getenv("SMTP_RETRY_BACKOFF_BASE", "5"))
+SMTP_RETRY_BACKOFF_MAX = int(os.getenv("SMTP_RETRY_BACKOFF_MAX", "120"))
+SMTP_SEND_WAIT_TIMEOUT = int(os.getenv("SMTP_SEND_WAIT_TIMEOUT", "60"))
 
 # 全局 MCP 服务器配置（stdio/http 类型）
 # 注意：SDK MCP 服务器在 agent_manager.py 中配置
@@ -188,6 +244,9 @@ GLOBAL_MCP_SERVERS = {
 # MCP 工具白名单（允许的 MCP 工具名称列表）
 MCP_ALLOWED_TOOLS: List[str] = []
 
+# 用户 MCP 配置缓存有效期（秒）：安装/删除 MCP 时立即失效，有效期用于多进程部署下的兜底
+MCP_USER_CONFIG_CACHE_TTL = int(os.getenv('MCP_USER_CONFIG_CACHE_TTL', '600'))
+
 # ==================== 技能配置 ====================
 
 # 默认技能分类
@@ -279,6 +338,19 @@ FREE_TRIAL_DAYS = int(os.getenv('FREE_TRIAL_DAYS', '7'))  # 免费试用天数
 # 非会员限制配置
 NON_MEMBER_LIMIT_HOURS = int(os.getenv('NON_MEMBER_LIMIT_HOURS', '5'))  # 时间窗口（小时）
 NON_MEMBER_LIMIT_MAX = int(os.getenv('NON_MEMBER_LIMIT_MAX', '10'))  # 最大次数
+QUOTA_WRITE_BACK_DELAY = float(os.getenv('QUOTA_WRITE_BACK_DELAY', '5'))  # Redis 计数回写配额表的合并间隔（秒）
+
+# 会员状态缓存：Redis 共享缓存有效期、进程内缓存有效期（秒，均不超过会员到期时间；0 为关闭）
+MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL', '600'))
+MEMBERSHIP_LOCAL_CACHE_TTL = int(os.getenv('MEMBERSHIP_LOCAL_CACHE_TTL', '10'))
+
+# 模型 API Key 路由：选择策略（least_loaded / round_robin / weighted）、全量刷新间隔（秒）、
+# 连续多少次鉴权/额度/服务商错误后暂停使用、暂停时长（秒，冷却后放回试用，再次失败时翻倍，不超过上限）
+API_KEY_ROUTER_STRATEGY = os.getenv('API_KEY_ROUTER_STRATEGY', 'least_loaded')
+API_KEY_ROUTER_REFRESH_INTERVAL = int(os.getenv('API_KEY_ROUTER_REFRESH_INTERVAL', '60'))
+API_KEY_FAILURE_THRESHOLD = int(os.getenv('API_KEY_FAILURE_THRESHOLD', '3'))
+API_KEY_COOLDOWN_SECONDS = int(os.getenv('API_KEY_COOLDOWN_SECONDS', '60'))
+API_KEY_COOLDOWN_MAX_SECONDS = int(os.getenv('API_KEY_COOLDOWN_MAX_SECONDS', '900'))
 
 # AI助手创建限制
 MAX_AI_ASSISTANTS_NON_MEMBER = int(os.getenv('MAX_AI_ASSISTANTS_NON_MEMBER', '0'))  # 非会员最大AI助手数
@@ -294,6 +366,22 @@ USER_PORT_ALLOWLIST = {
     if port.strip().isdigit()
 }
 
+# 用户服务代理（/agent/{slug}）：连接池大小、超时（秒）、单用户并发上限及排队等待时间（秒）
+AGENT_PROXY_MAX_CONNECTIONS = int(os.getenv('AGENT_PROXY_MAX_CONNECTIONS', '200'))
+AGENT_PROXY_MAX_KEEPALIVE = int(os.getenv('AGENT_PROXY_MAX_KEEPALIVE', '50'))
+AGENT_PROXY_CONNECT_TIMEOUT = float(os.getenv('AGENT_PROXY_CONNECT_TIMEOUT', '5'))
+AGENT_PROXY_READ_TIMEOUT = float(os.getenv('AGENT_PROXY_READ_TIMEOUT', '300'))
+AGENT_PROXY_USER_CONCURRENCY = int(os.getenv('AGENT_PROXY_USER_CONCURRENCY', '16'))
+AGENT_PROXY_QUEUE_TIMEOUT = float(os.getenv('AGENT_PROXY_QUEUE_TIMEOUT', '10'))
+# 静态页面分享（/html-page）：智能体归属缓存 TTL（秒）、Cache-Control、小文件内存缓存阈值与总容量（字节）
+HTML_PAGE_OWNER_CACHE_TTL = int(os.getenv('HTML_PAGE_OWNER_CACHE_TTL', '600'))
+HTML_PAGE_CACHE_CONTROL = os.getenv('HTML_PAGE_CACHE_CONTROL', 'public, max-age=60')
+HTML_PAGE_HOT_FILE_MAX_BYTES = int(os.getenv('HTML_PAGE_HOT_FILE_MAX_BYTES', str(256 * 1024)))
+HTML_PAGE_HOT_CACHE_MAX_BYTES = int(os.getenv('HTML_PAGE_HOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# WebSocket 隧道：单用户（端口段）最大连接数、空闲超时（秒）
+AGENT_PROXY_WS_MAX_PER_USER = int(os.getenv('AGENT_PROXY_WS_MAX_PER_USER', '20'))
+AGENT_PROXY_WS_IDLE_TIMEOUT = float(os.getenv('AGENT_PROXY_WS_IDLE_TIMEOUT', '600'))
+
 # 用户默认存储配额（字节）
 USER_DEFAULT_STORAGE_QUOTA_BYTES = int(os.getenv('USER_DEFAULT_STORAGE_QUOTA_BYTES', str(1024 * 1024 * 1024)))
 
@@ -307,6 +395,31 @@ BIGMODEL_EMBEDDING_MODEL = os.getenv('BIGMODEL_EMBEDDING_MODEL', 'embedding-3')
 BIGMODEL_EMBEDDING_DIMENSIONS = int(os.getenv('BIGMODEL_EMBEDDING_DIMENSIONS', '512'))
 KB_USE_VECTOR = os.getenv('KB_USE_VECTOR', 'true').lower() in ('true', '1', 'yes')
 KB_PUBLIC_PASSWORD = os.getenv('KB_PUBLIC_PASSWORD', '844700')
+# 检索：每路候选数（用户向量 / 公开向量 / 关键词各取一路后合并重排）、HNSW ef_search
+KB_RETRIEVAL_CANDIDATES = int(os.getenv('KB_RETRIEVAL_CANDIDATES', '40'))
+KB_HNSW_EF_SEARCH = int(os.getenv('KB_HNSW_EF_SEARCH', '80'))
+# 过滤条件下的迭代索引扫描（pgvector >= 0.8：relaxed_order / strict_order；为空则不设置，旧版本自动跳过）
+KB_HNSW_ITERATIVE_SCAN = os.getenv('KB_HNSW_ITERATIVE_SCAN', 'relaxed_order')
+# 用户记忆条数不超过该值时，用户一路按 user_id 索引精确计算距离，不走全局 HNSW 索引
+KB_EXACT_SCAN_MAX_ROWS = int(os.getenv('KB_EXACT_SCAN_MAX_ROWS', '2000'))
+# 检索结果缓存：有效期（秒，0 为关闭）/ 最大条目数；记忆增删改时按用户失效
+KB_RETRIEVAL_CACHE_TTL = int(os.getenv('KB_RETRIEVAL_CACHE_TTL', '60'))
+KB_RETRIEVAL_CACHE_SIZE = int(os.getenv('KB_RETRIEVAL_CACHE_SIZE', '1024'))
+# 聊天时知识库检索的耗时预算（秒），超时则本轮不附带知识库片段
+KB_CONTEXT_TIMEOUT = float(os.getenv('KB_CONTEXT_TIMEOUT', '2.0'))
+# 导出未处理聊天记录时服务端游标每批拉取的行数
+KB_DUMP_FETCH_SIZE = int(os.getenv('KB_DUMP_FETCH_SIZE', '1000'))
+# 向量缓存：进程内 LRU 条目数 / Redis 过期时间（秒）
+KB_EMBEDDING_CACHE_SIZE = int(os.getenv('KB_EMBEDDING_CACHE_SIZE', '2048'))
+KB_EMBEDDING_CACHE_TTL = int(os.getenv('KB_EMBEDDING_CACHE_TTL', str(7 * 24 * 3600)))
+# 批量向量化：单次请求最多文本数 / 并发请求数
+KB_EMBEDDING_BATCH_SIZE = int(os.getenv('KB_EMBEDDING_BATCH_SIZE', '32'))
+KB_EMBEDDING_BATCH_CONCURRENCY = int(os.getenv('KB_EMBEDDING_BATCH_CONCURRENCY', '4'))
+# 后台向量化队列：空闲轮询间隔（秒）、最大重试次数、重试退避基数/上限（秒）
+KB_EMBEDDING_QUEUE_POLL_INTERVAL = int(os.getenv('KB_EMBEDDING_QUEUE_POLL_INTERVAL', '10'))
+KB_EMBEDDING_QUEUE_MAX_ATTEMPTS = int(os.getenv('KB_EMBEDDING_QUEUE_MAX_ATTEMPTS', '8'))
+KB_EMBEDDING_QUEUE_BACKOFF_BASE = int(os.getenv('KB_EMBEDDING_QUEUE_BACKOFF_BASE', '15'))
+KB_EMBEDDING_QUEUE_BACKOFF_MAX = int(os.getenv('KB_EMBEDDING_QUEUE_BACKOFF_MAX', '3600'))
 
 # 日志目录
 LOG_DIR = os.getenv('LOG_DIR', '/home/ai/log')
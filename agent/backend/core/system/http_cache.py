@@ -0,0 +1,93 @@
+"""
+HTTP 条件请求工具
+基于文件 mtime + size 生成 ETag / Last-Modified，处理 If-None-Match / If-Modified-Since，
+命中时直接返回 304；未命中时返回 FileResponse（由 Starlette 负责 Range 分段传输）。
+"""
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# 工作区文件随时可能被智能体修改，默认每次都回源校验（命中时只需 304）
+DEFAULT_CACHE_CONTROL = "private, no-cache"
+
+
+def build_etag(stat_res: os.stat_result, variant: str = "") -> str:
+    """根据文件 mtime + size（以及可选的变体标识）生成强 ETag"""
+    etag = f"{stat_res.st_size:x}-{stat_res.st_mtime_ns:x}"
+    if variant:
+        etag = f"{etag}-{variant}"
+    return f'"{etag}"'
+
+
+def build_cache_headers(stat_res: os.stat_result, variant: str = "", cache_control: str = DEFAULT_CACHE_CONTROL) -> Dict[str, str]:
+    """生成缓存校验相关的响应头"""
+    return {
+        "ETag": build_etag(stat_res, variant),
+        "Last-Modified": formatdate(stat_res.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+
+def is_not_modified(request: Request, stat_res: os.stat_result, variant: str = "") -> bool:
+    """
+    判断客户端缓存是否仍然有效
+
+    If-None-Match 优先于 If-Modified-Since（RFC 9110）
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = build_etag(stat_res, variant)
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_res.st_mtime) <= int(since)
+
+    return False
+
+
+def not_modified_response(stat_res: os.stat_result, variant: str = "", cache_control: str = DEFAULT_CACHE_CONTROL) -> Response:
+    """构造 304 响应"""
+    return Response(status_code=304, headers=build_cache_headers(stat_res, variant, cache_control))
+
+
+def conditional_file_response(
+    request: Request,
+    path: Path,
+    media_type: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+) -> Response:
+    """
+    返回支持条件请求与 Range 的文件响应
+
+    Args:
+        request: 当前请求
+        path: 文件路径
+        media_type: 响应类型
+        headers: 额外响应头（如 Content-Disposition）
+        cache_control: Cache-Control 取值
+    """
+    stat_res = path.stat()
+    if is_not_modified(request, stat_res):
+        return not_modified_response(stat_res, cache_control=cache_control)
+
+    merged = build_cache_headers(stat_res, cache_control=cache_control)
+    if headers:
+        merged.update(headers)
+    return FileResponse(
+        path=str(path),
+        media_type=media_type,
+        filename=None,
+        headers=merged,
+        stat_result=stat_res,
+    )
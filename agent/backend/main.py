@@ -30,6 +30,7 @@ setup_logging()
 from agent.backend.core.db.init_db import check_and_init
 from agent.backend.core.agent.agent_manager import get_user_work_base_dir
 from agent.backend.core.scheduler import background_tasks
+from agent.backend.core.mcp.mail_sender import get_mail_metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -50,6 +51,22 @@ async def lifespan(app: FastAPI):
     await background_tasks.stop_background_tasks()
     print("后台任务已停止")
 
+    # 关闭代理连接池
+    from agent.backend.core.agent.agent_proxy_api import close_proxy_client
+    await close_proxy_client()
+
+    # 关闭向量化连接池
+    from agent.backend.core.kbs.embedding import close_embedding_client
+    await close_embedding_client()
+
+    # 关闭素材类 MCP 连接池
+    from agent.backend.core.mcp.mcp_http import close_mcp_http_client
+    await close_mcp_http_client()
+
+    # 停止邮件发送队列并关闭 SMTP 连接
+    from agent.backend.core.mcp.mail_sender import close_mail_sender
+    await close_mail_sender()
+
     # 关闭数据库连接池
     from agent.backend.core.db.dbutil import DatabaseUtil
     print("正在关闭数据库连接池...")
@@ -248,7 +265,8 @@ async def health_check():
         "status": "healthy",
         "database": "connected",
         "service": "queen_bee_api",
-        "background_tasks": background_tasks.get_background_tasks_status()
+        "background_tasks": background_tasks.get_background_tasks_status(),
+        "mail": get_mail_metrics(),
     }
 
 if __name__ == "__main__":
@@ -425,6 +425,17 @@ async function downloadSessionFile(userId, sessionId, path, extraParams = {}) {
     return { url, filename, blob, contentType };
 }
 
+/**
+ * 获取图片缩略图地址（token 鉴权，可直接用于 <img src>）
+ */
+function getSessionThumbnailUrl(sessionId, path, width) {
+    const token = getToken();
+    if (!token || !sessionId || !path) return null;
+    const params = new URLSearchParams({ path, token });
+    if (width) params.set('w', String(width));
+    return `/api/v1/chat/sessions/${sessionId}/thumbnail?${params.toString()}`;
+}
+
 /**
  * 预览Office文件（服务端转换为PDF）
  */
@@ -719,6 +730,7 @@ window.API = {
     usePromptTemplate,
     clearAllSessionFiles,
     downloadSessionFile,
+    getSessionThumbnailUrl,
     previewSessionFile,
     getOfficePreviewSettings,
     uploadSessionFiles,
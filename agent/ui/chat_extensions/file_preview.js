@@ -12,6 +12,9 @@
   var PREVIEW_MARKER = "preview-file:";
   var IMAGE_EXTS = { ".png": true, ".jpg": true, ".jpeg": true, ".svg": true };
   var HTML_EXTS = { ".html": true, ".htm": true };
+  // 聊天卡片中的位图使用服务端缩略图，点击“打开”再查看原图
+  var THUMB_EXTS = { ".png": true, ".jpg": true, ".jpeg": true };
+  var THUMB_WIDTH = 640;
 
   function getSessionId() {
     var container = document.getElementById("chatMessages");
@@ -57,6 +60,17 @@
     return getPublicBaseUrl() + "/html-page/" + encodeURIComponent(agentId) + "/" + encodePath(path);
   }
 
+  function buildThumbnailUrl(path) {
+    var sessionId = getSessionId();
+    var token = getToken();
+    if (!sessionId || !token || !path || !THUMB_EXTS[getExtension(path)]) return null;
+    var dpr = window.devicePixelRatio && window.devicePixelRatio > 1 ? 2 : 1;
+    var query = "path=" + encodeURIComponent(path.replace(/^\/+/, "")) +
+      "&token=" + encodeURIComponent(token) +
+      "&w=" + THUMB_WIDTH * dpr;
+    return "/api/v1/chat/sessions/" + encodeURIComponent(sessionId) + "/thumbnail?" + query;
+  }
+
   function buildCard(path, url, isHtml) {
     var card = document.createElement("div");
     card.className = "chat-file-preview-card";
@@ -91,9 +105,17 @@
         body.appendChild(frame);
       } else {
         var img = document.createElement("img");
-        img.src = url;
+        var thumbUrl = buildThumbnailUrl(path);
+        img.src = thumbUrl || url;
         img.alt = path;
         img.loading = "lazy";
+        img.decoding = "async";
+        if (thumbUrl) {
+          img.onerror = function () {
+            img.onerror = null;
+            img.src = url;
+          };
+        }
         body.appendChild(img);
       }
     } else {